@@ -1,27 +1,39 @@
-from collections import defaultdict
+from collections import defaultdict, deque
+from collections.abc import Mapping
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from copy import deepcopy
 from html import unescape
+from json import dumps as json_dumps, loads as json_loads
 from logging import getLogger, Formatter, WARNING, INFO
 from logging.handlers import RotatingFileHandler
 from os.path import dirname, abspath
 from urllib.parse import parse_qs, urlparse, unquote
-from wsgiref.headers import Headers
 
 from requests import ConnectionError as RequestsConnectionError, \
-    JSONDecodeError
+    JSONDecodeError, Timeout
 
+import config
 from config import LANG
+from lib.breaker import breaker_stats
+from lib.cache import Cache, MISSING, SingleFlight
 from lib.ketabir import url_to_dict as ketabir_url_to_dict
 from lib.commons import uninum2en, scr_to_json, ISBN_10OR13_SEARCH, \
-    dict_to_sfn_cit_ref, ReturnError
-from lib.doi import doi_to_dict, DOI_SEARCH
-from lib.googlebooks import url_to_dict as google_books_dict
-from lib.isbn_oclc import IsbnError, isbn_to_dict, oclc_dict
+    dict_to_sfn_cit_ref, ReturnError, upstream_stats, deadline, fetch_memo
+from lib.doi import doi_to_dict, get_crossref_dicts, DOI_SEARCH, \
+    CROSSREF_CACHE
+from lib.googlebooks import url_to_dict as google_books_dict, \
+    VOLUME_CACHE, VOLUME_IN_FLIGHT
+from lib.isbn_oclc import IsbnError, isbn_to_dict, oclc_dict, \
+    canonical_isbn, BOOK_CACHE, BOOK_NOT_FOUND_CACHE, BOOK_IN_FLIGHT
 from lib.jstor import url_to_dict as jstor_url_to_dict
+from lib.language import classify
 from lib.noorlib import url_to_dict as noorlib_url_to_dict
 from lib.noormags import url_to_dict as noormags_url_to_dict
 from lib.pubmed import pmcid_dict, pmid_dict
-from lib.urls import url_to_dict as urls_url_to_dict
-from lib.waybackmachine import url_to_dict as archive_url_to_dict
+from lib.urls import url_to_dict as urls_url_to_dict, HOME_CACHE, \
+    LANGUAGE_CACHE
+from lib.waybackmachine import url_to_dict as archive_url_to_dict, \
+    CDX_CACHE
 if LANG == 'en':
     from lib.html.en import (
         DEFAULT_SCR,
@@ -73,7 +85,29 @@ TLDLESS_NETLOC_RESOLVER = {
     'jstor': jstor_url_to_dict,
 }.get
 
-RESPONSE_HEADERS = Headers([('Content-Type', 'text/html; charset=UTF-8')])
+HTML_CONTENT_TYPE = ('Content-Type', 'text/html; charset=UTF-8')
+
+# Resolved dictionaries keyed on normalized inputs, e.g. 'doi:10.1000/1'.
+# date_format and access-date are applied on each request.
+RESULT_CACHE = Cache(
+    'results',
+    maxsize=getattr(config, 'RESULT_CACHE_SIZE', 1000),
+    ttl=getattr(config, 'RESULT_CACHE_TTL', 3600),
+)
+# Concurrent requests for the same key share one resolver call.
+IN_FLIGHT = SingleFlight('results')
+
+# Number of threads used for resolving the inputs of each batch request.
+BATCH_WORKERS = getattr(config, 'BATCH_WORKERS', 16)
+# Maximum number of concurrent lookups per upstream service in a batch.
+BATCH_UPSTREAM_LIMIT = getattr(config, 'BATCH_UPSTREAM_LIMIT', 4)
+BATCH_MAX_ITEMS = getattr(config, 'BATCH_MAX_ITEMS', 5000)
+BATCH_HEADERS = [('Content-Type', 'application/x-ndjson; charset=UTF-8')]
+JSON_CONTENT_TYPE = ('Content-Type', 'application/json; charset=UTF-8')
+
+# Seconds that the upstream requests of each input may take in total. The
+# timeout of each request is shortened to the time that remains.
+REQUEST_BUDGET = getattr(config, 'REQUEST_BUDGET', 20)
 
 
 getLogger('requests').setLevel(WARNING)
@@ -101,115 +135,362 @@ def get_root_logger():
 LOGGER = get_root_logger()
 
 
+def resolve_and_cache(key: str, to_dict: callable, args: tuple) -> dict:
+    return cache_result(key, to_dict(*args))
+
+
+def cache_result(key: str, d: dict) -> dict:
+    # Partial results were built while an upstream was failing or skipped by
+    # its circuit breaker. They are resolved again on the next request.
+    if isinstance(d, Mapping) and not d.get('partial'):
+        RESULT_CACHE.set(key, d)
+    return d
+
+
+def cached(key: str, to_dict: callable, *args) -> dict:
+    """Return to_dict(*args) using RESULT_CACHE and IN_FLIGHT.
+
+    The last argument must be date_format. It is not a part of the key and
+    is set on the returned dictionary. A fresh copy is returned on each call
+    since generating the citation modifies the dictionary.
+    """
+    if (d := RESULT_CACHE.get(key)) is MISSING:
+        d = IN_FLIGHT.do(key, resolve_and_cache, key, to_dict, args)
+    return result_copy(d, args[-1])
+
+
+def result_copy(d: dict, date_format: str) -> dict:
+    if not isinstance(d, Mapping):
+        return d
+    d = deepcopy(d)
+    d['date_format'] = date_format
+    return d
+
+
 def input_to_dict(user_input, date_format, /) -> dict:
     en_user_input = unquote(uninum2en(user_input))
     # Checking the user input for dot is important because
     # the use of dotless domains is prohibited.
     # See: https://features.icann.org/dotless-domains
     if '.' in en_user_input:
-        # Try predefined URLs
-        # Todo: The following code could be done in threads.
-        if not (url_input := user_input.startswith('http')):
-            url = 'http://' + user_input
-        else:
-            url = user_input
-        parsed_url = urlparse(url)
-        # TLD stands for top-level domain
-        tldless_netloc = parsed_url[1].rpartition('.')[0]
-        # todo: make lazy?
-        if (to_dict := TLDLESS_NETLOC_RESOLVER(
-            tldless_netloc[4:] if tldless_netloc.startswith('www.')
-            else tldless_netloc
-        )) is not None:
+        url, url_input, parsed_url, to_dict = url_resolver(user_input)
+        if to_dict is not None:
+            key = 'url:' + url
             if to_dict is google_books_dict:
-                return to_dict(parsed_url, date_format)
+                return cached(key, to_dict, parsed_url, date_format)
             elif to_dict is google_encrypted_dict:
-                return to_dict(url, parsed_url, date_format)
-            return to_dict(url, date_format)
+                return cached(key, to_dict, url, parsed_url, date_format)
+            return cached(key, to_dict, url, date_format)
 
         # DOIs contain dots
         if (m := DOI_SEARCH(unescape(en_user_input))) is not None:
             try:
-                return doi_to_dict(m[0], True, date_format)
+                # DOIs are case-insensitive
+                return cached(
+                    'doi:' + m[0].lower(), doi_to_dict, m[0], True,
+                    date_format)
             except JSONDecodeError:
                 if url_input is False:
                     raise
                 # continue with urls_scr
 
-        return urls_url_to_dict(url, date_format)
+        return cached('url:' + url, urls_url_to_dict, url, date_format)
     else:
         # We can check user inputs containing dots for ISBNs, but probably is
         # error-prone.
         if (m := ISBN_10OR13_SEARCH(en_user_input)) is not None:
             try:
-                return isbn_to_dict(m[0], True, date_format)
+                return cached(
+                    f'isbn:{canonical_isbn(m[0])}', isbn_to_dict, m[0], True,
+                    date_format)
             except IsbnError:
                 pass
         return UNDEFINED_INPUT_SCR
 
 
+def url_resolver(user_input: str) -> tuple:
+    """Return (url, url_input, parsed_url, to_dict) of a dotted user_input.
+
+    url_input is whether user_input starts with http. to_dict is the value
+    of TLDLESS_NETLOC_RESOLVER for the URL or None.
+    """
+    # Try predefined URLs
+    if not (url_input := user_input.startswith('http')):
+        url = 'http://' + user_input
+    else:
+        url = user_input
+    parsed_url = urlparse(url)
+    # TLD stands for top-level domain
+    tldless_netloc = parsed_url[1].rpartition('.')[0]
+    return url, url_input, parsed_url, TLDLESS_NETLOC_RESOLVER(
+        tldless_netloc[4:] if tldless_netloc.startswith('www.')
+        else tldless_netloc)
+
+
+def warm_up() -> None:
+    """Load the modules and the langid model that are loaded on first use.
+
+    Pre-forking servers should call this before forking so that the workers
+    share them and the first requests are not delayed.
+    """
+    from bs4 import BeautifulSoup
+    BeautifulSoup('', features='lxml')
+    classify('warm up')
+
+
 def app(environ: dict, start_response: callable) -> tuple:
     path_info = environ['PATH_INFO']
+    if path_info[-6:] == '/batch':
+        return batch_app(environ, start_response)
+    if path_info[-7:] == '/status':
+        response_body = status_json()
+        start_response('200 OK', [
+            JSON_CONTENT_TYPE, ('Content-Length', str(len(response_body)))])
+        return response_body,
     if '/static/' in path_info:
-        if path_info[-4:] == '.css':
-            start_response('200 OK', CSS_HEADERS)
-            return CSS,
-        else:
-            # path_info.endswith('.js') and config.lang == 'en'
-            start_response('200 OK', JS_HEADERS)
-            return JS,
-
-    query_dict_get = parse_qs(environ['QUERY_STRING']).get
-    date_format = query_dict_get('dateformat', [''])[0].strip()
-    input_type = query_dict_get('input_type', [''])[0]
+        headers, response_body = static_file(path_info)
+        start_response('200 OK', headers)
+        return response_body,
+    status, response_body = page(environ['QUERY_STRING'])
+    start_response(status, [
+        HTML_CONTENT_TYPE, ('Content-Length', str(len(response_body)))])
+    return response_body,
 
-    # Warning: input is not escaped!
-    if not (user_input := query_dict_get('user_input', [''])[0].strip()):
-        response_body = scr_to_html(
+
+def static_file(path_info: str) -> tuple:
+    """Return (headers, body) of the static file at path_info."""
+    if path_info[-4:] == '.css':
+        return CSS_HEADERS, CSS
+    # path_info.endswith('.js') and config.lang == 'en'
+    return JS_HEADERS, JS
+
+
+def status_json() -> bytes:
+    """Return the state of upstream hosts, caches and in-flight lookups."""
+    return json_dumps({
+        'breakers': breaker_stats(),
+        'upstreams': upstream_stats(),
+        'caches': {c.name: c.stats() for c in (
+            RESULT_CACHE, HOME_CACHE, LANGUAGE_CACHE, CROSSREF_CACHE,
+            BOOK_CACHE, BOOK_NOT_FOUND_CACHE, VOLUME_CACHE, CDX_CACHE)},
+        'in_flight': {f.name: f.stats() for f in (
+            IN_FLIGHT, BOOK_IN_FLIGHT, VOLUME_IN_FLIGHT)},
+    }).encode()
+
+
+def page(query_string: str) -> tuple:
+    """Return (status, response_body) of the main page or the API."""
+    user_input, input_type, date_format, output_format = page_query(
+        query_string)
+    if not user_input:
+        return '200 OK', scr_to_html(
             DEFAULT_SCR, date_format, input_type
         ).encode()
-        RESPONSE_HEADERS['Content-Length'] = str(len(response_body))
-        start_response('200 OK', RESPONSE_HEADERS.items())
-        return response_body,
+    status, scr = input_to_scr(user_input, input_type, date_format)
+    return status, page_body(scr, output_format, date_format, input_type)
+
+
+def page_query(query_string: str) -> tuple:
+    """Return (user_input, input_type, date_format, output_format)."""
+    query_dict_get = parse_qs(query_string).get
+    # Warning: input is not escaped!
+    return (
+        query_dict_get('user_input', [''])[0].strip(),
+        query_dict_get('input_type', [''])[0],
+        query_dict_get('dateformat', [''])[0].strip(),
+        query_dict_get('output_format', [''])[0],  # apiquery
+    )
+
+
+def page_body(
+    scr: tuple, output_format: str, date_format: str, input_type: str
+) -> bytes:
+    if output_format == 'json':
+        response_body = scr_to_json(scr)
+    else:
+        response_body = scr_to_html(scr, date_format, input_type)
+    return response_body.encode()
 
-    output_format = query_dict_get('output_format', [''])[0]  # apiquery
 
+def input_to_scr(user_input: str, input_type: str, date_format: str) -> tuple:
+    """Return (status, (sfn, cit, ref)) for the given user_input."""
     to_dict = input_type_to_resolver[input_type]
     # noinspection PyBroadException
     try:
-        d = to_dict(user_input, date_format)
-    except RequestsConnectionError:
-        status = '500 ConnectionError'
-        LOGGER.exception(user_input)
-        if output_format == 'json':
-            response_body = scr_to_json(HTTPERROR_SCR)
-        else:
-            response_body = scr_to_html(
-                HTTPERROR_SCR, date_format, input_type)
+        with deadline(REQUEST_BUDGET), fetch_memo():
+            if to_dict is input_to_dict:
+                d = to_dict(user_input, date_format)
+            else:
+                d = cached(
+                    f'{input_type}:{uninum2en(user_input)}', to_dict,
+                    user_input, date_format)
     except Exception as e:
-        status = '500 Internal Server Error'
-
-        if isinstance(e, ReturnError):
-            scr = e.args
-        else:
-            LOGGER.exception(user_input)
-            scr = OTHER_EXCEPTION_SCR
-
-        if output_format == 'json':
-            response_body = scr_to_json(scr)
-        else:
-            response_body = scr_to_html(scr, date_format, input_type)
+        return error_scr(e, user_input)
+    return '200 OK', dict_to_sfn_cit_ref(d)
+
+
+def error_scr(e: Exception, user_input: str) -> tuple:
+    """Return (status, scr) of the error raised while resolving user_input.
+
+    Call it in the except clause so that the traceback is logged.
+    """
+    if isinstance(e, RequestsConnectionError):
+        LOGGER.exception(user_input)
+        return '500 ConnectionError', HTTPERROR_SCR
+    if isinstance(e, Timeout):
+        LOGGER.exception(user_input)
+        return '504 Gateway Timeout', HTTPERROR_SCR
+    if isinstance(e, ReturnError):
+        scr = e.args
     else:
-        status = '200 OK'
-        scr = dict_to_sfn_cit_ref(d)
-        if output_format == 'json':
-            response_body = scr_to_json(scr)
-        else:
-            response_body = scr_to_html(scr, date_format, input_type)
-    response_body = response_body.encode()
-    RESPONSE_HEADERS['Content-Length'] = str(len(response_body))
-    start_response(status, RESPONSE_HEADERS.items())
-    return response_body,
+        LOGGER.exception(user_input)
+        scr = OTHER_EXCEPTION_SCR
+    return '500 Internal Server Error', scr
+
+
+def parse_batch(body: str, input_type: str, date_format: str) -> list:
+    """Return a list of (user_input, input_type, date_format) tuples.
+
+    body is either a JSON array or newline-delimited inputs. Each item can
+    be an input string or an object with a user_input and optional
+    input_type and dateformat keys, defaulting to the given values.
+    Raise ValueError if body is invalid.
+    """
+    if body.lstrip()[:1] == '[':
+        items = json_loads(body)
+        if not isinstance(items, list):
+            raise ValueError('expected a JSON array')
+    else:
+        items = [
+            json_loads(line) if line[0] == '{' else line
+            for line in map(str.strip, body.splitlines()) if line]
+    if len(items) > BATCH_MAX_ITEMS:
+        raise ValueError(f'too many inputs: {len(items)} > {BATCH_MAX_ITEMS}')
+    result = []
+    append = result.append
+    for item in items:
+        if isinstance(item, str):
+            append((item.strip(), input_type, date_format))
+            continue
+        if not isinstance(item, dict) or not all(
+            isinstance(v, str) for v in item.values()
+        ) or 'user_input' not in item:
+            raise ValueError(f'invalid batch item: {item!r}')
+        append((
+            item['user_input'].strip(),
+            item.get('input_type', input_type),
+            item.get('dateformat', date_format).strip()))
+    return result
+
+
+def upstream_of(user_input: str, input_type: str) -> str:
+    """Return the name of the service that will be used to resolve input."""
+    if input_type in ('pmid', 'pmcid', 'oclc'):
+        return input_type
+    en_user_input = unquote(uninum2en(user_input))
+    if '.' not in en_user_input:
+        return 'isbn'
+    if DOI_SEARCH(unescape(en_user_input)) is not None:
+        return 'doi'
+    if not user_input.startswith('http'):
+        user_input = 'http://' + user_input
+    return urlparse(user_input).hostname or ''
+
+
+def batch_line(index: int, item: tuple) -> str:
+    """Resolve item and return its JSON line."""
+    if not (user_input := item[0]):
+        return scr_to_json(UNDEFINED_INPUT_SCR, index=index, user_input='')
+    # noinspection PyBroadException
+    try:
+        scr = input_to_scr(*item)[1]
+    except Exception:  # do not break the other lines of the response
+        LOGGER.exception(user_input)
+        scr = OTHER_EXCEPTION_SCR
+    return scr_to_json(scr, index=index, user_input=user_input)
+
+
+def prefetch_dois(items: list) -> None:
+    """Look up the DOIs of items in bulk to fill the crossref cache.
+
+    Only the works API of Crossref is queried. The DOIs that it does not
+    find are left to the concurrent resolvers of the items.
+    """
+    if len(dois := batch_dois(items)) > 1:
+        with deadline(REQUEST_BUDGET):
+            get_crossref_dicts(dois, fallback=False)
+
+
+def batch_dois(items: list) -> list:
+    """Return the DOIs of the batch items that will be resolved as DOIs."""
+    return [
+        m[0] for user_input, input_type, _ in items
+        if upstream_of(user_input, input_type) == 'doi' and (
+            m := DOI_SEARCH(unescape(unquote(uninum2en(user_input)))))]
+
+
+def batch_lines(items: list):
+    """Yield the JSON lines of items in the order they are resolved.
+
+    At most BATCH_UPSTREAM_LIMIT items of each upstream are submitted to the
+    executor at a time. The next item of an upstream is submitted when one of
+    its items is resolved, so the threads never wait for a busy upstream
+    while the items of other upstreams are pending.
+    """
+    prefetch_dois(items)
+    queues = defaultdict(deque)  # {upstream: deque of (index, item)}
+    for index_item in enumerate(items):
+        queues[upstream_of(*index_item[1][:2])].append(index_item)
+    executor = ThreadPoolExecutor(BATCH_WORKERS)
+    upstreams = {}  # {future: upstream}
+
+    def submit(upstream: str):
+        upstreams[executor.submit(
+            batch_line, *queues[upstream].popleft())] = upstream
+
+    try:
+        for upstream, queue in queues.items():
+            for _ in range(min(len(queue), BATCH_UPSTREAM_LIMIT)):
+                submit(upstream)
+        while upstreams:
+            done, _ = wait(upstreams, return_when=FIRST_COMPLETED)
+            for future in done:
+                if queues[upstream := upstreams.pop(future)]:
+                    submit(upstream)
+                yield future.result().encode() + b'\n'
+    finally:
+        # the client may have closed the connection
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def batch_app(environ: dict, start_response: callable):
+    """Resolve the inputs in the request body concurrently.
+
+    The response is newline-delimited JSON, one line per input, streamed in
+    the order that the inputs are resolved. Each line has the keys of
+    scr_to_json plus the index of the input and the user_input itself.
+    """
+    try:
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        items = batch_items(
+            environ['wsgi.input'].read(length), environ['QUERY_STRING'])
+    except ValueError as e:  # includes JSONDecodeError and UnicodeError
+        response_body = str(e).encode()
+        start_response('400 Bad Request', [
+            ('Content-Type', 'text/plain; charset=UTF-8'),
+            ('Content-Length', str(len(response_body)))])
+        return response_body,
+    start_response('200 OK', BATCH_HEADERS)
+    return batch_lines(items)
+
+
+def batch_items(body: bytes, query_string: str) -> list:
+    """Return the parsed items of a batch request. Raise ValueError."""
+    query_dict_get = parse_qs(query_string).get
+    return parse_batch(
+        body.decode(),
+        query_dict_get('input_type', [''])[0],
+        query_dict_get('dateformat', [''])[0].strip())
 
 
 input_type_to_resolver = defaultdict(
@@ -222,7 +503,7 @@ input_type_to_resolver = defaultdict(
 
 if __name__ == '__main__':
     # note that app.py is not run as '__main__' in kubernetes
-    # only for local computer
+    # only for local computer, see server.py for a multi-process server
     from wsgiref.simple_server import make_server
     httpd = make_server('localhost', 5000, app)
     print('serving on http://localhost:5000')
@@ -0,0 +1,282 @@
+"""ASGI interface of Citer, an alternative to the WSGI app in app.py.
+
+Run it using an ASGI server, e.g. `uvicorn asgi:application`.
+
+Inputs are resolved by the async variants of the resolvers, which send their
+requests using the httpx clients of lib.aio. Waiting for upstream services
+does not hold a thread, and each upstream host has a connection pool of its
+own. The caches and the in-flight lookups are shared with app.py.
+"""
+
+from asyncio import as_completed, get_running_loop, Semaphore
+from collections import defaultdict
+from html import unescape
+from urllib.parse import unquote
+
+from requests import JSONDecodeError
+
+from app import BATCH_HEADERS, BATCH_UPSTREAM_LIMIT, DEFAULT_SCR, \
+    HTML_CONTENT_TYPE, IN_FLIGHT, JSON_CONTENT_TYPE, LOGGER, \
+    OTHER_EXCEPTION_SCR, REQUEST_BUDGET, RESULT_CACHE, UNDEFINED_INPUT_SCR, \
+    batch_dois, batch_items, cache_result, error_scr, google_encrypted_dict, \
+    page_body, page_query, result_copy, scr_to_html, static_file, \
+    status_json, upstream_of, url_resolver, warm_up
+from lib.aio import aclose_clients
+from lib.cache import MISSING
+from lib.commons import DOI_SEARCH, ISBN_10OR13_SEARCH, deadline, \
+    dict_to_sfn_cit_ref, scr_to_json, uninum2en
+from lib.doi import adoi_to_dict, aget_crossref_dicts
+from lib.googlebooks import aurl_to_dict as agoogle_books_dict, \
+    url_to_dict as google_books_dict
+from lib.isbn_oclc import IsbnError, aisbn_to_dict, aoclc_dict, \
+    canonical_isbn
+from lib.jstor import aurl_to_dict as ajstor_url_to_dict, \
+    url_to_dict as jstor_url_to_dict
+from lib.ketabir import aurl_to_dict as aketabir_url_to_dict, \
+    url_to_dict as ketabir_url_to_dict
+from lib.noorlib import aurl_to_dict as anoorlib_url_to_dict, \
+    url_to_dict as noorlib_url_to_dict
+from lib.noormags import aurl_to_dict as anoormags_url_to_dict, \
+    url_to_dict as noormags_url_to_dict
+from lib.pubmed import apmcid_dict, apmid_dict
+from lib.urls import aurl_to_dict as aurls_url_to_dict
+from lib.waybackmachine import aurl_to_dict as aarchive_url_to_dict, \
+    url_to_dict as archive_url_to_dict
+
+
+async def agoogle_encrypted_dict(url, parsed_url, date_format) -> dict:
+    """Async variant of app.google_encrypted_dict."""
+    if parsed_url[2][:7] in {'/books', '/books/'}:
+        return await agoogle_books_dict(parsed_url, date_format)
+    return await aurls_url_to_dict(url, date_format)
+
+
+# {resolver of app.TLDLESS_NETLOC_RESOLVER: its async variant}
+ASYNC_RESOLVER = {
+    ketabir_url_to_dict: aketabir_url_to_dict,
+    noorlib_url_to_dict: anoorlib_url_to_dict,
+    noormags_url_to_dict: anoormags_url_to_dict,
+    archive_url_to_dict: aarchive_url_to_dict,
+    google_books_dict: agoogle_books_dict,
+    google_encrypted_dict: agoogle_encrypted_dict,
+    jstor_url_to_dict: ajstor_url_to_dict,
+}
+
+
+async def aresolve_and_cache(
+    key: str, to_dict: callable, args: tuple
+) -> dict:
+    return cache_result(key, await to_dict(*args))
+
+
+async def acached(key: str, to_dict: callable, *args) -> dict:
+    """Async variant of app.cached. to_dict must be a coroutine function."""
+    if (d := RESULT_CACHE.get(key)) is MISSING:
+        d = await IN_FLIGHT.ado(key, aresolve_and_cache, key, to_dict, args)
+    return result_copy(d, args[-1])
+
+
+async def ainput_to_dict(user_input, date_format, /) -> dict:
+    """Async variant of app.input_to_dict."""
+    en_user_input = unquote(uninum2en(user_input))
+    if '.' in en_user_input:
+        url, url_input, parsed_url, to_dict = url_resolver(user_input)
+        if to_dict is not None:
+            key = 'url:' + url
+            ato_dict = ASYNC_RESOLVER[to_dict]
+            if to_dict is google_books_dict:
+                return await acached(key, ato_dict, parsed_url, date_format)
+            elif to_dict is google_encrypted_dict:
+                return await acached(
+                    key, ato_dict, url, parsed_url, date_format)
+            return await acached(key, ato_dict, url, date_format)
+
+        # DOIs contain dots
+        if (m := DOI_SEARCH(unescape(en_user_input))) is not None:
+            try:
+                # DOIs are case-insensitive
+                return await acached(
+                    'doi:' + m[0].lower(), adoi_to_dict, m[0], True,
+                    date_format)
+            except JSONDecodeError:
+                if url_input is False:
+                    raise
+                # continue with urls_scr
+
+        return await acached(
+            'url:' + url, aurls_url_to_dict, url, date_format)
+    else:
+        if (m := ISBN_10OR13_SEARCH(en_user_input)) is not None:
+            try:
+                return await acached(
+                    f'isbn:{canonical_isbn(m[0])}', aisbn_to_dict, m[0], True,
+                    date_format)
+            except IsbnError:
+                pass
+        return UNDEFINED_INPUT_SCR
+
+
+input_type_to_resolver = defaultdict(
+    lambda: ainput_to_dict, {
+        'url-doi-isbn': ainput_to_dict,
+        'pmid': apmid_dict,
+        'pmcid': apmcid_dict,
+        'oclc': aoclc_dict})
+
+
+async def ainput_to_scr(
+    user_input: str, input_type: str, date_format: str
+) -> tuple:
+    """Async variant of app.input_to_scr."""
+    to_dict = input_type_to_resolver[input_type]
+    # noinspection PyBroadException
+    try:
+        # tasks that are started inside copy the deadline
+        with deadline(REQUEST_BUDGET):
+            if to_dict is ainput_to_dict:
+                d = await to_dict(user_input, date_format)
+            else:
+                d = await acached(
+                    f'{input_type}:{uninum2en(user_input)}', to_dict,
+                    user_input, date_format)
+    except Exception as e:
+        return error_scr(e, user_input)
+    return '200 OK', dict_to_sfn_cit_ref(d)
+
+
+async def apage(query_string: str) -> tuple:
+    """Async variant of app.page."""
+    user_input, input_type, date_format, output_format = page_query(
+        query_string)
+    if not user_input:
+        return '200 OK', scr_to_html(
+            DEFAULT_SCR, date_format, input_type
+        ).encode()
+    status, scr = await ainput_to_scr(user_input, input_type, date_format)
+    return status, page_body(scr, output_format, date_format, input_type)
+
+
+async def abatch_line(index: int, item: tuple) -> str:
+    """Async variant of app.batch_line."""
+    if not (user_input := item[0]):
+        return scr_to_json(UNDEFINED_INPUT_SCR, index=index, user_input='')
+    # noinspection PyBroadException
+    try:
+        scr = (await ainput_to_scr(*item))[1]
+    except Exception:  # do not break the other lines of the response
+        LOGGER.exception(user_input)
+        scr = OTHER_EXCEPTION_SCR
+    return scr_to_json(scr, index=index, user_input=user_input)
+
+
+async def aprefetch_dois(items: list) -> None:
+    """Async variant of app.prefetch_dois."""
+    if len(dois := batch_dois(items)) > 1:
+        with deadline(REQUEST_BUDGET):
+            await aget_crossref_dicts(dois, fallback=False)
+
+
+async def resolve_batch_item(
+    index: int, item: tuple, semaphores: dict
+) -> str:
+    """Resolve item, at most BATCH_UPSTREAM_LIMIT per upstream at a time.
+
+    semaphores is {upstream: Semaphore} of the current batch.
+    """
+    async with semaphores.setdefault(
+        upstream_of(item[0], item[1]), Semaphore(BATCH_UPSTREAM_LIMIT)
+    ):
+        return await abatch_line(index, item)
+
+
+def encode_headers(headers: list) -> list:
+    return [(k.lower().encode(), v.encode()) for k, v in headers]
+
+
+async def respond(
+    send: callable, status: str, headers: list, body: bytes
+) -> None:
+    if not any(k == 'Content-Length' for k, _ in headers):
+        headers = [*headers, ('Content-Length', str(len(body)))]
+    await send({
+        'type': 'http.response.start',
+        'status': int(status[:3]),
+        'headers': encode_headers(headers),
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def read_body(receive: callable) -> bytes:
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise ConnectionResetError('client disconnected')
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return bytes(body)
+
+
+async def batch(receive: callable, send: callable, query_string: str):
+    """Async variant of app.batch_app."""
+    try:
+        items = batch_items(await read_body(receive), query_string)
+    except ValueError as e:  # includes JSONDecodeError and UnicodeError
+        await respond(
+            send, '400 Bad Request',
+            [('Content-Type', 'text/plain; charset=UTF-8')], str(e).encode())
+        return
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': encode_headers(BATCH_HEADERS),
+    })
+    await aprefetch_dois(items)
+    loop = get_running_loop()
+    semaphores = {}
+    tasks = [
+        loop.create_task(resolve_batch_item(i, item, semaphores))
+        for i, item in enumerate(items)]
+    try:
+        for task in as_completed(tasks):
+            await send({
+                'type': 'http.response.body',
+                'body': (await task).encode() + b'\n',
+                'more_body': True,
+            })
+    finally:
+        # the client may have closed the connection
+        for task in tasks:
+            task.cancel()
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def lifespan(receive: callable, send: callable) -> None:
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            warm_up()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await aclose_clients()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope: dict, receive: callable, send: callable):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    path = scope['path']
+    if path[-6:] == '/batch':
+        await batch(receive, send, scope['query_string'].decode('latin-1'))
+        return
+    if path[-7:] == '/status':
+        await respond(send, '200 OK', [JSON_CONTENT_TYPE], status_json())
+        return
+    if '/static/' in path:
+        headers, body = static_file(path)
+        await respond(send, '200 OK', headers, body)
+        return
+    status, body = await apage(scope['query_string'].decode('latin-1'))
+    await respond(send, status, [HTML_CONTENT_TYPE], body)
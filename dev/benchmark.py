@@ -0,0 +1,266 @@
+"""Offline benchmark of the resolvers using the recorded test/testdata.
+
+Usage:
+    python -m dev.benchmark run [-o result.json] [-r REPEAT] [-i INPUTS_FILE]
+    python -m dev.benchmark compare old.json new.json [-t THRESHOLD]
+
+The run command replays the recorded responses of test/testdata through
+app.input_to_dict and dict_to_sfn_cit_ref. By default the inputs are the
+recorded URLs that can be replayed directly; pass a file with one input per
+line to use other inputs. Inputs which need a response that is not recorded
+are reported as skipped.
+
+Latencies are reported in milliseconds per resolver and per stage. The fetch,
+decode and language stages are the time spent in the corresponding calls in
+all threads; extract is the rest of the resolver time in the main thread,
+including the time spent waiting for background threads; render is the time
+of dict_to_sfn_cit_ref. Allocations are the peak traced memory of each input
+in KiB, measured in a separate pass using tracemalloc.
+
+The compare command prints the relative change of the percentiles and exits
+with status 1 if any p50 has become slower than the threshold (default 10%).
+"""
+
+from argparse import ArgumentParser
+from collections import defaultdict
+from collections.abc import Mapping
+from datetime import datetime
+from hashlib import sha1
+from json import dump, load
+from platform import python_version
+from subprocess import CalledProcessError, check_output
+from sys import exit as sys_exit
+import threading
+from threading import current_thread, main_thread, Lock
+from time import perf_counter
+from tracemalloc import (
+    start as tracemalloc_start, stop as tracemalloc_stop,
+    get_traced_memory, reset_peak)
+from typing import Dict, List
+
+# Importing test replaces requests.Session.request with fake_request.
+from test import TESTDATA
+from requests import Session
+
+import app
+from lib import (
+    breaker, doi, googlebooks, isbn_oclc, ketabir, urls, waybackmachine)
+from lib.commons import dict_to_sfn_cit_ref, fetch_memo
+
+
+PERCENTILES = (50, 90, 99)
+STAGES = ('fetch', 'decode', 'extract', 'language', 'render')
+CACHES = (
+    app.RESULT_CACHE, urls.HOME_CACHE, urls.LANGUAGE_CACHE, doi.CROSSREF_CACHE,
+    isbn_oclc.BOOK_CACHE, isbn_oclc.BOOK_NOT_FOUND_CACHE,
+    googlebooks.VOLUME_CACHE, waybackmachine.CDX_CACHE)
+
+_stage_times: Dict[str, float] = defaultdict(float)
+_main_thread_time = 0.
+_stage_lock = Lock()
+
+
+def timed(stage: str, func):
+    """Return a wrapper of func that adds its durations to _stage_times."""
+    def wrapper(*args, **kwargs):
+        global _main_thread_time
+        start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            duration = perf_counter() - start
+            with _stage_lock:
+                _stage_times[stage] += duration
+                if current_thread() is main_thread():
+                    _main_thread_time += duration
+    return wrapper
+
+
+def instrument() -> None:
+    # Home pages of many recorded URLs are not recorded. The home threads
+    # fail with RuntimeError in that case, which is not worth reporting.
+    threading.excepthook = lambda args: None
+    # The same missing responses fail on every repeat. Never open a breaker.
+    breaker.BREAKER_MIN_CALLS = float('inf')
+    Session.request = staticmethod(timed('fetch', Session.request))
+    urls.decode_html = timed('decode', urls.decode_html)
+    for module in (doi, googlebooks, isbn_oclc, ketabir, urls):
+        module.classify = timed('language', module.classify)
+
+
+RESOLVER_NAMES: Dict[int, str] = {}
+
+
+def cached(key, to_dict, *args):
+    """Replace app.cached to bypass the cache and record the resolver."""
+    RESOLVER_NAMES[id(current_thread())] = \
+        to_dict.__module__.rpartition('.')[2] + '.' + to_dict.__name__
+    return to_dict(*args)
+
+
+def recorded_inputs() -> List[str]:
+    """Return the recorded URLs that can be replayed by their own URL."""
+    inputs = []
+    for path in sorted(TESTDATA.glob('*.json')):
+        with open(path, encoding='utf8') as f:
+            d = load(f)
+        if (url := d.get('url')) is None:
+            continue
+        if sha1(url.encode()).hexdigest() == path.stem:
+            inputs.append(url)
+    return inputs
+
+
+def clear_caches() -> None:
+    for cache in CACHES:
+        cache.clear()
+
+
+def resolve(user_input: str) -> tuple:
+    """Return (resolver, seconds, {stage: seconds}) of user_input."""
+    global _main_thread_time
+    clear_caches()
+    _stage_times.clear()
+    _main_thread_time = 0.
+    start = perf_counter()
+    with fetch_memo():  # like app.input_to_scr
+        d = app.input_to_dict(user_input, '%Y-%m-%d')
+    total = perf_counter() - start
+    if not isinstance(d, Mapping):
+        raise ValueError('undefined input')
+    stages = dict(_stage_times)
+    stages['extract'] = total - _main_thread_time
+    start = perf_counter()
+    dict_to_sfn_cit_ref(d)
+    stages['render'] = perf_counter() - start
+    return RESOLVER_NAMES.pop(id(current_thread())), total, stages
+
+
+def percentiles(values: List[float]) -> dict:
+    """Return nearest-rank percentiles, max and count of values."""
+    values = sorted(values)
+    n = len(values)
+    result = {
+        f'p{p}': values[max(0, -(-p * n // 100) - 1)] for p in PERCENTILES}
+    result['max'] = values[-1]
+    result['count'] = n
+    return result
+
+
+def run(inputs: List[str], repeat: int) -> dict:
+    instrument()
+    app.cached = cached
+    resolver_ms: Dict[str, List[float]] = defaultdict(list)
+    stage_ms: Dict[str, List[float]] = defaultdict(list)
+    resolver_of = {}
+    skipped = {}
+    for user_input in inputs:
+        # noinspection PyBroadException
+        try:
+            resolver, total, stages = resolve(user_input)
+        except Exception as e:
+            RESOLVER_NAMES.clear()
+            skipped[user_input] = f'{type(e).__name__}: {e}'
+            continue
+        resolver_of[user_input] = resolver
+        for _ in range(repeat):
+            resolver, total, stages = resolve(user_input)
+            resolver_ms[resolver].append(total * 1000)
+            for stage in STAGES:
+                stage_ms[stage].append(stages.get(stage, 0.) * 1000)
+
+    allocations_kib: Dict[str, List[float]] = defaultdict(list)
+    tracemalloc_start()
+    try:
+        for user_input, resolver in resolver_of.items():
+            clear_caches()
+            reset_peak()
+            with fetch_memo():
+                app.input_to_dict(user_input, '%Y-%m-%d')
+            allocations_kib[resolver].append(get_traced_memory()[1] / 1024)
+    finally:
+        tracemalloc_stop()
+
+    try:
+        commit = check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except (CalledProcessError, OSError):
+        commit = None
+    return {
+        'info': {
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'commit': commit,
+            'python': python_version(),
+            'inputs': len(inputs),
+            'repeat': repeat,
+        },
+        'resolvers_ms': {
+            k: percentiles(v) for k, v in sorted(resolver_ms.items())},
+        'stages_ms': {k: percentiles(stage_ms[k]) for k in STAGES},
+        'allocations_kib': {
+            k: percentiles(v) for k, v in sorted(allocations_kib.items())},
+        'skipped': skipped,
+    }
+
+
+def compare(old: dict, new: dict, threshold: float) -> bool:
+    """Print the changes from old to new. Return True on regression."""
+    regression = False
+    for section in ('resolvers_ms', 'stages_ms', 'allocations_kib'):
+        print(section)
+        for name, new_stats in new[section].items():
+            if (old_stats := old[section].get(name)) is None:
+                print(f'  {name}: new')
+                continue
+            changes = []
+            for p in (*(f'p{p}' for p in PERCENTILES), 'max'):
+                o, n = old_stats[p], new_stats[p]
+                change = (n - o) / o if o else 0.
+                changes.append(f'{p} {o:.2f} -> {n:.2f} ({change:+.0%})')
+                if p == 'p50' and change > threshold:
+                    regression = True
+                    changes[-1] += ' REGRESSION'
+            print(f'  {name}: ' + ', '.join(changes))
+    return regression
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.partition('\n')[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run')
+    run_parser.add_argument('-o', '--output', default='bench_output.json')
+    run_parser.add_argument('-r', '--repeat', type=int, default=3)
+    run_parser.add_argument(
+        '-i', '--inputs', help='a file containing one input per line')
+    compare_parser = subparsers.add_parser('compare')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('-t', '--threshold', type=float, default=.1)
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        with open(args.old, encoding='utf8') as f:
+            old = load(f)
+        with open(args.new, encoding='utf8') as f:
+            new = load(f)
+        sys_exit(1 if compare(old, new, args.threshold) else 0)
+
+    if args.inputs:
+        with open(args.inputs, encoding='utf8') as f:
+            inputs = [line.strip() for line in f if line.strip()]
+    else:
+        inputs = recorded_inputs()
+    result = run(inputs, args.repeat)
+    with open(args.output, 'w', encoding='utf8') as f:
+        dump(result, f, ensure_ascii=False, indent='\t')
+    for section in ('resolvers_ms', 'stages_ms', 'allocations_kib'):
+        print(section)
+        for name, stats in result[section].items():
+            print(f'  {name}: ' + ', '.join(
+                f'{k} {v:.2f}' if k != 'count' else f'n={v}'
+                for k, v in stats.items()))
+    print(f'{len(result["skipped"])} inputs skipped. Results: {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,26 @@
+"""Pre-seed the book cache of isbn_to_dict from a JSON lines file.
+
+Usage: python -m dev.seed_books books.jsonl
+
+Each line should be a JSON object like the ones returned by isbn_to_dict,
+having at least the isbn, title and cite_type keys. Set SQLITE_CACHE in
+config.py, otherwise the seeded records are lost when this script exits.
+"""
+
+from json import loads
+from sys import argv
+
+from lib.cache import SQLITE_CACHE
+from lib.isbn_oclc import seed_books
+
+
+def main():
+    if not SQLITE_CACHE:
+        raise SystemExit('SQLITE_CACHE is not set in config.py')
+    with open(argv[1], encoding='utf8') as f:
+        n = seed_books(loads(line) for line in f if line.strip())
+    print(f'{n} books stored in {SQLITE_CACHE}')
+
+
+if __name__ == '__main__':
+    main()
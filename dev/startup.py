@@ -0,0 +1,73 @@
+"""Report the startup cost of app broken down by module.
+
+Usage: python -m dev.startup [-n TOP]
+
+Imports app in a new interpreter using `python -X importtime` and prints the
+modules that took the most time to import, in milliseconds. The time of
+the third-party packages and the standard library is grouped by their top
+level package, while app and lib modules are listed individually. The time
+of app.warm_up, which loads what the resolvers would otherwise load on their
+first use, is reported separately, including the modules that it imports.
+"""
+
+from argparse import ArgumentParser
+from collections import defaultdict
+from subprocess import run
+from sys import executable
+from typing import Dict
+
+WARM_UP_MARKER = 'warming up'
+CODE = (
+    'from sys import stderr\n'
+    'from time import perf_counter\n'
+    'import app\n'
+    f'print({WARM_UP_MARKER!r}, file=stderr)\n'
+    'start = perf_counter()\n'
+    'app.warm_up()\n'
+    'print(perf_counter() - start)\n')
+
+
+def group_of(module: str) -> str:
+    if module == 'app' or module.startswith('lib.'):
+        return module
+    return module.partition('.')[0]
+
+
+def import_times(stderr: str) -> Dict[str, float]:
+    """Return {group: self time in ms} parsed from -X importtime output."""
+    times = defaultdict(float)
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, _, module = line[12:].split('|')
+        if not self_us.strip().isdigit():  # the header
+            continue
+        times[group_of(module.strip())] += int(self_us) / 1000
+    return times
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.partition('\n')[0])
+    parser.add_argument('-n', '--top', type=int, default=20)
+    args = parser.parse_args()
+
+    p = run(
+        [executable, '-X', 'importtime', '-c', CODE],
+        capture_output=True, text=True, check=True)
+    app_stderr, _, warm_up_stderr = p.stderr.partition(WARM_UP_MARKER)
+    times = import_times(app_stderr)
+    total = sum(times.values())
+    for group, ms in sorted(
+        times.items(), key=lambda i: i[1], reverse=True
+    )[:args.top]:
+        print(f'{ms:9.1f} {ms / total:6.1%}  {group}')
+    print(f'{total:9.1f} ms importing app ({len(times)} groups)')
+    warm_up_imports = import_times(warm_up_stderr)
+    print(
+        f'{float(p.stdout) * 1000:9.1f} ms in app.warm_up, including '
+        f'{sum(warm_up_imports.values()):.1f} ms importing '
+        + ', '.join(sorted(warm_up_imports, key=warm_up_imports.get)[:-6:-1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""Asynchronous requests, used by the async resolvers of asgi.py.
+
+arequest is the async variant of lib.commons.request. It uses the same
+per-host pool sizes and timeouts, DEADLINE, circuit breakers and hedging, but
+sends the requests using one httpx.AsyncClient per upstream host, so waiting
+for a response does not hold a thread. Errors are raised as the exceptions
+of requests, so that the resolvers handle them like the errors of request.
+
+httpx is only imported on first use; the WSGI app does not need it.
+"""
+
+from asyncio import CancelledError, FIRST_COMPLETED, get_running_loop, wait
+from time import monotonic
+from typing import Dict, Tuple
+from urllib.parse import urlparse
+from weakref import WeakKeyDictionary
+
+from requests import ConnectionError as RequestsConnectionError, \
+    RequestException, Timeout
+from requests.compat import chardet
+from requests.utils import get_encoding_from_headers
+
+from lib.breaker import breaker
+from lib.commons import AGENT_HEADER, DEADLINE, HEDGE_DELAY, HEDGED_HOSTS, \
+    OTHER_HOSTS, OTHER_HOSTS_POOLS, SPOOFED_AGENT_HEADER, UPSTREAMS, \
+    budget_timeout
+
+# {event loop: {host: AsyncClient}}. All hosts that are not in UPSTREAMS
+# share the client of the None host. Clients cannot be used across event
+# loops, e.g. the ones of asyncio.run calls in tests.
+_CLIENTS: 'WeakKeyDictionary[object, Dict[str, object]]' = \
+    WeakKeyDictionary()
+
+
+def async_client(host: str) -> Tuple[object, tuple]:
+    """Return (AsyncClient, (connect timeout, read timeout)) of host."""
+    if (upstream := UPSTREAMS.get(host)) is None:
+        host = None
+        size, *timeout = OTHER_HOSTS
+        size *= OTHER_HOSTS_POOLS
+    else:
+        size, *timeout = upstream
+    if (clients := _CLIENTS.get(loop := get_running_loop())) is None:
+        clients = _CLIENTS[loop] = {}
+    if (client := clients.get(host)) is None:
+        from httpx import AsyncClient, Limits
+        client = clients[host] = AsyncClient(limits=Limits(
+            max_connections=size, max_keepalive_connections=size))
+    return client, (*timeout,)
+
+
+async def aclose_clients() -> None:
+    """Close the clients of the running event loop."""
+    for client in _CLIENTS.pop(get_running_loop(), {}).values():
+        await client.aclose()
+
+
+async def arequest(
+    url, spoof=False, method='get', stream=False, allow_redirects=True,
+    **kwargs
+):
+    """Send the request and return its httpx.Response.
+
+    If stream is True, the content is not read and the response must be
+    closed using its aclose method. The encoding of responses is the one
+    that requests would use.
+    """
+    import httpx
+    headers = SPOOFED_AGENT_HEADER if spoof else AGENT_HEADER
+    if 'headers' in kwargs:
+        headers = headers | kwargs.pop('headers')
+    host = urlparse(url).hostname
+    client, timeout = async_client(host)
+    timeout, budget_limited = budget_timeout(
+        url, kwargs.pop('timeout', timeout))
+    request = client.build_request(
+        method.upper(), url, headers=headers,
+        timeout=httpx.Timeout(timeout[1], connect=timeout[0]), **kwargs)
+    host_breaker = breaker(host)
+    host_breaker.before()  # raises CircuitOpenError if host is unhealthy
+    failed = True
+    start = monotonic()
+    try:
+        if host in HEDGED_HOSTS and method == 'get' and not stream:
+            r = await ahedged(
+                client.send, request, follow_redirects=allow_redirects)
+        else:
+            r = await client.send(
+                request, stream=stream, follow_redirects=allow_redirects)
+        failed = r.status_code >= 500
+    except CancelledError:  # e.g. the client has disconnected
+        failed = False
+        raise
+    except httpx.TimeoutException as e:
+        # not the fault of the host if its timeout was cut short
+        failed = not budget_limited
+        raise Timeout(str(e) or f'timeout of {url}') from e
+    except httpx.TransportError as e:
+        raise RequestsConnectionError(str(e) or f'could not get {url}') from e
+    except httpx.HTTPError as e:  # e.g. TooManyRedirects
+        raise RequestException(str(e)) from e
+    finally:
+        host_breaker.after(failed, monotonic() - start)
+    encoding = get_encoding_from_headers(r.headers)
+    if encoding is None and not stream:
+        # the text of such responses is decoded using the guess of requests
+        encoding = chardet.detect(r.content)['encoding']
+    r.encoding = encoding
+    return r
+
+
+async def ahedged(send: callable, *args, **kwargs):
+    """Async variant of lib.commons.hedged.
+
+    The attempt that does not win is cancelled.
+    """
+    if (
+        (deadline_ := DEADLINE.get()) is not None
+        and deadline_ - monotonic() < HEDGE_DELAY
+    ):
+        return await send(*args, **kwargs)
+    create_task = get_running_loop().create_task
+    attempts = [create_task(send(*args, **kwargs))]
+    try:
+        if not (await wait(attempts, timeout=HEDGE_DELAY))[0]:
+            attempts.append(create_task(send(*args, **kwargs)))
+        pending = attempts
+        while pending:
+            done, pending = await wait(pending, return_when=FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+        return attempts[0].result()  # raises the error of the first attempt
+    finally:
+        for task in attempts:
+            task.cancel()
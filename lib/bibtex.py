@@ -12,10 +12,9 @@ Known issues:
     * Abbreviations are not supported (e.g. @string { foo = "Mrs. Foo" })
 """
 
-from collections import defaultdict
-
 from regex import compile as rc
 
+from lib.citation import Citation
 from lib.commons import first_last
 
 
@@ -27,12 +26,10 @@ FINDALL_BIBTEX_FIELDS = rc(
 TYPE_SEARCH = rc(r'(?i)@(.*?)\s*\{').search
 
 
-def search_for_tag(bibtex: str) -> defaultdict:
-    """Find all fields of the bibtex and return result as a defaultdict."""
+def search_for_tag(bibtex: str) -> Citation:
+    """Find all fields of the bibtex and return result as a Citation."""
     fs = FINDALL_BIBTEX_FIELDS(bibtex)
-    return defaultdict(
-        lambda: None, {f[0].lower(): f[1] if f[1] else f[2] for f in fs}
-    )
+    return Citation({f[0].lower(): f[1] if f[1] else f[2] for f in fs})
 
 
 def parse(bibtex):
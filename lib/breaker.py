@@ -0,0 +1,136 @@
+"""Circuit breakers that stop sending requests to unhealthy hosts."""
+
+from collections import OrderedDict, deque
+from threading import Lock
+from time import monotonic
+from typing import Deque, Tuple
+
+from requests import ConnectionError as RequestsConnectionError
+
+import config
+
+# A breaker opens when at least BREAKER_MIN_CALLS requests were sent to its
+# host in the last BREAKER_WINDOW seconds and BREAKER_ERROR_RATE of them
+# failed. Connection errors, timeouts, 5xx responses and responses slower
+# than BREAKER_SLOW_CALL seconds count as failures.
+BREAKER_WINDOW = getattr(config, 'BREAKER_WINDOW', 60)
+BREAKER_MIN_CALLS = getattr(config, 'BREAKER_MIN_CALLS', 5)
+BREAKER_ERROR_RATE = getattr(config, 'BREAKER_ERROR_RATE', .5)
+BREAKER_SLOW_CALL = getattr(config, 'BREAKER_SLOW_CALL', 8)
+# Seconds that an open breaker rejects requests before letting one probe
+# request through (half-open). The breaker closes if the probe succeeds.
+BREAKER_OPEN_SECONDS = getattr(config, 'BREAKER_OPEN_SECONDS', 30)
+MAX_BREAKERS = 10_000
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+
+class CircuitOpenError(RequestsConnectionError):
+
+    """Raise instead of sending a request to an unhealthy host."""
+
+
+class CircuitBreaker:
+
+    __slots__ = ('host', 'state', 'opened_at', 'probing', 'calls', '_lock')
+
+    def __init__(self, host: str):
+        self.host = host
+        self.state = CLOSED
+        self.opened_at = 0.
+        self.probing = False
+        # (time, failed, latency) of the calls in the last BREAKER_WINDOW
+        self.calls: Deque[Tuple[float, bool, float]] = deque()
+        self._lock = Lock()
+
+    def before(self) -> None:
+        """Raise CircuitOpenError if a request should not be sent."""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            if self.state == OPEN:
+                if monotonic() - self.opened_at < BREAKER_OPEN_SECONDS:
+                    raise CircuitOpenError(f'{self.host} is unavailable')
+                self.state = HALF_OPEN
+            if self.probing:  # only one probe at a time
+                raise CircuitOpenError(f'{self.host} is unavailable')
+            self.probing = True
+
+    def after(self, failed: bool, latency: float) -> None:
+        """Record the outcome of a request that was allowed by before."""
+        failed = failed or latency > BREAKER_SLOW_CALL
+        now = monotonic()
+        with self._lock:
+            calls = self.calls
+            calls.append((now, failed, latency))
+            while calls[0][0] < now - BREAKER_WINDOW:
+                calls.popleft()
+            if self.state == HALF_OPEN:
+                self.probing = False
+                if failed:
+                    self.state, self.opened_at = OPEN, now
+                else:
+                    self.state = CLOSED
+                    calls.clear()
+            elif (
+                self.state == CLOSED
+                and len(calls) >= BREAKER_MIN_CALLS
+                and sum(c[1] for c in calls) >= BREAKER_ERROR_RATE * len(calls)
+            ):
+                self.state, self.opened_at = OPEN, now
+
+    def available(self) -> bool:
+        """Return False if before would raise CircuitOpenError."""
+        state = self.state
+        return state == CLOSED or (
+            not self.probing and (
+                state == HALF_OPEN
+                or monotonic() - self.opened_at >= BREAKER_OPEN_SECONDS))
+
+    def stats(self) -> dict:
+        with self._lock:
+            calls = [*self.calls]
+            state = self.state
+        n = len(calls)
+        return {
+            'state': state,
+            'calls': n,
+            'error_rate': sum(c[1] for c in calls) / n if n else 0.,
+            'mean_latency': sum(c[2] for c in calls) / n if n else 0.,
+            'max_latency': max((c[2] for c in calls), default=0.),
+        }
+
+
+_breakers: OrderedDict[str, CircuitBreaker] = OrderedDict()
+_breakers_lock = Lock()
+
+
+def breaker(host: str) -> CircuitBreaker:
+    """Return the breaker of host. Keep up to MAX_BREAKERS recent hosts."""
+    with _breakers_lock:
+        if (b := _breakers.get(host)) is None:
+            b = _breakers[host] = CircuitBreaker(host)
+            if len(_breakers) > MAX_BREAKERS:
+                _breakers.popitem(last=False)
+        else:
+            _breakers.move_to_end(host)
+        return b
+
+
+def available(host: str) -> bool:
+    """Return False if requests to host are currently being rejected."""
+    with _breakers_lock:
+        b = _breakers.get(host)
+    return b is None or b.available()
+
+
+def breaker_stats() -> dict:
+    """Return {host: stats} of the breakers that are not healthy.
+
+    A breaker is included if it is not closed or had failures in its window.
+    """
+    with _breakers_lock:
+        breakers = [*_breakers.values()]
+    return {
+        b.host: stats for b in breakers
+        if (stats := b.stats())['state'] != CLOSED or stats['error_rate']}
@@ -0,0 +1,245 @@
+"""Thread-safe LRU caches with TTL and optional SQLite persistence."""
+
+from asyncio import get_running_loop, shield, Task
+from collections import OrderedDict
+from logging import getLogger
+from os import register_at_fork
+from pickle import dumps, loads, HIGHEST_PROTOCOL
+from sqlite3 import connect, Connection, Error as SQLiteError
+from threading import Event, Lock
+from time import time
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Tuple
+
+import config
+
+# Path of the SQLite file used by persistent caches. Caches are kept in
+# memory only if this is empty.
+SQLITE_CACHE = getattr(config, 'SQLITE_CACHE', '')
+
+# Returned by Cache.get when the key is not found and no default is given.
+# Use it to distinguish missing keys from cached None values.
+MISSING = object()
+
+_connections: Dict[str, Tuple[Connection, Lock]] = {}
+_connections_lock = Lock()
+
+
+def _connection(path: str) -> Tuple[Connection, Lock]:
+    """Return a shared (connection, lock) pair for the given path."""
+    with _connections_lock:
+        if (cl := _connections.get(path)) is None:
+            cl = _connections[path] = (
+                connect(path, check_same_thread=False), Lock())
+        return cl
+
+
+# SQLite connections must not be used across fork. Processes forked by
+# server.py open their own connections on first use.
+register_at_fork(after_in_child=_connections.clear)
+
+
+class Cache:
+
+    """An LRU cache whose entries expire after ttl seconds.
+
+    If persistent is True and SQLITE_CACHE is set, entries are also stored
+    in a table named after the cache and survive restarts. Memory is checked
+    first; entries found on disk are promoted into memory.
+    """
+
+    __slots__ = (
+        'name', 'maxsize', 'ttl', 'hits', 'misses', '_data', '_lock', '_db')
+
+    def __init__(
+        self, name: str, maxsize: int, ttl: float, persistent: bool = False,
+        path: str = None,
+    ):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = self.misses = 0
+        # key -> (expires, value)
+        self._data: OrderedDict[Hashable, Tuple[float, Any]] = OrderedDict()
+        self._lock = Lock()
+        if path is None:
+            path = SQLITE_CACHE if persistent else ''
+        if path:
+            try:
+                self._db = path
+                self._execute(
+                    f'CREATE TABLE IF NOT EXISTS "{name}" '
+                    '(key TEXT PRIMARY KEY, value BLOB, expires REAL)')
+                self._execute(
+                    f'DELETE FROM "{name}" WHERE expires < ?', (time(),))
+            except SQLiteError:
+                logger.exception('could not open cache %s at %s', name, path)
+                self._db = None
+        else:
+            self._db = None
+
+    def _execute(self, sql: str, params: tuple = ()) -> list:
+        connection, lock = _connection(self._db)
+        with lock, connection:
+            return connection.execute(sql, params).fetchall()
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        """Return the cached value for key or default if there is none."""
+        now = time()
+        with self._lock:
+            if (item := self._data.get(key)) is not None:
+                if item[0] > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return item[1]
+                del self._data[key]
+        if self._db is not None:
+            try:
+                rows = self._execute(
+                    f'SELECT value, expires FROM "{self.name}" '
+                    'WHERE key = ? AND expires > ?', (str(key), now))
+            except SQLiteError:
+                logger.exception('cache %s', self.name)
+                rows = None
+            if rows:
+                value, expires = loads(rows[0][0]), rows[0][1]
+                self._remember(key, value, expires)
+                with self._lock:
+                    self.hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return default
+
+    def _remember(self, key: Hashable, value: Any, expires: float) -> None:
+        with self._lock:
+            data = self._data
+            data[key] = expires, value
+            data.move_to_end(key)
+            while len(data) > self.maxsize:
+                data.popitem(last=False)
+
+    def set(self, key: Hashable, value: Any, ttl: float = None) -> None:
+        """Cache value for ttl seconds (defaults to self.ttl)."""
+        expires = time() + (self.ttl if ttl is None else ttl)
+        self._remember(key, value, expires)
+        if self._db is not None:
+            try:
+                self._execute(
+                    f'INSERT OR REPLACE INTO "{self.name}" VALUES (?, ?, ?)',
+                    (str(key), dumps(value, HIGHEST_PROTOCOL), expires))
+            except SQLiteError:
+                logger.exception('cache %s', self.name)
+
+    def update(
+        self, items: Iterable[Tuple[Hashable, Any]], ttl: float = None
+    ) -> None:
+        """Cache all the (key, value) pairs of items."""
+        for key, value in items:
+            self.set(key, value, ttl)
+
+    def pop(self, key: Hashable) -> None:
+        """Remove key from memory and disk."""
+        with self._lock:
+            self._data.pop(key, None)
+        if self._db is not None:
+            self._execute(
+                f'DELETE FROM "{self.name}" WHERE key = ?', (str(key),))
+
+    def clear(self) -> None:
+        """Remove all entries and reset the counters."""
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+        if self._db is not None:
+            self._execute(f'DELETE FROM "{self.name}"')
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        """Return size and hit/miss counters of the cache."""
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'persistent': self._db is not None,
+        }
+
+
+class SingleFlight:
+
+    """Share one execution among concurrent calls having the same key.
+
+    While a call for a key is in progress, other threads calling do with the
+    same key wait for it and receive the same result or exception instead of
+    calling func themselves. ado does the same for coroutines running in an
+    event loop. The number of such calls is kept in deduplicated.
+    """
+
+    __slots__ = ('name', 'deduplicated', '_calls', '_lock', '_tasks')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.deduplicated = 0
+        # key -> [event, result, exception]
+        self._calls: Dict[Hashable, List[Any]] = {}
+        self._lock = Lock()
+        # key -> Task of the in-flight coroutine of ado
+        self._tasks: Dict[Hashable, Task] = {}
+
+    def do(self, key: Hashable, func: Callable, *args) -> Any:
+        """Return func(*args) or the result of an in-flight call for key."""
+        with self._lock:
+            if (call := self._calls.get(key)) is None:
+                call = self._calls[key] = [Event(), None, None]
+                leader = True
+            else:
+                self.deduplicated += 1
+                leader = False
+        event = call[0]
+        if not leader:
+            event.wait()
+            if (exception := call[2]) is not None:
+                raise exception
+            return call[1]
+        try:
+            call[1] = result = func(*args)
+        except BaseException as e:
+            call[2] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            event.set()
+        return result
+
+    async def ado(self, key: Hashable, func: Callable, *args) -> Any:
+        """Return await func(*args) or the result of an in-flight call.
+
+        The coroutine runs in a task of its own, so it is not cancelled
+        with the caller that started it while others wait for it.
+        """
+        loop = get_running_loop()
+        task = self._tasks.get(key)
+        if task is None or task.get_loop() is not loop:  # e.g. asyncio.run
+            task = self._tasks[key] = loop.create_task(func(*args))
+
+            def done(_):
+                if self._tasks.get(key) is task:
+                    del self._tasks[key]
+
+            task.add_done_callback(done)
+        else:
+            self.deduplicated += 1
+        return await shield(task)
+
+    def stats(self) -> dict:
+        """Return the number of in-flight and deduplicated calls."""
+        return {
+            'in_flight': len(self._calls) + len(self._tasks),
+            'deduplicated': self.deduplicated,
+        }
+
+
+logger = getLogger(__name__)
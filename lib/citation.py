@@ -0,0 +1,161 @@
+"""The record that resolvers return and the generators turn into citations."""
+
+from collections.abc import Mapping, MutableMapping
+from datetime import date as datetime_date
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+# {key: attribute} of the fields that are used by generator_en and
+# generator_fa. Keys are the names that resolvers have always used.
+FIELDS: Dict[str, str] = {k: k.replace('-', '_') for k in (
+    'cite_type', 'date_format', 'title', 'authors', 'editors', 'translators',
+    'others', 'journal', 'container-title', 'website', 'booktitle', 'chapter',
+    'publisher', 'organization', 'address', 'publisher-location', 'edition',
+    'series', 'volume', 'issue', 'number', 'page', 'date', 'year', 'month',
+    'language', 'isbn', 'issn', 'pmid', 'pmcid', 'doi', 'oclc', 'jstor',
+    'jstor-access', 'url', 'archive-url', 'archive-date', 'url-status',
+)}
+_ATTRIBUTES = frozenset(FIELDS.values())
+
+Names = List[Tuple[str, str]]  # [(first, last), ...]
+
+
+class Citation(MutableMapping):
+
+    """A record with a fixed set of fields and an extras dict for the rest.
+
+    Fields that are not set are None, e.g. `c.title` or `c['title']`. Other
+    keys, e.g. raw fields of a RIS or BibTeX entry, are kept in `extras`.
+    The mapping interface is that of the `defaultdict(lambda: None)` that
+    resolvers used to return, except that reading a missing key does not
+    add it. Citation(mapping) converts such dicts, including those stored
+    in persistent caches.
+    """
+
+    __slots__ = (*FIELDS.values(), 'extras')
+
+    cite_type: Optional[str]
+    date_format: Optional[str]
+    title: Optional[str]
+    authors: Optional[Names]
+    editors: Optional[Names]
+    translators: Optional[Names]
+    others: Optional[Names]
+    journal: Optional[str]
+    container_title: Optional[str]
+    website: Optional[str]
+    booktitle: Optional[str]
+    chapter: Optional[str]
+    publisher: Optional[str]
+    organization: Optional[str]
+    address: Optional[str]
+    publisher_location: Optional[str]
+    edition: Optional[str]
+    series: Optional[str]
+    volume: Optional[str]
+    issue: Optional[str]
+    number: Optional[str]
+    page: Optional[str]
+    date: Optional[Union[datetime_date, str]]
+    year: Optional[str]
+    month: Optional[str]
+    language: Optional[str]
+    isbn: Optional[str]
+    issn: Optional[str]
+    pmid: Optional[str]
+    pmcid: Optional[str]
+    doi: Optional[str]
+    oclc: Optional[str]
+    jstor: Optional[str]
+    jstor_access: Any
+    url: Optional[str]
+    archive_url: Optional[str]
+    archive_date: Optional[datetime_date]
+    url_status: Optional[str]
+    extras: Dict[str, Any]
+
+    def __init__(self, mapping: Mapping = (), /, **fields):
+        self.extras = {}
+        self.update(mapping, **fields)
+
+    def __getattr__(self, name: str):
+        # only called for unset slots and missing attributes
+        if name in _ATTRIBUTES:
+            return None
+        raise AttributeError(name)
+
+    def __getitem__(self, key: str):
+        if (member := _MEMBERS.get(key)) is None:
+            return self.extras.get(key)
+        try:
+            return member.__get__(self)
+        except AttributeError:
+            return None
+
+    def __setitem__(self, key: str, value) -> None:
+        if (member := _MEMBERS.get(key)) is None:
+            self.extras[key] = value
+        else:
+            member.__set__(self, value)
+
+    def __delitem__(self, key: str) -> None:
+        if (member := _MEMBERS.get(key)) is None:
+            del self.extras[key]
+            return
+        try:
+            member.__delete__(self)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __contains__(self, key) -> bool:
+        if (member := _MEMBERS.get(key)) is None:
+            return key in self.extras
+        try:
+            member.__get__(self)
+        except AttributeError:
+            return False
+        return True
+
+    def __iter__(self) -> Iterator[str]:
+        for key, member in _MEMBERS.items():
+            try:
+                member.__get__(self)
+            except AttributeError:
+                continue
+            yield key
+        yield from self.extras
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f'Citation({dict(self.items())!r})'
+
+    def get(self, key: str, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def pop(self, key: str, *default):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def setdefault(self, key: str, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def __reduce__(self):
+        # pickle and deepcopy only the keys that are set
+        return Citation, (dict(self.items()),)
+
+    def copy(self) -> 'Citation':
+        return Citation(self)
+
+
+# {key: member descriptor of its slot}
+_MEMBERS = {k: vars(Citation)[a] for k, a in FIELDS.items()}
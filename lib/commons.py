@@ -1,13 +1,24 @@
+import threading
 from calendar import month_abbr, month_name
+from concurrent.futures import FIRST_COMPLETED, Future, \
+    ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
 from datetime import datetime, date as datetime_date
 from functools import partial
 from json import dumps as json_dumps
+from time import monotonic
+from typing import Optional, Tuple
+from urllib.parse import urlparse
 
 from isbnlib import mask as isbn_mask, NotValidISBNError
 from jdatetime import date as jdate
 from regex import compile as regex_compile, VERBOSE, IGNORECASE
-from requests import Session
+from requests import Session, Timeout
+from requests.adapters import HTTPAdapter
 
+import config
+from lib.breaker import breaker
 from config import LANG, SPOOFED_USER_AGENT, NCBI_TOOL, NCBI_EMAIL, USER_AGENT
 
 if LANG == 'en':
@@ -101,7 +112,69 @@ SPOOFED_AGENT_HEADER = {
     'User-Agent': SPOOFED_USER_AGENT,
     'Accept': "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
 }
-REQUEST = partial(Session().request, timeout=10)
+
+# host: (pool size, connect timeout, read timeout)
+# Each of these hosts gets a session of its own so that its connections are
+# kept alive and are not evicted or starved by requests to other websites.
+UPSTREAMS = {
+    'doi.org': (32, 3.05, 10),
+    'api.crossref.org': (16, 3.05, 10),
+    'en.wikipedia.org': (32, 3.05, 20),  # citoid can be slow
+    'eutils.ncbi.nlm.nih.gov': (10, 3.05, 10),
+    'www.ncbi.nlm.nih.gov': (10, 3.05, 10),
+    'www.worldcat.org': (8, 3.05, 10),
+    'books.google.com': (16, 3.05, 10),
+    'www.jstor.org': (8, 3.05, 10),
+    'msapi.ketab.ir': (8, 5, 10),
+    'ketab.ir': (8, 5, 10),
+    'www.noormags.ir': (8, 5, 10),
+    'www.noorlib.ir': (8, 5, 10),
+    'web.archive.org': (16, 5, 20),
+} | getattr(config, 'UPSTREAMS', {})
+# (pool size, connect timeout, read timeout) of all other hosts, e.g. news
+# websites. They share one session which keeps the pools of up to
+# OTHER_HOSTS_POOLS recently used hosts.
+OTHER_HOSTS = getattr(config, 'OTHER_HOSTS', (4, 3.05, 10))
+OTHER_HOSTS_POOLS = 256
+
+
+def new_session(pool_connections: int, pool_maxsize: int) -> Session:
+    session = Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+# host: (session, (connect timeout, read timeout)); all created on import,
+# so looking them up needs no lock. Sessions are shared between threads.
+# The connection pools of urllib3 are thread-safe.
+SESSIONS = {
+    # a few extra pools for redirects to other hosts, e.g. doi.org -> crossref
+    host: (new_session(4, size), (connect, read))
+    for host, (size, connect, read) in UPSTREAMS.items()}
+OTHER_HOSTS_SESSION = (
+    new_session(OTHER_HOSTS_POOLS, OTHER_HOSTS[0]), OTHER_HOSTS[1:])
+
+# monotonic() time by which the current user request should be answered.
+# Set by app using the deadline context manager. Use the Thread class of this
+# module to carry it into new threads.
+DEADLINE: ContextVar[Optional[float]] = ContextVar('deadline', default=None)
+# {(url, spoof, headers): Future of the response} of the GET requests sent
+# while resolving the current user request. Set by app using the fetch_memo
+# context manager, so that resolvers fetching the same URL share a response.
+FETCHES: ContextVar[Optional[dict]] = ContextVar('fetches', default=None)
+# GET requests to these hosts are sent again if no response is received in
+# HEDGE_DELAY seconds. The first successful response of the two is used.
+HEDGED_HOSTS = getattr(config, 'HEDGED_HOSTS', {'doi.org', 'en.wikipedia.org'})
+HEDGE_DELAY = getattr(config, 'HEDGE_DELAY', 1.)
+# Hedged requests are sent on HEDGE_EXECUTOR. While all of its threads are
+# busy, requests are sent once on the calling thread.
+HEDGE_WORKERS = 64
+HEDGE_EXECUTOR = ThreadPoolExecutor(
+    HEDGE_WORKERS, thread_name_prefix='hedge')
+_hedge_slots = threading.BoundedSemaphore(HEDGE_WORKERS)
 
 # original regex from:
 # https://www.debuggex.com/r/0Npla56ipD5aeTr9
@@ -147,11 +220,193 @@ class ReturnError(RuntimeError):
     """
 
 
-def request(url, spoof=False, method='get', **kwargs):
+class DeadlineExceededError(Timeout):
+
+    """Raise instead of sending a request after DEADLINE has passed."""
+
+
+class Thread(threading.Thread):
+
+    """A Thread that runs in a copy of the context of its creator.
+
+    This carries DEADLINE and FETCHES into the threads started by the
+    resolvers.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._context = copy_context()
+
+    def run(self):
+        self._context.run(super().run)
+
+
+@contextmanager
+def deadline(seconds: float):
+    """Limit the total time of the requests sent in the with block."""
+    new = monotonic() + seconds
+    if (current := DEADLINE.get()) is not None and current < new:
+        new = current
+    token = DEADLINE.set(new)
+    try:
+        yield
+    finally:
+        DEADLINE.reset(token)
+
+
+@contextmanager
+def fetch_memo():
+    """Send each simple GET request of the with block only once.
+
+    Later requests for the same URL, including the ones sent concurrently
+    from other threads, receive the response of the first one. Errors and
+    responses with an error status are only shared with the concurrent
+    requests; later ones are sent again.
+    """
+    token = FETCHES.set({})
+    try:
+        yield
+    finally:
+        FETCHES.reset(token)
+
+
+def request(url, spoof=False, method='get', memo=True, **kwargs):
+    """Send the request, or reuse the response of fetch_memo if memo."""
+    if (
+        not memo or (fetches := FETCHES.get()) is None
+        or method != 'get' or kwargs.keys() - {'headers', 'timeout'}
+    ):
+        return send_request(url, spoof, method, **kwargs)
+    key = (url, spoof, repr(kwargs.get('headers')))
+    if (future := fetches.setdefault(key, new := Future())) is not new:
+        return future.result()
+    try:
+        r = send_request(url, spoof, method, **kwargs)
+    except BaseException as e:
+        del fetches[key]
+        future.set_exception(e)
+        raise
+    if r.status_code >= 400:
+        del fetches[key]
+    future.set_result(r)
+    return r
+
+
+def budget_timeout(url: str, timeout: tuple) -> Tuple[tuple, bool]:
+    """Return (timeout, budget_limited) of a request to url.
+
+    timeout is shortened to the time that remains until DEADLINE, in which
+    case budget_limited is True. Raise DeadlineExceededError if no time
+    remains.
+    """
+    if (deadline_ := DEADLINE.get()) is None:
+        return timeout, False
+    if (remaining := deadline_ - monotonic()) <= 0:
+        raise DeadlineExceededError(f'deadline exceeded before {url}')
+    if remaining < timeout[1]:
+        return (min(timeout[0], remaining), remaining), True
+    return timeout, False
+
+
+def send_request(url, spoof=False, method='get', **kwargs):
     headers = SPOOFED_AGENT_HEADER if spoof else AGENT_HEADER
     if 'headers' in kwargs:
-        headers |= kwargs.pop('headers')
-    return REQUEST(method, url, headers=headers, **kwargs)
+        headers = headers | kwargs.pop('headers')
+    host = urlparse(url).hostname
+    session, timeout = SESSIONS.get(host, OTHER_HOSTS_SESSION)
+    timeout, budget_limited = budget_timeout(url, timeout)
+    kwargs.setdefault('timeout', timeout)
+    host_breaker = breaker(host)
+    host_breaker.before()  # raises CircuitOpenError if host is unhealthy
+    failed = True
+    start = monotonic()
+    try:
+        if (
+            host in HEDGED_HOSTS and method == 'get'
+            and not kwargs.get('stream')
+        ):
+            r = hedged(session.request, method, url, headers=headers, **kwargs)
+        else:
+            r = session.request(method, url, headers=headers, **kwargs)
+        failed = r.status_code >= 500
+        return r
+    except Timeout:
+        # not the fault of the host if its timeout was cut short
+        failed = not budget_limited
+        raise
+    finally:
+        host_breaker.after(failed, monotonic() - start)
+
+
+def hedged(send: callable, *args, **kwargs):
+    """Return the first successful response of send(*args, **kwargs).
+
+    The request is sent on HEDGE_EXECUTOR. If there is no response after
+    HEDGE_DELAY seconds, a duplicate is sent, and the first of the two that
+    succeeds is returned while the other one is closed. The request is sent
+    once on the calling thread if the deadline is less than HEDGE_DELAY away
+    or HEDGE_EXECUTOR has no idle thread.
+    """
+    if (
+        (deadline_ := DEADLINE.get()) is not None
+        and deadline_ - monotonic() < HEDGE_DELAY
+    ) or not _hedge_slots.acquire(blocking=False):
+        return send(*args, **kwargs)
+    attempts = [submit_hedge(send, args, kwargs)]
+    # The calling thread waits anyway, so it also schedules the duplicate.
+    if (
+        wait(attempts, HEDGE_DELAY).not_done
+        and _hedge_slots.acquire(blocking=False)
+    ):
+        attempts.append(submit_hedge(send, args, kwargs))
+    pending = attempts
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is not None:
+                continue
+            for other in attempts:
+                if other is not future:
+                    other.add_done_callback(close_response)
+            return future.result()
+    return attempts[0].result()  # raises the error of the first attempt
+
+
+def submit_hedge(send: callable, args: tuple, kwargs: dict) -> Future:
+    """Submit send to HEDGE_EXECUTOR using an acquired _hedge_slots."""
+    future = HEDGE_EXECUTOR.submit(send, *args, **kwargs)
+    future.add_done_callback(lambda _: _hedge_slots.release())
+    return future
+
+
+def close_response(future) -> None:
+    if future.exception() is None:
+        future.result().close()
+
+
+def upstream_stats() -> dict:
+    """Return {host: {requests, connections, reused}} of the open pools.
+
+    connections is the number of connections opened and reused is the
+    fraction of requests sent over already open (kept-alive) connections.
+    """
+    stats = {}
+    for session, _ in (*SESSIONS.values(), OTHER_HOSTS_SESSION):
+        pools = session.get_adapter('https://').poolmanager.pools
+        for key in pools.keys():
+            if (pool := pools.get(key)) is None:  # evicted meanwhile
+                continue
+            requests, connections = pool.num_requests, pool.num_connections
+            host = stats.setdefault(
+                pool.host, {'requests': 0, 'connections': 0})
+            host['requests'] += requests
+            host['connections'] += connections
+    for host in stats.values():
+        if requests := host['requests']:
+            host['reused'] = max(requests - host['connections'], 0) / requests
+        else:
+            host['reused'] = 0.
+    return stats
 
 
 def dict_to_sfn_cit_ref(dictionary) -> tuple:
@@ -165,12 +420,17 @@ def dict_to_sfn_cit_ref(dictionary) -> tuple:
     return sfn_cit_ref(dictionary)
 
 
-def scr_to_json(response) -> str:
-    """Generate api JSON response containing sfn, cite and ref."""
+def scr_to_json(response, **extra) -> str:
+    """Generate api JSON response containing sfn, cite and ref.
+
+    Items of extra are added to the JSON object as they are.
+    """
+    sfn, cite, ref = response
     return json_dumps({
-        'reference_tag': response.ref,
-        'citation_template': response.cite,
-        'shortened_footnote': response.sfn,
+        'reference_tag': ref,
+        'citation_template': cite,
+        'shortened_footnote': sfn,
+        **extra,
     })
 
 
@@ -1,47 +1,108 @@
 """Codes related to DOI inputs."""
 
 
-from collections import defaultdict
+from asyncio import gather
 from datetime import datetime
-from typing import Any
-from urllib.parse import unquote_plus
+from logging import getLogger
+from typing import Dict, Iterable, Iterator, List, Tuple
+from urllib.parse import unquote_plus, urlencode
 from html import unescape
 
-from langid import classify
+from requests import HTTPError, JSONDecodeError
 
+import config
+from lib.cache import Cache, MISSING
+from lib.citation import Citation, FIELDS
+from lib.aio import arequest
 from lib.commons import request, DOI_SEARCH
+from lib.language import classify
 from config import LANG
 
+# {lower-cased doi: CSL-JSON of doi.org or None if the DOI was not found}
+CROSSREF_CACHE = Cache(
+    'crossref',
+    maxsize=getattr(config, 'CROSSREF_CACHE_SIZE', 10_000),
+    ttl=getattr(config, 'CROSSREF_CACHE_TTL', 30 * 86_400),
+    persistent=True,
+)
+# How long to remember that a DOI was not found or is invalid.
+CROSSREF_NEGATIVE_TTL = getattr(config, 'CROSSREF_NEGATIVE_TTL', 3600)
+# See https://citation.crosscite.org/docs.html for documentation.
+CSL_JSON_HEADERS = {'Accept': 'application/vnd.citationstyles.csl+json'}
+# Statuses that mean that the DOI is invalid, unknown, or has no CSL-JSON.
+NOT_FOUND_STATUSES = {400, 404, 406}
+
+CROSSREF_WORKS_URL = 'https://api.crossref.org/works'
+# Maximum number of DOIs in each query of get_crossref_dicts.
+CROSSREF_BATCH_SIZE = 100
+# Fields that are lists in the works API but strings in CSL-JSON.
+WORKS_LIST_FIELDS = ('title', 'container-title')
+
 
 def doi_to_dict(doi_or_url, pure=False, date_format='%Y-%m-%d', /) -> dict:
+    dictionary = get_crossref_dict(input_doi(doi_or_url, pure))
+    return set_format_and_language(dictionary, date_format)
+
+
+async def adoi_to_dict(
+    doi_or_url, pure=False, date_format='%Y-%m-%d', /
+) -> dict:
+    """Async variant of doi_to_dict."""
+    dictionary = await aget_crossref_dict(input_doi(doi_or_url, pure))
+    return set_format_and_language(dictionary, date_format)
+
+
+def input_doi(doi_or_url: str, pure: bool) -> str:
     if pure:
-        doi = doi_or_url
-    else:
-        # unescape '&amp;', '&lt;', and '&gt;' in doi_or_url
-        # decode percent encodings
-        decoded_url = unquote_plus(unescape(doi_or_url))
-        doi = DOI_SEARCH(decoded_url)[0]
-    dictionary = get_crossref_dict(doi)
+        return doi_or_url
+    # unescape '&amp;', '&lt;', and '&gt;' in doi_or_url
+    # decode percent encodings
+    decoded_url = unquote_plus(unescape(doi_or_url))
+    return DOI_SEARCH(decoded_url)[0]
+
+
+def set_format_and_language(dictionary: Citation, date_format: str) -> dict:
     dictionary['date_format'] = date_format
     if LANG == 'fa':
         dictionary['language'] = classify(dictionary['title'])[0]
     return dictionary
 
 
-def get_crossref_dict(doi) -> defaultdict:
-    """Return the parsed data of crossref.org for the given DOI."""
-    # See https://citation.crosscite.org/docs.html for documentation.
-    j = request(
-        f'https://doi.org/{doi}',
-        headers={"Accept": "application/vnd.citationstyles.csl+json"}
-    ).json()
+def get_crossref_dict(doi) -> Citation:
+    """Return the parsed data of crossref.org for the given DOI.
+
+    Raise JSONDecodeError if doi.org does not return CSL-JSON, which is also
+    what happens for a DOI cached as not found.
+    """
+    key = doi.lower()
+    if (j := CROSSREF_CACHE.get(key)) is MISSING:
+        j = get_csl_json(doi, key)
+    elif j is None:
+        raise JSONDecodeError(f'{doi=} was not found (cached)', '', 0)
+    return crossref_dict(j)
+
+
+async def aget_crossref_dict(doi) -> Citation:
+    """Async variant of get_crossref_dict."""
+    key = doi.lower()
+    if (j := CROSSREF_CACHE.get(key)) is MISSING:
+        j = await aget_csl_json(doi, key)
+    elif j is None:
+        raise JSONDecodeError(f'{doi=} was not found (cached)', '', 0)
+    return crossref_dict(j)
+
 
-    d : defaultdict[str, Any] = defaultdict(
-        lambda: None, {k.lower(): v for k, v in j.items()})
+def crossref_dict(j: dict) -> Citation:
+    """Convert the CSL-JSON of a DOI to a Citation for generating refs.
 
-    d['cite_type'] = d['type']
+    Only the CSL variables that are also Citation fields are copied.
+    """
+    j = {k.lower(): v for k, v in j.items()}
+    d = Citation({k: v for k, v in j.items() if k in FIELDS})
 
-    if (author := d['author']) is not None:
+    d['cite_type'] = j.get('type')
+
+    if (author := j.get('author')) is not None:
         d['authors'] = [
             (a['given'], a['family']) for a in author if 'given' in a
         ]
@@ -49,7 +110,7 @@ def get_crossref_dict(doi) -> defaultdict:
     if (issn := d['issn']) is not None:
         d['issn'] = issn[0]
 
-    if (published := d['published']) is not None:
+    if (published := j.get('published')) is not None:
         date = published['date-parts'][0]
         if len(date) == 3:
             d['date'] = datetime(*date)
@@ -65,6 +126,151 @@ def get_crossref_dict(doi) -> defaultdict:
     return d
 
 
+def get_csl_json(doi: str, key: str) -> dict:
+    """Return the CSL-JSON of doi and cache it.
+
+    Raise JSONDecodeError if doi is not found or the response is not JSON,
+    and HTTPError for the other error statuses, e.g. 429 or 503. Only found
+    and not found DOIs are cached.
+    """
+    return csl_json(
+        request(f'https://doi.org/{doi}', headers=CSL_JSON_HEADERS), doi, key)
+
+
+async def aget_csl_json(doi: str, key: str) -> dict:
+    """Async variant of get_csl_json."""
+    return csl_json(
+        await arequest(f'https://doi.org/{doi}', headers=CSL_JSON_HEADERS),
+        doi, key)
+
+
+def csl_json(r, doi: str, key: str) -> dict:
+    """Return the CSL-JSON of the response r of doi.org, see get_csl_json.
+
+    r is the response of requests or httpx.
+    """
+    if (status := r.status_code) in NOT_FOUND_STATUSES:
+        CROSSREF_CACHE.set(key, None, CROSSREF_NEGATIVE_TTL)
+        raise JSONDecodeError(f'{doi=} was not found ({status})', '', 0)
+    if status >= 400:
+        raise HTTPError(f'{status} response for {doi=}', response=r)
+    try:
+        j = r.json()
+    except ValueError as e:  # the JSONDecodeError of requests or json
+        raise JSONDecodeError(f'{doi=} did not return JSON: {e}', '', 0)
+    CROSSREF_CACHE.set(key, j)
+    return j
+
+
+def get_crossref_dicts(
+    dois: Iterable[str], fallback: bool = True
+) -> Dict[str, Citation]:
+    """Return {doi: get_crossref_dict(doi)} for the DOIs that can be found.
+
+    DOIs that are not cached are first looked up using the works API of
+    Crossref, CROSSREF_BATCH_SIZE DOIs per request. If fallback is True, the
+    rest, e.g. DOIs of other registration agencies, are resolved one by one
+    using doi.org. Otherwise they are left out of the result.
+    """
+    dois = [*dois]
+    jsons, missing = cached_csl_jsons(dois)
+    for url, size in works_queries(missing):
+        # noinspection PyBroadException
+        try:
+            items = request(url).json()['message']['items']
+        except Exception:
+            logger.exception('crossref works query of %d DOIs', size)
+            continue
+        cache_works_items(items, missing, jsons)
+    for key, doi in missing.items() if fallback else ():
+        # noinspection PyBroadException
+        try:
+            jsons[key] = get_csl_json(doi, key)
+        except Exception:
+            logger.exception('could not resolve %s', doi)
+    return crossref_dicts(dois, jsons)
+
+
+async def aget_crossref_dicts(
+    dois: Iterable[str], fallback: bool = True
+) -> Dict[str, Citation]:
+    """Async variant of get_crossref_dicts. The queries run concurrently."""
+    dois = [*dois]
+    jsons, missing = cached_csl_jsons(dois)
+
+    async def query(url: str, size: int):
+        # noinspection PyBroadException
+        try:
+            items = (await arequest(url)).json()['message']['items']
+        except Exception:
+            logger.exception('crossref works query of %d DOIs', size)
+            return
+        cache_works_items(items, missing, jsons)
+
+    await gather(*[query(*q) for q in works_queries(missing)])
+
+    async def fallback_query(key: str, doi: str):
+        # noinspection PyBroadException
+        try:
+            jsons[key] = await aget_csl_json(doi, key)
+        except Exception:
+            logger.exception('could not resolve %s', doi)
+
+    if fallback:
+        await gather(*[fallback_query(*i) for i in missing.items()])
+    return crossref_dicts(dois, jsons)
+
+
+def cached_csl_jsons(dois: List[str]) -> Tuple[dict, dict]:
+    """Return ({key: CSL-JSON}, {key: doi}) of the cached and missing dois.
+
+    key is the lower-cased doi. DOIs cached as not found are in neither.
+    """
+    jsons = {}
+    missing = {}
+    for doi in dois:
+        key = doi.lower()
+        if (j := CROSSREF_CACHE.get(key)) is MISSING:
+            missing[key] = doi
+        elif j is not None:
+            jsons[key] = j
+    return jsons, missing
+
+
+def works_queries(missing: dict) -> Iterator[Tuple[str, int]]:
+    """Yield (url, number of DOIs) of the works API queries of missing."""
+    # commas separate the values in the filter parameter
+    keys = [k for k in missing if ',' not in k]
+    for i in range(0, len(keys), CROSSREF_BATCH_SIZE):
+        chunk = keys[i:i + CROSSREF_BATCH_SIZE]
+        yield CROSSREF_WORKS_URL + '?' + urlencode({
+            'filter': ','.join('doi:' + k for k in chunk),
+            'rows': len(chunk),
+        }), len(chunk)
+
+
+def cache_works_items(items: list, missing: dict, jsons: dict) -> None:
+    """Move the found items of missing to jsons and CROSSREF_CACHE."""
+    for item in items:
+        if missing.pop(key := item['DOI'].lower(), None) is None:
+            continue
+        item.pop('reference', None)  # large and unused
+        for field in WORKS_LIST_FIELDS:
+            if (value := item.get(field)) is not None:
+                if value:
+                    item[field] = value[0]
+                else:
+                    del item[field]
+        CROSSREF_CACHE.set(key, item)
+        jsons[key] = item
+
+
+def crossref_dicts(dois: List[str], jsons: dict) -> Dict[str, Citation]:
+    return {
+        doi: crossref_dict(j) for doi in dois
+        if (j := jsons.get(doi.lower())) is not None}
+
+
 def extract_names(d: dict, from_key: str, to_key: str):
     if (from_values := d[from_key]) is None:
         return
@@ -75,3 +281,6 @@ def extract_names(d: dict, from_key: str, to_key: str):
             authors_append((from_value['given'], from_value['family']))
         except KeyError:
             pass
+
+
+logger = getLogger(__name__)
@@ -3,11 +3,11 @@
 
 from datetime import date as datetime_date
 from functools import partial
-from collections import defaultdict
 from logging import getLogger
 
 from regex import compile as regex_compile
 
+from lib.citation import Citation
 from lib.language import TO_TWO_LETTER_CODE
 
 
@@ -88,7 +88,7 @@ TYPE_TO_CITE = {
 }.get
 
 
-def sfn_cit_ref(d: defaultdict) -> tuple:
+def sfn_cit_ref(d: Citation) -> tuple:
     """Return sfn, citation, and ref."""
     date_format = d['date_format']
     if not (cite_type := TYPE_TO_CITE(d['cite_type'])):
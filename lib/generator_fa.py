@@ -1,12 +1,12 @@
 """Codes required to create citation templates for wikifa."""
 
 
-from collections import defaultdict
 from datetime import date
 from logging import getLogger
 from random import seed as randseed, choice as randchoice
 from string import digits, ascii_lowercase
 
+from lib.citation import Citation
 from lib.generator_en import (
     DOI_URL_MATCH, sfn_cit_ref as en_citations, fullname)
 from lib.language import TO_TWO_LETTER_CODE
@@ -85,7 +85,7 @@ LOWER_ALPHA_DIGITS = digits + ascii_lowercase
 DIGITS_TO_FA = str.maketrans('0123456789', '۰۱۲۳۴۵۶۷۸۹')
 
 
-def sfn_cit_ref(d: defaultdict) -> tuple:
+def sfn_cit_ref(d: Citation) -> tuple:
     """Return sfn, citation, and ref."""
     if not (cite_type := TYPE_TO_CITE(d['cite_type'])):
         logger.warning('Unknown citation type: %s, d: %s', cite_type, d)
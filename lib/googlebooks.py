@@ -1,30 +1,82 @@
+from copy import deepcopy
 from urllib.parse import parse_qs
 
-from langid import classify
-
+import config
+from lib.aio import arequest
+from lib.cache import Cache, MISSING, SingleFlight
+from lib.citation import Citation
 from lib.commons import request
+from lib.language import classify
 from lib.ris import ris_parse
 
 
+# All Google Books domains serve the same RIS file for a volume.
+RIS_URL = 'https://books.google.com/books/download/?id={}&output=ris'
+# {volume id: parsed RIS of the volume}. Pages of the same book share one
+# entry; the page and the url of each request are set on a copy.
+VOLUME_CACHE = Cache(
+    'google_books',
+    maxsize=getattr(config, 'GOOGLE_BOOKS_CACHE_SIZE', 10_000),
+    ttl=getattr(config, 'GOOGLE_BOOKS_CACHE_TTL', 30 * 86_400),
+    persistent=True,
+)
+VOLUME_IN_FLIGHT = SingleFlight('google_books')
+
+
 def url_to_dict(parsed_url, date_format='%Y-%m-%d') -> dict:
     """Create the response namedtuple."""
-    parsed_query = parse_qs(parsed_url.query)
+    parsed_query, volume_id = volume_id_of(parsed_url)
+    if (volume := VOLUME_CACHE.get(volume_id)) is MISSING:
+        volume = VOLUME_IN_FLIGHT.do(volume_id, fetch_volume, volume_id)
+    return page_dict(volume, parsed_query, date_format)
+
 
+async def aurl_to_dict(parsed_url, date_format='%Y-%m-%d') -> dict:
+    """Async variant of url_to_dict."""
+    parsed_query, volume_id = volume_id_of(parsed_url)
+    if (volume := VOLUME_CACHE.get(volume_id)) is MISSING:
+        volume = await VOLUME_IN_FLIGHT.ado(
+            volume_id, afetch_volume, volume_id)
+    return page_dict(volume, parsed_query, date_format)
+
+
+def volume_id_of(parsed_url) -> tuple:
+    """Return (parsed query, volume id) of a Google Books URL."""
+    parsed_query = parse_qs(parsed_url.query)
     if (id_ := parsed_query.get('id')) is not None:
-        volume_id = id_[0]
-    else:  # the new URL format
-        volume_id = parsed_url.path.rpartition('/')[2]
+        return parsed_query, id_[0]
+    # the new URL format
+    return parsed_query, parsed_url.path.rpartition('/')[2]
+
 
-    dictionary = ris_parse(request(
-        f'https://{parsed_url.netloc}/books/download/?id={volume_id}'
-        f'&output=ris', spoof=True).content.decode('utf8'))
+def page_dict(volume: dict, parsed_query: dict, date_format: str) -> dict:
+    """Return the Citation of the page of volume that the query points to."""
+    dictionary = Citation(deepcopy(volume))
     dictionary['date_format'] = date_format
     # manually adding page number to dictionary:
     if (pg := parsed_query.get('pg')) is not None:
         pg0 = pg[0]
         dictionary['page'] = pg0[2:]
         dictionary['url'] += f'&pg={pg0}'
-    # although google does not provide a language field:
-    if not dictionary['language']:
-        dictionary['language'] = classify(dictionary['title'])[0]
     return dictionary
+
+
+def fetch_volume(volume_id: str) -> dict:
+    """Return the parsed RIS of volume_id and store it in VOLUME_CACHE."""
+    return cache_volume(volume_id, request(
+        RIS_URL.format(volume_id), spoof=True).content)
+
+
+async def afetch_volume(volume_id: str) -> dict:
+    """Async variant of fetch_volume."""
+    return cache_volume(volume_id, (await arequest(
+        RIS_URL.format(volume_id), spoof=True)).content)
+
+
+def cache_volume(volume_id: str, ris: bytes) -> dict:
+    d = ris_parse(ris.decode('utf8'))
+    # although google does not provide a language field:
+    if not d['language']:
+        d['language'] = classify(d['title'])[0]
+    VOLUME_CACHE.set(volume_id, d := dict(d))
+    return d
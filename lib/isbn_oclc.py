@@ -1,20 +1,50 @@
-from collections import defaultdict
+from asyncio import gather
 from logging import getLogger
-from threading import Thread
-from typing import Optional, Any
+from typing import Iterable, Optional, Tuple
 from json import loads
 
-from langid import classify
 from isbnlib import info as isbn_info
+from requests import HTTPError
 
+import config
 from config import LANG
+from lib.breaker import available
+from lib.cache import Cache, MISSING, SingleFlight
+from lib.citation import Citation
+from lib.aio import arequest
+from lib.ketabir import aurl_to_dict as ketabir_aurl_to_dict, \
+    aisbn_to_url as ketabir_aisbn2url
 from lib.ketabir import url_to_dict as ketabir_url_to_dict
 from lib.ketabir import isbn_to_url as ketabir_isbn2url
 from lib.commons import request, ISBN13_SEARCH, ISBN10_SEARCH, ReturnError, \
-    FOUR_DIGIT_NUM
+    FOUR_DIGIT_NUM, Thread
+from lib.language import classify
 
 
 RM_DASH_SPACE = str.maketrans('', '', '- ')
+CITOID_URL = 'https://en.wikipedia.org/api/rest_v1/data/citation/mediawiki/'
+WORLDCAT_URL = 'https://www.worldcat.org/title/'
+
+# Book metadata rarely changes. The keys are 'isbn_<LANG>:<ISBN-13>' for the
+# combined results of isbn_to_dict (which depend on LANG), '<source>:<ISBN-13>'
+# for the results of each source (ketabir and citoid) and 'oclc:<number>' for
+# oclc_dict. ISBN-13s are the canonical_isbn of the input.
+BOOK_CACHE = Cache(
+    'books',
+    maxsize=getattr(config, 'BOOK_CACHE_SIZE', 10_000),
+    ttl=getattr(config, 'BOOK_CACHE_TTL', 365 * 86_400),
+    persistent=True,
+)
+# The same keys for the lookups that found nothing, except that the
+# combined results use 'isbn:<ISBN-13>'.
+BOOK_NOT_FOUND_CACHE = Cache(
+    'books_not_found',
+    maxsize=getattr(config, 'BOOK_CACHE_SIZE', 10_000),
+    ttl=getattr(config, 'BOOK_NOT_FOUND_TTL', 86_400),
+    persistent=True,
+)
+# Concurrent lookups of the same book, keyed on canonical_isbn.
+BOOK_IN_FLIGHT = SingleFlight('books')
 
 
 class IsbnError(Exception):
@@ -29,6 +59,34 @@ def isbn_to_dict(
     pure: bool = False,
     date_format: str = '%Y-%m-%d',
 ) -> dict:
+    isbn, isbn13, key, d = cached_isbn(isbn_container_str, pure)
+    if d is MISSING:
+        d = BOOK_IN_FLIGHT.do(key, fetch_and_cache_isbn, isbn, isbn13, key)
+    dictionary = Citation(d)
+    dictionary['date_format'] = date_format
+    return dictionary
+
+
+async def aisbn_to_dict(
+    isbn_container_str: str,
+    pure: bool = False,
+    date_format: str = '%Y-%m-%d',
+) -> dict:
+    """Async variant of isbn_to_dict."""
+    isbn, isbn13, key, d = cached_isbn(isbn_container_str, pure)
+    if d is MISSING:
+        d = await BOOK_IN_FLIGHT.ado(
+            key, afetch_and_cache_isbn, isbn, isbn13, key)
+    dictionary = Citation(d)
+    dictionary['date_format'] = date_format
+    return dictionary
+
+
+def cached_isbn(isbn_container_str: str, pure: bool) -> tuple:
+    """Return (isbn, isbn13, key, cached dict or MISSING).
+
+    Raise IsbnError if the isbn is cached as not found.
+    """
     if pure:
         isbn = isbn_container_str
     else:
@@ -39,17 +97,78 @@ def isbn_to_dict(
             # search for isbn10
             isbn = ISBN10_SEARCH(isbn_container_str)[0]
 
-    if (iranian_isbn := isbn_info(isbn) == 'Iran') is True:
+    isbn13 = canonical_isbn(isbn)
+    key = f'isbn_{LANG}:{isbn13}'
+    if (d := BOOK_CACHE.get(key)) is MISSING:
+        if BOOK_NOT_FOUND_CACHE.get(f'isbn:{isbn13}') is not MISSING:
+            raise IsbnError('Bibliographic information not found.')
+    return isbn, isbn13, key, d
+
+
+def fetch_and_cache_isbn(isbn: str, isbn13: int, key: str) -> dict:
+    """Return fetch_isbn(...) and cache it if all the sources responded."""
+    iranian_isbn, skip_ketabir = ketabir_usage(isbn)
+    failures = []
+    try:
+        d = fetch_isbn(
+            isbn, isbn13, iranian_isbn and not skip_ketabir, failures)
+    except IsbnError:
+        if not (skip_ketabir or failures):
+            BOOK_NOT_FOUND_CACHE.set(f'isbn:{isbn13}', True)
+        raise
+    return cache_isbn(d, key, skip_ketabir or failures)
+
+
+async def afetch_and_cache_isbn(isbn: str, isbn13: int, key: str) -> dict:
+    """Async variant of fetch_and_cache_isbn."""
+    iranian_isbn, skip_ketabir = ketabir_usage(isbn)
+    failures = []
+    try:
+        d = await afetch_isbn(
+            isbn, isbn13, iranian_isbn and not skip_ketabir, failures)
+    except IsbnError:
+        if not (skip_ketabir or failures):
+            BOOK_NOT_FOUND_CACHE.set(f'isbn:{isbn13}', True)
+        raise
+    return cache_isbn(d, key, skip_ketabir or failures)
+
+
+def ketabir_usage(isbn: str) -> Tuple[bool, bool]:
+    """Return (whether isbn is Iranian, whether to skip ketab.ir)."""
+    iranian_isbn = isbn_info(isbn) == 'Iran'
+    # Do not wait for ketab.ir while it is down, but do not cache the result
+    # either.
+    skip_ketabir = iranian_isbn and not (
+        available('msapi.ketab.ir') and available('ketab.ir'))
+    return iranian_isbn, skip_ketabir
+
+
+def cache_isbn(d: dict, key: str, partial: bool) -> dict:
+    if not partial:
+        BOOK_CACHE.set(key, d := dict(d))
+    else:
+        d['partial'] = True  # not to be cached by app either
+    return d
+
+
+def fetch_isbn(
+    isbn: str, isbn13: int, iranian_isbn: bool, failures: list
+) -> dict:
+    """Return the combined results of ketab.ir and citoid for isbn.
+
+    Sources that raise an exception are appended to failures.
+    """
+    if iranian_isbn is True:
         ketabir_result_list = []
         ketabir_thread = Thread(
             target=ketabir_thread_target,
-            args=(isbn, ketabir_result_list))
+            args=(isbn, isbn13, ketabir_result_list, failures))
         ketabir_thread.start()
 
     citoid_result_list = []
     citoid_thread = Thread(
         target=citoid_thread_target,
-        args=(isbn, citoid_result_list))
+        args=(isbn, isbn13, citoid_result_list, failures))
     citoid_thread.start()
 
     if iranian_isbn is True:
@@ -72,22 +191,91 @@ def isbn_to_dict(
 
     dictionary = combine_dicts(ketabir_dict, citoid_dict)
 
-    dictionary['date_format'] = date_format
     if 'language' not in dictionary:
         dictionary['language'] = classify(dictionary['title'])[0]
     return dictionary
 
 
-def ketabir_thread_target(isbn: str, result: list) -> None:
+async def afetch_isbn(
+    isbn: str, isbn13: int, iranian_isbn: bool, failures: list
+) -> dict:
+    """Async variant of fetch_isbn."""
+    sources = [('citoid', aget_citoid_dict)]
+    if iranian_isbn is True:
+        sources.append(('ketabir', aget_ketabir_dict))
+    results = await gather(
+        *[acached_source(source, isbn13, get_dict, isbn)
+          for source, get_dict in sources],
+        return_exceptions=True)
+    dicts = {}
+    for (source, _), result in zip(sources, results):
+        if isinstance(result, Exception):
+            logger.error('isbn: %s', isbn, exc_info=result)
+            failures.append(source)
+        else:
+            dicts[source] = result
+
+    dictionary = combine_dicts(dicts.get('ketabir'), dicts.get('citoid'))
+
+    if 'language' not in dictionary:
+        dictionary['language'] = classify(dictionary['title'])[0]
+    return dictionary
+
+
+def cached_source(
+    source: str, isbn13: int, get_dict: callable, isbn: str
+) -> Optional[dict]:
+    """Return get_dict(isbn) using BOOK_CACHE and BOOK_NOT_FOUND_CACHE."""
+    key = f'{source}:{isbn13}'
+    if (d := BOOK_CACHE.get(key)) is not MISSING:
+        return Citation(d)
+    if BOOK_NOT_FOUND_CACHE.get(key) is not MISSING:
+        return None
+    return cache_source(key, get_dict(isbn))
+
+
+async def acached_source(
+    source: str, isbn13: int, get_dict: callable, isbn: str
+) -> Optional[dict]:
+    """Async variant of cached_source."""
+    key = f'{source}:{isbn13}'
+    if (d := BOOK_CACHE.get(key)) is not MISSING:
+        return Citation(d)
+    if BOOK_NOT_FOUND_CACHE.get(key) is not MISSING:
+        return None
+    return cache_source(key, await get_dict(isbn))
+
+
+def cache_source(key: str, d: Optional[dict]) -> Optional[dict]:
+    if d:
+        BOOK_CACHE.set(key, dict(d))
+    else:
+        BOOK_NOT_FOUND_CACHE.set(key, True)
+    return d
+
+
+def get_ketabir_dict(isbn: str) -> Optional[dict]:
+    if (url := ketabir_isbn2url(isbn)) is None:
+        return  # ketab.ir does not have any entries for this isbn
+    return ketabir_url_to_dict(url)
+
+
+async def aget_ketabir_dict(isbn: str) -> Optional[dict]:
+    if (url := await ketabir_aisbn2url(isbn)) is None:
+        return  # ketab.ir does not have any entries for this isbn
+    return await ketabir_aurl_to_dict(url)
+
+
+def ketabir_thread_target(
+    isbn: str, isbn13: int, result: list, failures: list
+) -> None:
     # noinspection PyBroadException
     try:
-        if (url := ketabir_isbn2url(isbn)) is None:
-            return  # ketab.ir does not have any entries for this isbn
-        if d := ketabir_url_to_dict(url):
+        if d := cached_source('ketabir', isbn13, get_ketabir_dict, isbn):
             result.append(d)
     except Exception:
         logger.exception('isbn: %s', isbn)
-        return
+        failures.append('ketabir')
 
 
 def combine_dicts(ketabir: dict, citoid: dict) -> dict:
@@ -119,17 +307,48 @@ def isbn2int(isbn):
     return int(isbn.translate(RM_DASH_SPACE))
 
 
+def canonical_isbn(isbn: str) -> int:
+    """Return the ISBN-13 of isbn as an int.
+
+    isbn can be an ISBN-10 or ISBN-13, as matched by ISBN10_SEARCH or
+    ISBN13_SEARCH, i.e. with Latin digits and optional hyphens or spaces.
+    Use this as the key of ISBN caches so that all forms of an ISBN share
+    the same entries.
+    """
+    if len(digits := isbn.translate(RM_DASH_SPACE)) != 10:
+        return isbn2int(digits)
+    # ISBN-10 to ISBN-13: prefix 978 and recalculate the check digit
+    digits = '978' + digits[:9]
+    check = -sum(
+        int(c) * (3 if i % 2 else 1) for i, c in enumerate(digits)) % 10
+    return int(digits) * 10 + check
+
+
 def get_citoid_dict(isbn) -> Optional[dict]:
+    """Return the citoid dict of isbn, or None if citoid does not know it.
+
+    Raise HTTPError for error statuses other than 404, e.g. 429, so that
+    they are not cached as not found.
+    """
     # https://www.mediawiki.org/wiki/Citoid/API
-    r = request(
-        'https://en.wikipedia.org/api/rest_v1/data/citation/mediawiki/' + isbn)
-    if r.status_code != 200:
+    return citoid_dict(request(CITOID_URL + isbn), isbn)
+
+
+async def aget_citoid_dict(isbn) -> Optional[dict]:
+    """Async variant of get_citoid_dict."""
+    return citoid_dict(await arequest(CITOID_URL + isbn), isbn)
+
+
+def citoid_dict(r, isbn) -> Optional[dict]:
+    if (status := r.status_code) == 404:
         return
+    if status != 200:
+        raise HTTPError(f'{status} response from citoid for {isbn=}')
 
     j0 = r.json()[0]
     get = j0.get
 
-    d = defaultdict(lambda: None)
+    d = Citation()
 
     d['cite_type'] = j0['itemType']
     d['isbn'] = j0['ISBN'][0]
@@ -160,25 +379,87 @@ def get_citoid_dict(isbn) -> Optional[dict]:
     return d
 
 
-def citoid_thread_target(isbn: str, result: list) -> None:
-    if citoid_dict := get_citoid_dict(isbn):
-        result.append(citoid_dict)
+def citoid_thread_target(
+    isbn: str, isbn13: int, result: list, failures: list
+) -> None:
+    # noinspection PyBroadException
+    try:
+        if d := cached_source('citoid', isbn13, get_citoid_dict, isbn):
+            result.append(d)
+    except Exception:
+        logger.exception('isbn: %s', isbn)
+        failures.append('citoid')
+
+
+def seed_books(records: Iterable[dict]) -> int:
+    """Store records as the results of isbn_to_dict for their ISBNs and LANG.
+
+    Use this to pre-seed BOOK_CACHE from a bulk export. Each record should
+    be a dict like the ones returned by isbn_to_dict and have at least the
+    isbn, title and cite_type keys. Return the number of stored records.
+    """
+    n = 0
+    for record in records:
+        record = {k: v for k, v in record.items() if k != 'date_format'}
+        isbn13 = canonical_isbn(record['isbn'])
+        if 'language' not in record:
+            record['language'] = classify(record['title'])[0]
+        BOOK_CACHE.set(f'isbn_{LANG}:{isbn13}', record)
+        BOOK_NOT_FOUND_CACHE.pop(f'isbn:{isbn13}')
+        n += 1
+    return n
 
 
 def oclc_dict(oclc: str, date_format: str = '%Y-%m-%d', /) -> dict:
-    content = request('https://www.worldcat.org/title/' + oclc).content
+    key = 'oclc:' + oclc
+    if (d := cached_oclc(key, oclc)) is MISSING:
+        d = get_oclc_dict(oclc)
+        BOOK_CACHE.set(key, dict(d))
+    dictionary = Citation(d)
+    dictionary['date_format'] = date_format
+    return dictionary
+
+
+async def aoclc_dict(oclc: str, date_format: str = '%Y-%m-%d', /) -> dict:
+    """Async variant of oclc_dict."""
+    key = 'oclc:' + oclc
+    if (d := cached_oclc(key, oclc)) is MISSING:
+        d = worldcat_dict((await arequest(WORLDCAT_URL + oclc)).content, oclc)
+        BOOK_CACHE.set(key, dict(d))
+    dictionary = Citation(d)
+    dictionary['date_format'] = date_format
+    return dictionary
+
+
+def cached_oclc(key: str, oclc: str):
+    if (d := BOOK_CACHE.get(key)) is MISSING:
+        if BOOK_NOT_FOUND_CACHE.get(key) is not MISSING:
+            raise_invalid_oclc(oclc)
+    return d
+
+
+def raise_invalid_oclc(oclc: str):
+    raise ReturnError(
+        'Error processing OCLC number: ' + oclc,
+        'Make sure the OCLC identifier is valid.',
+        ''
+    )
+
+
+def get_oclc_dict(oclc: str) -> dict:
+    return worldcat_dict(request(WORLDCAT_URL + oclc).content, oclc)
+
+
+def worldcat_dict(content: bytes, oclc: str) -> dict:
     j = loads(content[
         (s := (f := content.find)(b' type="application/json">') + 25)
         :f(b'</script>', s)
     ])
     record = j['props']['pageProps']['record']
     if record is None:  # invalid OCLC number
-        raise ReturnError(
-            'Error processing OCLC number: ' + oclc,
-            'Make sure the OCLC identifier is valid.',
-            ''
-        )
-    d: defaultdict[str, Any] = defaultdict(lambda: None)
+        BOOK_NOT_FOUND_CACHE.set('oclc:' + oclc, True)
+        raise_invalid_oclc(oclc)
+    d = Citation()
     d['cite_type'] = record['generalFormat'].lower()
     d['title'] = record['title']
     d['authors'] = [
@@ -195,7 +476,6 @@ def oclc_dict(oclc: str, date_format: str = '%Y-%m-%d', /) -> dict:
     if isbn := record['isbn13']:
         d['isbn'] = isbn
     d['oclc'] = oclc
-    d['date_format'] = date_format
     return d
 
 
@@ -1,7 +1,8 @@
-from threading import Thread
+from asyncio import gather
 from urllib.parse import urlparse
 
-from lib.commons import request
+from lib.aio import arequest
+from lib.commons import request, Thread
 from lib.bibtex import parse as bibtex_parse
 
 
@@ -20,6 +21,20 @@ def url_to_dict(url: str, date_format: str = '%Y-%m-%d') -> dict:
     return dictionary
 
 
+async def aurl_to_dict(url: str, date_format: str = '%Y-%m-%d') -> dict:
+    """Async variant of url_to_dict."""
+    id_ = urlparse(url).path.rpartition('/')[2]
+    bibtex_response, page_response = await gather(
+        arequest('https://www.jstor.org/citation/text/' + id_),
+        arequest(url, spoof=True))
+    dictionary = bibtex_parse(bibtex_response.content.decode('utf8'))
+    dictionary['jstor'] = id_
+    dictionary['date_format'] = date_format
+    if '"openAccess" : "True"' in page_response.text:
+        dictionary['jstor-access'] = 'free'
+    return dictionary
+
+
 def is_open_access(url: str, result: list):
     if '"openAccess" : "True"' in request(url, spoof=True).text:
         result.append(True)
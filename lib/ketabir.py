@@ -1,19 +1,20 @@
 """All things that are specifically related to adinebook website"""
 
-from collections import defaultdict
 from logging import getLogger
-from typing import Optional, Any
+from typing import Optional
 
-from langid import classify
 from regex import compile as rc
 from requests import RequestException
-from bs4 import BeautifulSoup
 
+from lib.aio import arequest
+from lib.citation import Citation
 from lib.commons import first_last, request
+from lib.language import classify
 
 
 AUTHORS_FINDALL = rc(r'(\S+?)\s*+:\s*+(.*)').findall
 VOLUME_SEARCH = rc(r'\bجلد (\d+)').search
+SEARCH_URL = 'https://msapi.ketab.ir/search/?query={}&limit=1'
 
 
 def url_to_dict(url: str, date_format='%Y-%m-%d', /) -> dict:
@@ -27,10 +28,28 @@ def url_to_dict(url: str, date_format='%Y-%m-%d', /) -> dict:
     return dictionary
 
 
+async def aurl_to_dict(url: str, date_format='%Y-%m-%d', /) -> dict:
+    """Async variant of url_to_dict."""
+    dictionary = content_to_dict((await arequest(url)).content)
+    dictionary['date_format'] = date_format
+    if 'language' not in dictionary:
+        dictionary['language'] = classify(dictionary['title'])[0]
+    return dictionary
+
+
 def isbn_to_url(isbn: str) -> Optional[str]:
     """Return the ketab.ir book-url for the given isbn."""
-    r = request(f'https://msapi.ketab.ir/search/?query={isbn}&limit=1')
-    j = r.json()
+    r = request(SEARCH_URL.format(isbn))
+    return search_result_url(r.json())
+
+
+async def aisbn_to_url(isbn: str) -> Optional[str]:
+    """Async variant of isbn_to_url."""
+    r = await arequest(SEARCH_URL.format(isbn))
+    return search_result_url(r.json())
+
+
+def search_result_url(j: dict) -> str:
     return 'https://ketab.ir/book/' \
            + j['result']['groups']['printableBook']['items'][0]['url']
 
@@ -43,9 +62,15 @@ def _url_to_dict(ketabir_url: str) -> Optional[dict]:
     except RequestException:
         logger.exception(ketabir_url)
         return
+    return content_to_dict(r.content)
+
 
-    soup = BeautifulSoup(r.content, features='lxml')
-    d : defaultdict[str, Any] = defaultdict(lambda: None, cite_type='book')
+def content_to_dict(content: bytes) -> dict:
+    """Return the Citation of a ketab.ir book page."""
+    # bs4 and lxml are slow to import and only needed here
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(content, features='lxml')
+    d = Citation(cite_type='book')
     d['title'] = soup.select_one('.card-title').text.strip()
 
     table = {(tds := tr.select('td'))[0].text: tds[1] for tr in soup.select('tr')}
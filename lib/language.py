@@ -1,4 +1,5 @@
-"""Provide utilities to convert between language codes and names.
+"""Provide utilities to detect languages and convert between language codes
+and names.
 
 Data Source: http://data.okfn.org/data/core/language-codes
 """
@@ -260,3 +261,13 @@ TO_TWO_LETTER_CODE = {
     'zhuang': 'za',
     'zulu': 'zu'
 }.get
+
+
+def classify(text: str) -> tuple:
+    """Return the (language code, score) of text using langid.
+
+    langid imports numpy and its model is loaded on the first call, so both
+    are deferred until a language is needed. See app.warm_up.
+    """
+    from langid import classify as langid_classify
+    return langid_classify(text)
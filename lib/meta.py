@@ -0,0 +1,85 @@
+"""Single-pass extraction of <meta> tags from an html document."""
+
+from typing import Dict, List, Optional, Tuple
+
+from regex import compile as rc, VERBOSE, IGNORECASE
+
+
+META_TAG_FINDITER = rc(
+    r'''
+    <meta\s
+    (?<attrs>
+        (?>
+            [^>"']++
+            |"[^"]*+"
+            |'[^']*+'
+        )*+
+    )
+    >
+    ''',
+    VERBOSE | IGNORECASE,
+).finditer
+
+ATTR_FINDITER = rc(
+    r'''
+    (?<name>[^\s=/>"']++)
+    \s*+=\s*+
+    (?>
+        "(?<value>[^"]*+)"
+        |'(?<value>[^']*+)'
+        |(?<value>[^\s>"']++)
+    )
+    ''',
+    VERBOSE,
+).finditer
+
+# Name or property attributes written as name="value" with no spaces.
+QUOTED_NAME_FULLMATCH = rc(
+    r'(?>name|property)=(?<q>["\'])[^"\']*+(?P=q)', IGNORECASE
+).fullmatch
+
+# (position of the meta tag, raw name/property attribute, content, leading)
+MetaEntry = Tuple[int, str, str, bool]
+MetaIndex = Dict[str, List[MetaEntry]]
+
+
+def meta_index(html: str) -> MetaIndex:
+    """Return a {name/property: [(start, id, content, leading), ...]} dict.
+
+    Keys are lower-cased values of the name or property attributes of the
+    <meta> tags. Entries are in document order. The id item is the raw text
+    of the name/property attribute and can be used to check if two entries
+    were found using the same criteria. leading is True if the name/property
+    and the content are the first two attributes of the tag.
+    Tags without a non-empty and quoted content attribute are ignored.
+    """
+    index: MetaIndex = {}
+    setdefault = index.setdefault
+    for tag in META_TAG_FINDITER(html):
+        keys = []
+        content = None
+        for i, attr in enumerate(ATTR_FINDITER(tag['attrs'])):
+            attr_name = attr['name'].lower()
+            if attr_name == 'content':
+                if content is None and attr[0][8:9] in ('"', "'"):
+                    content = attr['value']
+                    content_i = i
+            elif attr_name == 'name' or attr_name == 'property':
+                keys.append((attr['value'].lower(), attr[0], i))
+        if not content:
+            continue
+        start = tag.start()
+        for key, id_, i in keys:
+            setdefault(key, []).append(
+                (start, id_, content, i + content_i == 1))
+    return index
+
+
+def first_content(meta: MetaIndex, key: str) -> Optional[str]:
+    """Return the content of the first meta tag with the given name.
+
+    Only name/property attributes in the name="value" form are considered.
+    """
+    for _, id_, content, _ in meta.get(key, ()):
+        if QUOTED_NAME_FULLMATCH(id_) is not None:
+            return content
@@ -2,6 +2,7 @@
 
 from regex import compile as regex_compile
 
+from lib.aio import arequest
 from lib.commons import request
 from lib.bibtex import parse as bibtex_parse
 
@@ -12,27 +13,37 @@ RIS_ARTICLE_ID_SEARCH = regex_compile(r'(?<=RIS&id=)\d+').search
 
 
 def url_to_dict(url: str, date_format: str = '%Y-%m-%d') -> dict:
-    dictionary = bibtex_parse(dict_from_bibtex(url))
+    dictionary = bibtex_parse(dict_from_bibtex(request(url).text))
     dictionary['date_format'] = date_format
     # risr = get_ris(url)[1]
     # dictionary = risr.parse(ris)[1]
     return dictionary
 
 
-def dict_from_bibtex(noorlib_url):
-    """Get bibtex file content from a noormags url. Return as string."""
-    pagetext = request(noorlib_url).text
+async def aurl_to_dict(url: str, date_format: str = '%Y-%m-%d') -> dict:
+    """Async variant of url_to_dict."""
+    page_text = (await arequest(url)).text
+    bibtex = (await arequest(bibtex_url(page_text))).text
+    dictionary = bibtex_parse(bibtex)
+    dictionary['date_format'] = date_format
+    return dictionary
+
+
+def dict_from_bibtex(pagetext):
+    """Get bibtex file content of a noorlib page. Return as string."""
+    return request(bibtex_url(pagetext)).text
+
+
+def bibtex_url(pagetext):
     article_id = BIBTEX_ARTICLE_ID_SEARCH(pagetext)[0]
-    url = 'http://www.noorlib.ir/View/HttpHandler/CitationHandler.ashx?id=' +\
-          article_id + '&format=BibTex'
-    return request(url).text
+    return 'http://www.noorlib.ir/View/HttpHandler/CitationHandler.ashx' \
+        '?id=' + article_id + '&format=BibTex'
 
 
-def dict_from_ris(noorlib_url):
+def dict_from_ris(pagetext):
     # This is copied from noormags module (currently not supported but may
     # be)[1]
-    """Get ris file content from a noormags url. Return as string."""
-    pagetext = request(noorlib_url).text
+    """Get ris file content of a noorlib page. Return as string."""
     article_id = RIS_ARTICLE_ID_SEARCH(pagetext)[0]
     url = 'http://www.noormags.ir/view/CitationHandler.ashx?format=RIS&id=' +\
           article_id
@@ -1,10 +1,12 @@
 """Codes specifically related to Noormags website."""
 
-from threading import Thread
+
+from asyncio import gather
 
 from regex import compile as regex_compile
 
-from lib.commons import request
+from lib.aio import arequest
+from lib.commons import request, Thread
 from lib.bibtex import parse as bibtex_parse
 from lib.ris import ris_parse
 
@@ -15,10 +17,12 @@ RIS_ARTICLE_ID_SEARCH = regex_compile(r'(?<=/citation/ris/)\d+').search
 
 def url_to_dict(url: str, date_format: str = '%Y-%m-%d') -> dict:
     """Create the response namedtuple."""
+    page_text = request(url).text
     ris_collection = {}
-    ris_thread = Thread(target=ris_fetcher_thread, args=(url, ris_collection))
+    ris_thread = Thread(
+        target=ris_fetcher_thread, args=(page_text, ris_collection))
     ris_thread.start()
-    dictionary = bibtex_parse(get_bibtex(url))
+    dictionary = bibtex_parse(get_bibtex(page_text))
     dictionary['date_format'] = date_format
     # language parameter needs to be taken from RIS
     # other information are more accurate in bibtex
@@ -29,25 +33,46 @@ def url_to_dict(url: str, date_format: str = '%Y-%m-%d') -> dict:
     return dictionary
 
 
-def get_bibtex(noormags_url):
-    """Get BibTex file content from a noormags_url. Return as string."""
-    page_text = request(noormags_url).text
+async def aurl_to_dict(url: str, date_format: str = '%Y-%m-%d') -> dict:
+    """Async variant of url_to_dict."""
+    page_text = (await arequest(url)).text
+    bibtex_response, ris_response = await gather(
+        arequest(bibtex_url(page_text)), arequest(ris_url(page_text)))
+    dictionary = bibtex_parse(bibtex_response.text)
+    dictionary['date_format'] = date_format
+    ris_collection = {}
+    update_ris_collection(ris_response.text, ris_collection)
+    dictionary.update(ris_collection)
+    return dictionary
+
+
+def get_bibtex(page_text):
+    """Get BibTex file content of a noormags page. Return as string."""
+    return request(bibtex_url(page_text)).text
+
+
+def bibtex_url(page_text):
     article_id = BIBTEX_ARTICLE_ID_SEARCH(page_text)[0]
-    url = 'http://www.noormags.ir/view/fa/citation/bibtex/' + article_id
-    return request(url).text
+    return 'http://www.noormags.ir/view/fa/citation/bibtex/' + article_id
+
 
+def get_ris(page_text):
+    """Get ris file content of a noormags page. Return as string."""
+    return request(ris_url(page_text)).text
 
-def get_ris(noormags_url):
-    """Get ris file content from a noormags url. Return as string."""
-    page_text = request(noormags_url).text
+
+def ris_url(page_text):
     article_id = RIS_ARTICLE_ID_SEARCH(page_text)[0]
-    return request(
-        'http://www.noormags.ir/view/fa/citation/ris/' + article_id).text
+    return 'http://www.noormags.ir/view/fa/citation/ris/' + article_id
 
 
-def ris_fetcher_thread(url, ris_collection):
+def ris_fetcher_thread(page_text, ris_collection):
     """Fill the ris_dict. This function is called in a thread."""
-    ris_dict = ris_parse(get_ris(url))
+    update_ris_collection(get_ris(page_text), ris_collection)
+
+
+def update_ris_collection(ris, ris_collection):
+    ris_dict = ris_parse(ris)
     if language := ris_dict.get('language'):
         ris_collection['language'] = language
     if authors := ris_dict.get('authors'):
@@ -1,17 +1,22 @@
 """Codes specifically related to PubMed inputs."""
 
-from collections import defaultdict
-from typing import Any
 
+from asyncio import get_running_loop, shield, sleep as async_sleep
+from typing import Optional
+
+import config
 from config import NCBI_API_KEY, NCBI_EMAIL, NCBI_TOOL
 from datetime import datetime
 from logging import getLogger
-from threading import Thread
+from threading import Event, Lock
+from time import monotonic, sleep
 
 from regex import compile as regex_compile
 
-from lib.commons import b_TO_NUM, request
-from lib.doi import get_crossref_dict
+from lib.aio import arequest
+from lib.citation import Citation
+from lib.commons import b_TO_NUM, request, Thread
+from lib.doi import aget_crossref_dict, get_crossref_dict
 
 NON_DIGITS_SUB = regex_compile(r'[^\d]').sub
 
@@ -22,12 +27,177 @@ NCBI_URL = (
 PUBMED_URL = NCBI_URL + '&db=pubmed&id='
 PMC_URL = NCBI_URL + '&db=pmc&id='
 
+# NCBI allows 3 requests per second without an API key and 10 with one.
+NCBI_RATE = 10 if NCBI_API_KEY else 3
+# Seconds to wait for other lookups to join a batch before sending it.
+NCBI_BATCH_WINDOW = getattr(config, 'NCBI_BATCH_WINDOW', .05)
+NCBI_BATCH_SIZE = 200  # maximum number of ids per esummary request
+# Number of retries after a rate limit error.
+NCBI_RATE_LIMIT_RETRIES = 2
+
 
 class NCBIError(Exception):
 
     pass
 
 
+class TokenBucket:
+
+    """Pace calls to rate per second, allowing bursts of up to capacity."""
+
+    __slots__ = ('rate', 'capacity', '_tokens', '_updated', '_lock')
+
+    def __init__(self, rate: float, capacity: float = 1.):
+        self.rate = rate
+        self.capacity = self._tokens = capacity
+        self._updated = monotonic()
+        self._lock = Lock()
+
+    def acquire(self) -> None:
+        """Wait until a token is available and take it."""
+        if (delay := self._take()) > 0:
+            sleep(delay)
+
+    async def aacquire(self) -> None:
+        """Async variant of acquire."""
+        if (delay := self._take()) > 0:
+            await async_sleep(delay)
+
+    def _take(self) -> float:
+        """Take a token and return the seconds until it is available."""
+        with self._lock:
+            now = monotonic()
+            tokens = min(
+                self.capacity,
+                self._tokens + (now - self._updated) * self.rate) - 1
+            self._tokens, self._updated = tokens, now
+        # A negative balance is a reservation of a future token.
+        return -tokens / self.rate
+
+
+NCBI_BUCKET = TokenBucket(NCBI_RATE)
+
+
+class ESummaryBatch:
+
+    __slots__ = ('ids', 'done', 'result', 'exception')
+
+    def __init__(self):
+        self.ids = {}  # used as an ordered set
+        self.done = Event()
+        self.result = self.exception = None
+
+    def send(self, url: str) -> None:
+        """Request the summaries of all ids and notify the waiters."""
+        try:
+            url += ','.join(self.ids)
+            for _ in range(NCBI_RATE_LIMIT_RETRIES + 1):
+                NCBI_BUCKET.acquire()
+                # the memo of the user request would return the same error
+                json_response = request(url, memo=False).json()
+                if not is_rate_limited(json_response):
+                    break
+            self.result = esummary_result(json_response)
+        except Exception as e:
+            self.exception = e
+        finally:
+            self.done.set()
+
+
+def is_rate_limited(json_response: dict) -> bool:
+    # Example error message if rates are exceeded:
+    # {"error":"API rate limit exceeded","count":"11"}
+    # https://www.ncbi.nlm.nih.gov/books/NBK25497/#chapter2.Coming_in_May_2018_API_Keys
+    return 'rate limit' in json_response.get('error', '')
+
+
+def esummary_result(json_response: dict) -> dict:
+    if 'error' in json_response:
+        raise NCBIError(json_response)
+    return json_response['result']
+
+
+class ESummaryBatcher:
+
+    """Combine the concurrent esummary lookups of one database.
+
+    The first lookup of a batch waits NCBI_BATCH_WINDOW seconds for others
+    to join and then sends all of their ids in one request, paced by
+    NCBI_BUCKET. The result is shared with all the waiting lookups.
+    """
+
+    __slots__ = ('url', '_batch', '_lock')
+
+    def __init__(self, url: str):
+        self.url = url
+        self._batch = None
+        self._lock = Lock()
+
+    def get(self, id_: str) -> dict:
+        """Return the esummary result of id_."""
+        with self._lock:
+            if (batch := self._batch) is None \
+                    or len(batch.ids) >= NCBI_BATCH_SIZE:
+                batch = self._batch = ESummaryBatch()
+                leader = True
+            else:
+                leader = False
+            batch.ids[id_] = None
+        if leader:
+            sleep(NCBI_BATCH_WINDOW)
+            with self._lock:
+                if self._batch is batch:
+                    self._batch = None
+            batch.send(self.url)
+        else:
+            batch.done.wait()
+        if batch.exception is not None:
+            raise batch.exception
+        return batch.result[id_]
+
+
+class AsyncESummaryBatcher:
+
+    """Async variant of ESummaryBatcher for the lookups of an event loop."""
+
+    __slots__ = ('url', '_ids', '_task')
+
+    def __init__(self, url: str):
+        self.url = url
+        self._ids = self._task = None
+
+    async def get(self, id_: str) -> dict:
+        """Return the esummary result of id_."""
+        loop = get_running_loop()
+        if (
+            self._task is None
+            or self._task.get_loop() is not loop  # e.g. asyncio.run
+            or len(self._ids) >= NCBI_BATCH_SIZE
+        ):
+            self._ids = {}  # used as an ordered set
+            self._task = loop.create_task(self._send(self._ids))
+        self._ids[id_] = None
+        return (await shield(self._task))[id_]
+
+    async def _send(self, ids: dict) -> dict:
+        await async_sleep(NCBI_BATCH_WINDOW)
+        if self._ids is ids:  # no more ids can join
+            self._ids = self._task = None
+        url = self.url + ','.join(ids)
+        for _ in range(NCBI_RATE_LIMIT_RETRIES + 1):
+            await NCBI_BUCKET.aacquire()
+            json_response = (await arequest(url)).json()
+            if not is_rate_limited(json_response):
+                break
+        return esummary_result(json_response)
+
+
+PUBMED = ESummaryBatcher(PUBMED_URL)
+PMC = ESummaryBatcher(PMC_URL)
+APUBMED = AsyncESummaryBatcher(PUBMED_URL)
+APMC = AsyncESummaryBatcher(PMC_URL)
+
+
 def pmid_dict(pmid: str, date_format='%Y-%m-%d', /) -> dict:
     """Return the response namedtuple."""
     pmid = NON_DIGITS_SUB('', pmid)
@@ -44,32 +214,74 @@ def pmcid_dict(pmcid: str, date_format='%Y-%m-%d', /) -> dict:
     return dictionary
 
 
-def ncbi(type_: str, id_: str) -> defaultdict:
+async def apmid_dict(pmid: str, date_format='%Y-%m-%d', /) -> dict:
+    """Async variant of pmid_dict."""
+    dictionary = await ancbi('pmid', NON_DIGITS_SUB('', pmid))
+    dictionary['date_format'] = date_format
+    return dictionary
+
+
+async def apmcid_dict(pmcid: str, date_format='%Y-%m-%d', /) -> dict:
+    """Async variant of pmcid_dict."""
+    dictionary = await ancbi('pmcid', NON_DIGITS_SUB('', pmcid))
+    dictionary['date_format'] = date_format
+    return dictionary
+
+
+def ncbi(type_: str, id_: str) -> Citation:
     """Return the NCBI data for the given id_."""
     # According to https://www.ncbi.nlm.nih.gov/pmc/tools/get-metadata/
     if type_ == 'pmid':
-        json_response = request(PUBMED_URL + id_).json()
+        result = PUBMED.get(id_)
     else:  # type_ == 'pmcid'
-        json_response = request(PMC_URL + id_).json()
-    if 'error' in json_response:
-        # Example error message if rates are exceeded:
-        # {"error":"API rate limit exceeded","count":"11"}
-        # https://www.ncbi.nlm.nih.gov/books/NBK25497/#chapter2.Coming_in_May_2018_API_Keys
-        # Return a 503 Service Unavailable
-        raise NCBIError(json_response)
-    result_get = json_response['result'][id_].get
-    d : defaultdict[str, Any] = defaultdict(lambda: None)
+        result = PMC.get(id_)
+    if doi := esummary_doi(result):
+        crossref_dict = {}
+        crossref_thread = Thread(
+            target=crossref_update, args=(crossref_dict, doi))
+        crossref_thread.start()
+    d = esummary_dict(result)
+    if doi:
+        # noinspection PyUnboundLocalVariable
+        crossref_thread.join()
+        # noinspection PyUnboundLocalVariable
+        d.update(crossref_dict)
+    return d
+
+
+async def ancbi(type_: str, id_: str) -> Citation:
+    """Async variant of ncbi."""
+    if type_ == 'pmid':
+        result = await APUBMED.get(id_)
+    else:  # type_ == 'pmcid'
+        result = await APMC.get(id_)
+    d = esummary_dict(result)
+    if doi := d['doi']:
+        # noinspection PyBroadException
+        try:
+            d.update(await aget_crossref_dict(doi))
+        except Exception:
+            logger.exception(
+                'There was an error in resolving crossref DOI: ' + doi)
+    return d
+
+
+def esummary_doi(result: dict) -> Optional[str]:
+    for articleid in result.get('articleids', ()):
+        if articleid['idtype'] == 'doi':
+            return articleid['value']
+    return None
+
+
+def esummary_dict(result: dict) -> Citation:
+    """Return the Citation of the esummary result of an id."""
+    result_get = result.get
+    d = Citation()
 
-    doi = None
     articleids = result_get('articleids', ())
     for articleid in articleids:
         if (idtype := articleid['idtype']) == 'doi':
-            doi = articleid['value']
-            crossref_dict = {}
-            crossref_thread = Thread(
-                target=crossref_update, args=(crossref_dict, doi))
-            crossref_thread.start()
-            d['doi'] = doi
+            d['doi'] = articleid['value']
         elif idtype == 'pmcid':
             # Use NON_DIGITS_SUB to remove the PMC prefix e.g. in PMC3539452
             d['pmcid'] = NON_DIGITS_SUB('', articleid['value'])
@@ -127,12 +339,6 @@ def ncbi(type_: str, id_: str) -> defaultdict:
     if (lang := result_get('lang')) is not None:
         d['language'] = lang[0]
 
-    if doi:
-        # noinspection PyUnboundLocalVariable
-        crossref_thread.join()
-        # noinspection PyUnboundLocalVariable
-        d.update(crossref_dict)
-
     return d
 
 
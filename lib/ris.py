@@ -1,7 +1,6 @@
-from collections import defaultdict
-
 from regex import compile as regex_compile, MULTILINE, VERBOSE
 
+from lib.citation import Citation
 from lib.doi import DOI_SEARCH
 from lib.commons import first_last, InvalidNameError, ISBN_10OR13_SEARCH
 
@@ -45,10 +44,9 @@ RIS_FULLMATCH = regex_compile(
 
 
 def ris_parse(ris_text):
-    """Parse RIS_text data and return the result as a dictionary."""
-    d = defaultdict(lambda: None)
+    """Parse RIS_text data and return the result as a Citation."""
     match = RIS_FULLMATCH(ris_text)
-    d.update(match.groupdict())
+    d = Citation(match.groupdict())
     # cite_type: (book, journal, . . . )
     if (cite_type := d['type'].lower()) == 'jour':
         if (t2 := d['t2']) is not None:
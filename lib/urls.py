@@ -1,24 +1,38 @@
-from collections import defaultdict
+from asyncio import get_running_loop, wait
 from datetime import date as datetime_date
 from difflib import get_close_matches
 from functools import partial
 from html import unescape as html_unescape
 from logging import getLogger
-from threading import Thread
 from typing import Optional, List, Dict, Any, Tuple
 from urllib.parse import urlparse
 
-from langid import classify
-from regex import compile as rc, VERBOSE, IGNORECASE
+from regex import compile as rc, VERBOSE, IGNORECASE, DOTALL
 from requests import Response as RequestsResponse
+from requests.structures import CaseInsensitiveDict
 from requests.exceptions import RequestException
 
-from lib.commons import find_any_date, ANYDATE_PATTERN, request
-from lib.urls_authors import find_authors, CONTENT_ATTR
-from lib.doi import get_crossref_dict
+from lib.aio import arequest
+from lib.cache import Cache, MISSING
+from lib.citation import Citation
+from lib.commons import find_any_date, ANYDATE_PATTERN, ANYDATE_SEARCH, \
+    request, Thread
+from lib.meta import meta_index, first_content, MetaIndex, \
+    QUOTED_NAME_FULLMATCH
+from lib.urls_authors import find_authors, find_meta_authors
+from lib.doi import aget_crossref_dict, get_crossref_dict
+from lib.language import classify
 
 
 MAX_RESPONSE_LENGTH = 10_000_000  # in bytes
+CHUNK_SIZE = 65_536  # in bytes, used in streaming mode of get_html
+
+# {home_url: (site_name, home_title)} results of analyze_home
+HOME_CACHE = Cache('home', maxsize=10_000, ttl=86_400, persistent=True)
+# {hostname: language} of the pages that did not declare their language
+LANGUAGE_CACHE = Cache('languages', maxsize=10_000, ttl=86_400)
+# Maximum number of characters of text that are used to detect a language.
+LANGUAGE_SAMPLE_SIZE = 1_000
 
 # https://stackoverflow.com/questions/3458217/how-to-use-regular-expression-to-match-the-charset-string-in-html
 CHARSET = rc(
@@ -28,20 +42,10 @@ CHARSET = rc(
     IGNORECASE | VERBOSE,
 ).search
 
-TITLE_META_NAME_OR_PROP = r'''
-    (?>name|property)=(?<q>["\'])
-        (?>citation_title|title|Headline|og:title)
-    (?P=q)
-'''
-TITLE_SEARCH = rc(
-    r'<meta\s++(?:'
-    + TITLE_META_NAME_OR_PROP + r'\s++' + CONTENT_ATTR
-    + '|'
-    + CONTENT_ATTR + r'\s++' + TITLE_META_NAME_OR_PROP
-    + ')'
-    '|'
+TITLE_META_NAMES = ('citation_title', 'title', 'headline', 'og:title')
+TITLE_CLASS_SEARCH = rc(
     r'class=(?<q>["\'])(?>main-hed|heading1)(?P=q)[^>]++>(?<result>[^<]*+)<',
-    VERBOSE | IGNORECASE,
+    IGNORECASE,
 ).search
 
 TITLE_TAG = rc(
@@ -53,157 +57,38 @@ TITLE_TAG = rc(
     VERBOSE | IGNORECASE,
 ).search
 
-DATE_META_NAME_OR_PROP = r'''
-    (?>name|property)=(?<q>["\'])(?>
-        article:(?>modified_time|published_time)
-        |citation_(?>date|publication_date)
-        |date
-        |DC.date.[^'"\n>]*+
-        |last-modified
-        |pub_?date
-        |sailthru\.date
-    )(?P=q)
-'''
-DATE_CONTENT_ATTR =\
-    r'content=(?<q>["\'])[^"\'<]*?' + ANYDATE_PATTERN + r'[^"\'<]*+(?P=q)'
-DATE_SEARCH = rc(
-    r'<meta\s+[^\n<]*?(?:'
-    + DATE_META_NAME_OR_PROP + r'\s++[^\n<]*?' + DATE_CONTENT_ATTR
-    + '|'
-    + DATE_CONTENT_ATTR + r'\s++[^\n<]*?' + DATE_META_NAME_OR_PROP
-    + ')'
-    '|'
-    # http://livescience.com/46619-sterile-neutrino-experiment-beginning.html
-    # https://www.thetimes.co.uk/article/woman-who-lost-brother-on-mh370-mourns-relatives-on-board-mh17-r07q5rwppl0
-    r'date(?>Published|line)[^\w]++' + ANYDATE_PATTERN,
-    VERBOSE | IGNORECASE,
-).search
-
-JOURNAL_META_NAME_OR_PROP = r'''
-    (?>name|property)=(?<q>["\'])citation_journal_title(?P=q)
-'''
-JOURNAL_TITLE_SEARCH = rc(
-    r'<meta\s++[^\n<]*?(?:'
-    + CONTENT_ATTR + r'\s++[^\n<]*?' + JOURNAL_META_NAME_OR_PROP
-    + '|'
-    + JOURNAL_META_NAME_OR_PROP + r'\s++[^\n<]*?' + CONTENT_ATTR
-    + ')',
-    VERBOSE | IGNORECASE,
-).search
-
-URL_META_NAME_OR_PROP = r'''
-    (?>name|property)=(?<q>["\'])og:url(?P=q)
-'''
-URL_SEARCH = rc(
-    r'<meta\s++[^\n<]*?(?:'
-    + CONTENT_ATTR + r'\s++[^\n<]*?' + URL_META_NAME_OR_PROP
-    + '|'
-    + URL_META_NAME_OR_PROP + r'\s++[^\n<]*?' + CONTENT_ATTR
-    + ')',
-    VERBOSE | IGNORECASE,
-).search
-
-ISSN_META_NAME_OR_PROP = r'''
-    (?>name|property)=(?<q>["\'])citation_issn(?P=q)
-'''
-ISSN_SEARCH = rc(
-    r'<meta\s++[^\n<]*?(?:'
-    + CONTENT_ATTR + r'\s++[^\n<]*?' + ISSN_META_NAME_OR_PROP
-    + '|'
-    + ISSN_META_NAME_OR_PROP + r'\s++[^\n<]*?' + CONTENT_ATTR
-    + ')',
-    VERBOSE | IGNORECASE,
-).search
-
-PMID_META_NAME_OR_PROP = r'''
-    (?>name|property)=(?<q>["\'])citation_pmid(?P=q)
-'''
-PMID_SEARCH = rc(
-    r'<meta\s++[^\n<]*?(?:'
-    + CONTENT_ATTR + r'\s++[^\n<]*?' + PMID_META_NAME_OR_PROP
-    + '|'
-    + PMID_META_NAME_OR_PROP + r'\s++[^\n<]*?' + CONTENT_ATTR
-    + ')',
-    VERBOSE | IGNORECASE,
-).search
-
-DOI_META_NAME_OR_PROP = r'''
-    (?>name|property)=(?<q>["\'])citation_doi(?P=q)
-'''
-DOI_SEARCH = rc(
-    r'<meta\s++[^\n<]*?(?:'
-    + CONTENT_ATTR + r'\s++[^\n<]*?' + DOI_META_NAME_OR_PROP
-    + '|'
-    + DOI_META_NAME_OR_PROP + r'\s++[^\n<]*?' + CONTENT_ATTR
-    + ')',
-    VERBOSE | IGNORECASE,
-).search
-
-
-VOLUME_META_NAME_OR_PROP = r'''
-    (?>name|property)=(?<q>["\'])citation_volume(?P=q)
-'''
-VOLUME_SEARCH = rc(
-    r'<meta\s++[^\n<]*?(?:'
-    + CONTENT_ATTR + r'\s++[^\n<]*?' + VOLUME_META_NAME_OR_PROP
-    + '|'
-    + VOLUME_META_NAME_OR_PROP + r'\s++[^\n<]*?' + CONTENT_ATTR
-    + ')',
-    VERBOSE | IGNORECASE,
-).search
-
-ISSUE_META_NAME_OR_PROP = r'''
-    (?>name|property)=(?<q>["\'])citation_issue(?P=q)
-'''
-ISSUE_SEARCH = rc(
-    r'<meta\s++[^\n<]*?(?:'
-    + CONTENT_ATTR + r'\s++[^\n<]*?' + ISSUE_META_NAME_OR_PROP
-    + '|'
-    + ISSUE_META_NAME_OR_PROP + r'\s++[^\n<]*?' + CONTENT_ATTR
-    + ')',
-    VERBOSE | IGNORECASE,
-).search
-
-FIRST_PAGE_NAME_OR_PROP = r'''
-    (?>name|property)=(?<q>["\'])citation_firstpage(?P=q)
-'''
-FIRST_PAGE_SEARCH = rc(
-    r'<meta\s++[^\n<]*?(?:'
-    + CONTENT_ATTR + r'\s++[^\n<]*?' + FIRST_PAGE_NAME_OR_PROP
-    + '|'
-    + FIRST_PAGE_NAME_OR_PROP + r'\s++[^\n<]*?' + CONTENT_ATTR
-    + ')',
+DATE_META_NAME_FULLMATCH = rc(
+    r'''
+    article:(?>modified_time|published_time)
+    |citation_(?>date|publication_date)
+    |date
+    |DC.date.[^'"\n>]*+
+    |last-modified
+    |pub_?date
+    |sailthru\.date
+    ''',
     VERBOSE | IGNORECASE,
-).search
-
-
-LAST_PAGE_NAME_OR_PROP = r'''
-    (?>name|property)=(?<q>["\'])citation_lastpage(?P=q)
-'''
-LAST_PAGE_SEARCH = rc(
-    r'<meta\s++[^\n<]*?(?:'
-    + CONTENT_ATTR + r'\s++[^\n<]*?' + LAST_PAGE_NAME_OR_PROP
-    + '|'
-    + LAST_PAGE_NAME_OR_PROP + r'\s++[^\n<]*?' + CONTENT_ATTR
-    + ')',
+).fullmatch
+# Characters that are not allowed in a date meta content.
+DATE_CONTENT_INVALID_CHARS = rc(r'["\'<]').search
+# http://livescience.com/46619-sterile-neutrino-experiment-beginning.html
+# https://www.thetimes.co.uk/article/woman-who-lost-brother-on-mh370-mourns-relatives-on-board-mh17-r07q5rwppl0
+DATE_TEXT_SEARCH = rc(
+    r'date(?>Published|line)[^\w]++' + ANYDATE_PATTERN,
     VERBOSE | IGNORECASE,
 ).search
 
-
-SITE_NAME_NAME_OR_PROP = r'''
-    (?>name|property)=(?<q>["\'])og:site_name(?P=q)
-'''
-SITE_NAME_SEARCH = rc(
-    r'<meta\s++[^\n<]*?(?:'
-    + CONTENT_ATTR + r'\s++[^\n<]*?' + SITE_NAME_NAME_OR_PROP
-    + '|'
-    + SITE_NAME_NAME_OR_PROP + r'\s++[^\n<]*?' + CONTENT_ATTR
-    + ')',
-    VERBOSE | IGNORECASE,
-).search
+HEAD_END_SEARCH = rc(rb'</head\s*+>', IGNORECASE).search
 
 TITLE_SPLIT = rc(r' - | — |\|').split
 LANG_SEARCH = rc(r'\slang="([a-z]{2})[-"]').search
+HTML_LANG_SEARCH = rc(
+    r'<html\b[^>]*?\slang\s*+=\s*+["\']?+([a-z]{2})(?![a-z])', IGNORECASE
+).search
+# The primary subtag of Content-Language or og:locale, e.g. en-US or en_US.
+LANG_CODE_MATCH = rc(r'\s*+([a-z]{2})(?![a-z])', IGNORECASE).match
+PARAGRAPH_FINDITER = rc(
+    r'<p\b[^>]*+>(.*?)</p\s*+>', IGNORECASE | DOTALL).finditer
 
 
 class ContentTypeError(ValueError):
@@ -239,106 +124,107 @@ def url_to_dict(url: str, date_format: str = '%Y-%m-%d', /) -> dict:
     return dictionary
 
 
-def find_journal(html: str) -> Optional[str]:
+async def aurl_to_dict(url: str, date_format: str = '%Y-%m-%d', /) -> dict:
+    """Async variant of url_to_dict."""
+    dictionary = await aurl2dict(url)
+    dictionary['date_format'] = date_format
+    return dictionary
+
+
+def find_journal(meta: MetaIndex) -> Optional[str]:
     """Return journal title as a string."""
     # http://socialhistory.ihcs.ac.ir/article_319_84.html
-    if (m := JOURNAL_TITLE_SEARCH(html)) is not None:
-        return m['result']
+    return first_content(meta, 'citation_journal_title')
 
 
-def find_url(html: str, url: str) -> str:
+def find_url(meta: MetaIndex, url: str) -> str:
     """Return og:url or url as a string."""
-    if (m := URL_SEARCH(html)) is not None:
-        ogurl = m['result']
+    if (ogurl := first_content(meta, 'og:url')) is not None:
         if urlparse(ogurl).path:
             return ogurl
     return url
 
 
-def find_issn(html: str) -> Optional[str]:
+def find_issn(meta: MetaIndex) -> Optional[str]:
     r"""Return International Standard Serial Number as a string.
 
     Normally ISSN should be in the  '\d{4}\-\d{3}[\dX]' format, but this
     function does not check that.
     """
-    if (m := ISSN_SEARCH(html)) is not None:
-        return m['result']
+    return first_content(meta, 'citation_issn')
 
 
-def find_pmid(html: str) -> Optional[str]:
+def find_pmid(meta: MetaIndex) -> Optional[str]:
     """Return pmid as a string."""
-    if (m := PMID_SEARCH(html)) is not None:
-        return m['result']
+    return first_content(meta, 'citation_pmid')
 
 
-def find_doi(html: str) -> Optional[str]:
+def find_doi(meta: MetaIndex) -> Optional[str]:
     """Return DOI as a string."""
-    if (m := DOI_SEARCH(html)) is not None:
-        return m['result']
+    return first_content(meta, 'citation_doi')
 
 
-def find_volume(html: str) -> Optional[str]:
+def find_volume(meta: MetaIndex) -> Optional[str]:
     """Return citatoin volume number as a string."""
-    if (m := VOLUME_SEARCH(html)) is not None:
-        return m['result']
+    return first_content(meta, 'citation_volume')
 
 
-def find_issue(html: str) -> Optional[str]:
+def find_issue(meta: MetaIndex) -> Optional[str]:
     """Return citation issue number as a string."""
-    if (m := ISSUE_SEARCH(html)) is not None:
-        return m['result']
+    return first_content(meta, 'citation_issue')
 
 
-def find_pages(html: str) -> Optional[str]:
+def find_pages(meta: MetaIndex) -> Optional[str]:
     """Return citation pages as a string."""
     # http://socialhistory.ihcs.ac.ir/article_319_84.html
-    if fp_match := FIRST_PAGE_SEARCH(html):
-        if lp_match := LAST_PAGE_SEARCH(html):
-            return fp_match['result'] + '–' + lp_match['result']
+    if (fp := first_content(meta, 'citation_firstpage')) is not None:
+        if (lp := first_content(meta, 'citation_lastpage')) is not None:
+            return fp + '–' + lp
 
 
 def find_site_name(
-    html: str,
+    meta: MetaIndex,
     html_title: str,
     url: str,
     authors: List[Tuple[str, str]],
-    home_list: List[str],
-    thread: Thread,
+    home: Optional['Home'],
 ) -> str:
     """Return (site's name as a string, where).
 
     Parameters:
-        html: The html string of the page being processed.
+        meta: The meta index of the page being processed.
         html_title: Title of the page found in the title tag of the html.
         url: URL of the page.
         authors: Authors list returned from find_authors function.
-        home_list: A list containing the title of the home page as a str.
-        thread: The thread that should be joined before using home_title list.
+        home: The Home object of url. Only used if the other methods fail.
+            None means that the homepage should not be used.
     Returns site's name as a string.
     """
-    if (m := SITE_NAME_SEARCH(html)) is not None:
-        return m['result']
+    if (site_name := first_content(meta, 'og:site_name')) is not None:
+        return site_name
     # search the title
     if html_title is not None:
-        if site_name := parse_title(
-            html_title, url, authors, home_list, thread
-        )[2]:
+        if site_name := parse_title(html_title, url, authors, home)[2]:
             return site_name
-    # noinspection PyBroadException
-    try:
-        # using home_title
-        thread.join()
-        home_site_name, home_title = home_list
-        if home_site_name is not None:
-            return home_site_name
-        if (i := home_title.find(':')) != -1:
-            if site_name := home_title[:i].strip():
+    if home is not None:
+        # not in the try block, AsyncHome.result may raise HomeNotReady
+        home_result = home.result()
+        # noinspection PyBroadException
+        try:
+            # using home_title
+            if home_result is None:
+                raise ValueError('could not analyze the homepage')
+            home_site_name, home_title = home_result
+            if home_site_name is not None:
+                return home_site_name
+            if (i := home_title.find(':')) != -1:
+                if site_name := home_title[:i].strip():
+                    return site_name
+            if site_name := parse_title(home_title, url, None)[2]:
                 return site_name
-        if site_name := parse_title(home_title, url, None)[2]:
-            return site_name
-        return home_title
-    except Exception:
-        logger.exception(url)
+            return home_title
+        except Exception:
+            logger.exception(url)
     # return hostname
     hostname = urlparse(url).hostname
     return hostname.removeprefix('www.')
@@ -346,29 +232,43 @@ def find_site_name(
 
 def find_title(
     html: str,
+    meta: MetaIndex,
     html_title: str,
     url: str,
     authors: List[Tuple[str, str]],
-    home_list: List[str],
-    thread: Thread,
+    home: Optional['Home'],
 ) -> Optional[str]:
     """Return (title_string, where_info)."""
-    if (m := TITLE_SEARCH(html)) is not None:
-        return parse_title(
-            html_unescape(m['result']), url, authors, home_list, thread,
-        )[1]
+    if (title := search_title(html, meta)) is not None:
+        return parse_title(html_unescape(title), url, authors, home)[1]
     elif html_title is not None:
-        return parse_title(html_title, url, authors, home_list, thread)[1]
+        return parse_title(html_title, url, authors, home)[1]
     else:
         return None
 
 
+def search_title(html: str, meta: MetaIndex) -> Optional[str]:
+    """Return the first title found in title metas or main-hed classes."""
+    meta_start = meta_title = None
+    for name in TITLE_META_NAMES:
+        for start, id_, content, leading in meta.get(name, ()):
+            if meta_start is not None and start > meta_start:
+                break
+            if leading and QUOTED_NAME_FULLMATCH(id_) is not None:
+                meta_start, meta_title = start, content
+                break
+    if (m := TITLE_CLASS_SEARCH(
+        html, 0, None if meta_start is None else meta_start + 1
+    )) is not None:
+        return m['result']
+    return meta_title
+
+
 def parse_title(
     title: str,
     url: str,
     authors: Optional[List[Tuple[str, str]]],
-    home_list: Optional[List[str]] = None,
-    thread: Thread = None,
+    home: 'Home' = None,
 ) -> Tuple[Optional[str], str, Optional[str]]:
     """Return (intitle_author, pure_title, intitle_sitename).
 
@@ -414,22 +314,19 @@ def parse_title(
             hostname, title_parts, n=1, cutoff=.3
         ):
             intitle_sitename = close_matches[0]
-        else:
-            if thread is not None:
-                thread.join()
-            if home_list:
-                home_site_name, home_title = home_list
-                # 3. In homepage title
-                for part in title_parts:
-                    if part in home_title:
-                        intitle_sitename = part
-                        break
-                else:
-                    # 4. Using difflib on home_title
-                    if close_matches := get_close_matches(
-                        home_title, title_parts, n=1, cutoff=.3
-                    ):
-                        intitle_sitename = close_matches[0]
+        elif home is not None and (home_result := home.result()) is not None:
+            home_site_name, home_title = home_result
+            # 3. In homepage title
+            for part in title_parts:
+                if part in home_title:
+                    intitle_sitename = part
+                    break
+            else:
+                # 4. Using difflib on home_title
+                if close_matches := get_close_matches(
+                    home_title, title_parts, n=1, cutoff=.3
+                ):
+                    intitle_sitename = close_matches[0]
     # Remove sitename from title_parts
     if intitle_sitename:
         title_parts.remove(intitle_sitename)
@@ -449,13 +346,35 @@ def parse_title(
     return intitle_author, pure_title, intitle_sitename
 
 
-def find_date(html: str, url: str) -> datetime_date:
+def search_date(html: str, meta: MetaIndex):
+    """Return the first date match found in date metas or datePublished."""
+    meta_start = meta_match = None
+    for name, entries in meta.items():
+        if DATE_META_NAME_FULLMATCH(name) is None:
+            continue
+        for start, id_, content, _ in entries:
+            if meta_start is not None and start > meta_start:
+                break
+            if (
+                QUOTED_NAME_FULLMATCH(id_) is None
+                or DATE_CONTENT_INVALID_CHARS(content) is not None
+            ):
+                continue
+            if (m := ANYDATE_SEARCH(content)) is not None:
+                meta_start, meta_match = start, m
+                break
+    if (m := DATE_TEXT_SEARCH(html, 0, meta_start)) is not None:
+        return m
+    return meta_match
+
+
+def find_date(html: str, meta: MetaIndex, url: str) -> datetime_date:
     """Return the date of the document."""
     # Example for find_any_date(url):
     # http://ftalphaville.ft.com/2012/05/16/1002861/recap-and-tranche-primer/?Authorised=false
     # Example for find_any_date(html):
     # https://www.bbc.com/news/uk-england-25462900
-    if (m := DATE_SEARCH(html)) is not None:
+    if (m := search_date(html, meta)) is not None:
         return find_any_date(m)
     return find_any_date(url) or find_any_date(html)
 
@@ -465,6 +384,7 @@ def analyze_home(url: str, home_list: list) -> None:
 
     This function is invoked through a thread.
     home_list is used to return the thread result.
+    Successful results are stored in HOME_CACHE.
     """
     home_url = '://'.join(urlparse(url)[:2])
     with request(
@@ -478,18 +398,127 @@ def analyze_home(url: str, home_list: list) -> None:
         ):
             return
         content = next(r.iter_content(MAX_RESPONSE_LENGTH))
+    home_list += home_result(home_url, content, r.encoding)
 
-    m = CHARSET(content)
-    html = content.decode(m[1].decode() if m else r.encoding)
-
-    if m := SITE_NAME_SEARCH(html):
-        home_list.append(m['result'])
-    else:
-        home_list.append(None)
 
+def home_result(
+    home_url: str, content: bytes, encoding: Optional[str]
+) -> Tuple[Optional[str], Optional[str]]:
+    """Return (site_name, home_title) of the homepage and cache it."""
+    html = decode_html(content, encoding)
     m = TITLE_TAG(html)
-    title = html_unescape(m['result']) if m else None
-    home_list.append(title)
+    result = (
+        first_content(meta_index(html), 'og:site_name'),
+        html_unescape(m['result']) if m else None)
+    HOME_CACHE.set(home_url, result)
+    return result
+
+
+class Home:
+
+    """The lazily analyzed homepage of a URL.
+
+    analyze_home is only started when the result is actually needed, or
+    earlier if start is called explicitly. Results are taken from HOME_CACHE
+    when available. A Home object is meant to be used within one request.
+    """
+
+    __slots__ = ('url', '_list', '_thread')
+
+    def __init__(self, url: str):
+        self.url = url
+        self._list = None
+        self._thread = None
+
+    def start(self) -> None:
+        """Start analyzing the homepage in background if not started yet."""
+        if self._list is not None:
+            return
+        home_url = '://'.join(urlparse(self.url)[:2])
+        if (cached := HOME_CACHE.get(home_url)) is not MISSING:
+            self._list = [*cached]
+            return
+        self._list = []
+        thread = self._thread = Thread(
+            target=analyze_home, args=(self.url, self._list))
+        thread.start()
+
+    def result(self) -> Optional[Tuple[Optional[str], Optional[str]]]:
+        """Return (site_name, home_title) or None if analyze_home failed."""
+        self.start()
+        if self._thread is not None:
+            self._thread.join()
+        if self._list:
+            return self._list[0], self._list[1]
+        return None
+
+
+class HomeNotReady(Exception):
+
+    """Raise when the result of an AsyncHome is needed before it is ready."""
+
+
+class AsyncHome:
+
+    """Async variant of Home.
+
+    start analyzes the homepage in a task of the running event loop. result
+    raises HomeNotReady if the task is not done yet. In that case, await
+    wait and call result again.
+    """
+
+    __slots__ = ('url', '_result', '_task')
+
+    def __init__(self, url: str):
+        self.url = url
+        self._result = MISSING
+        self._task = None
+
+    def start(self) -> None:
+        """Start analyzing the homepage in background if not started yet."""
+        if self._result is not MISSING or self._task is not None:
+            return
+        home_url = '://'.join(urlparse(self.url)[:2])
+        if (cached := HOME_CACHE.get(home_url)) is not MISSING:
+            self._result = (*cached,)
+            return
+        self._task = get_running_loop().create_task(aanalyze_home(home_url))
+
+    def result(self) -> Optional[Tuple[Optional[str], Optional[str]]]:
+        """Return (site_name, home_title) or None if the analysis failed."""
+        self.start()
+        if self._result is MISSING:
+            if not self._task.done():
+                raise HomeNotReady(self.url)
+            if (e := self._task.exception()) is not None:
+                logger.error('could not analyze %s', self.url, exc_info=e)
+                self._result = None
+            else:
+                self._result = self._task.result()
+        return self._result
+
+    async def wait(self) -> None:
+        self.start()
+        if self._task is not None:
+            await wait([self._task])
+
+
+async def aanalyze_home(
+    home_url: str
+) -> Optional[Tuple[Optional[str], Optional[str]]]:
+    """Async variant of analyze_home. Return the result of home_result."""
+    r = await arequest(home_url, spoof=True, stream=True)
+    try:
+        try:
+            check_response_headers(r)
+        except (StatusCodeError, ContentTypeError, ContentLengthError):
+            return None
+        content = b''
+        async for content in r.aiter_bytes(MAX_RESPONSE_LENGTH):
+            break
+    finally:
+        await r.aclose()
+    return home_result(home_url, content, r.encoding)
 
 
 def check_response_headers(r: RequestsResponse) -> None:
@@ -516,79 +545,270 @@ def check_response_headers(r: RequestsResponse) -> None:
     return
 
 
-def get_html(url: str) -> str:
-    """Return the html string for the given url."""
+def decode_html(
+    content: bytes, encoding: Optional[str], errors: str = 'strict'
+) -> str:
+    """Decode content using its meta charset or the given encoding."""
+    charset_match = CHARSET(content)
+    return content.decode(
+        charset_match[1].decode() if charset_match else encoding, errors)
+
+
+def head_has_metadata(head: str) -> bool:
+    """Return True if head contains everything that url2dict needs.
+
+    Byline and date heuristics are only used when the meta tags for authors
+    and date are missing, so the body of such pages is not needed.
+    """
+    meta = meta_index(head)
+    if find_doi(meta) is not None:
+        return True
+    return (
+        (search_title(head, meta) is not None or TITLE_TAG(head) is not None)
+        and search_date(head, meta) is not None
+        and find_meta_authors(meta) is not None
+        and (
+            first_content(meta, 'og:site_name') is not None
+            or find_journal(meta) is not None
+        )
+    )
+
+
+def get_html(url: str, head_only: bool = False) -> str:
+    """Return the html string for the given url.
+
+    If head_only is True, stop downloading as soon as the </head> tag is
+    received and head_has_metadata returns True for it. In that case the
+    returned string will only contain the beginning of the document.
+    """
+    return fetch_html(url, head_only)[0]
+
+
+def fetch_html(
+    url: str, head_only: bool = False
+) -> Tuple[str, CaseInsensitiveDict]:
+    """Return the html string and the response headers of url.
+
+    See get_html for the head_only parameter.
+    """
     with request(
         url, stream=True, spoof=True
     ) as r:
         check_response_headers(r)
-        size = 0
-        chunks = []
-        a = chunks.append
-        for chunk in r.iter_content(MAX_RESPONSE_LENGTH):
-            size += len(chunk)
-            if size >= MAX_RESPONSE_LENGTH:
-                raise ValueError(
-                    'response was too large: '
-                    f'{size=} > {MAX_RESPONSE_LENGTH=}')
-            a(chunk)
-        content = b''.join(chunks)
-    charset_match = CHARSET(content)
-    return content.decode(
-        charset_match[1].decode() if charset_match else r.encoding)
+        buffer = HtmlBuffer(head_only, r.encoding)
+        for chunk in r.iter_content(CHUNK_SIZE):
+            if (head := buffer.feed(chunk)) is not None:
+                return head, r.headers
+    return buffer.html(), r.headers
+
+
+async def afetch_html(
+    url: str, head_only: bool = False
+) -> Tuple[str, CaseInsensitiveDict]:
+    """Async variant of fetch_html."""
+    r = await arequest(url, stream=True, spoof=True)
+    try:
+        check_response_headers(r)
+        buffer = HtmlBuffer(head_only, r.encoding)
+        async for chunk in r.aiter_bytes(CHUNK_SIZE):
+            if (head := buffer.feed(chunk)) is not None:
+                return head, r.headers
+    finally:
+        await r.aclose()
+    return buffer.html(), r.headers
+
+
+class HtmlBuffer:
+
+    """The received content of an html response, see fetch_html."""
+
+    __slots__ = ('content', 'head_only', 'encoding')
+
+    def __init__(self, head_only: bool, encoding: Optional[str]):
+        self.content = bytearray()
+        self.head_only = head_only
+        self.encoding = encoding
+
+    def feed(self, chunk: bytes) -> Optional[str]:
+        """Add chunk. Return the head if the rest is not needed."""
+        content = self.content
+        searched = len(content)
+        content += chunk
+        if (size := len(content)) >= MAX_RESPONSE_LENGTH:
+            raise ValueError(
+                'response was too large: '
+                f'{size=} > {MAX_RESPONSE_LENGTH=}')
+        if self.head_only is False:
+            return None
+        # 6 == len('</head') - 1
+        if (m := HEAD_END_SEARCH(content, max(searched - 6, 0))) is None:
+            return None
+        # the body will be needed if the head is not complete
+        self.head_only = False
+        # the rest of the chunk may end in the middle of a character
+        head = decode_html(content[:m.end()], self.encoding)
+        if head_has_metadata(head):
+            return head
+        return None
+
+    def html(self) -> str:
+        return decode_html(self.content, self.encoding)
+
+
+def text_sample(html: str, meta: MetaIndex, title: Optional[str]) -> str:
+    """Return up to LANGUAGE_SAMPLE_SIZE characters of the visible text.
+
+    The sample consists of the title, the description and the first
+    paragraphs of the page.
+    """
+    parts = [title or '']
+    size = len(parts[0])
+    for key in ('og:description', 'description'):
+        if (description := first_content(meta, key)) is not None:
+            parts.append(html_unescape(description))
+            size += len(parts[-1])
+            break
+    for m in PARAGRAPH_FINDITER(html):
+        if size >= LANGUAGE_SAMPLE_SIZE:
+            break
+        parts.append(html_unescape(to_text(m[1])).strip())
+        size += len(parts[-1])
+    return ' '.join(parts)[:LANGUAGE_SAMPLE_SIZE]
+
+
+def find_language(
+    html: str, meta: MetaIndex, headers: CaseInsensitiveDict, url: str,
+    title: Optional[str],
+) -> str:
+    """Return the two-letter code of the language of the page.
+
+    The language declared using the lang attribute of the html tag, the
+    Content-Language header, og:locale or the lang attribute of any other
+    tag is used if there is one. Otherwise the language of text_sample is
+    detected using langid and remembered for the hostname of url.
+    """
+    if (m := HTML_LANG_SEARCH(html)) is not None:
+        return m[1].lower()
+    for declared in (
+        headers.get('content-language'), first_content(meta, 'og:locale')
+    ):
+        if declared and (m := LANG_CODE_MATCH(declared)) is not None:
+            return m[1].lower()
+    if (m := LANG_SEARCH(html)) is not None:
+        return m[1]
+    hostname = urlparse(url).hostname
+    if (language := LANGUAGE_CACHE.get(hostname)) is not MISSING:
+        return language
+    language = classify(text_sample(html, meta, title))[0]
+    LANGUAGE_CACHE.set(hostname, language)
+    return language
 
 
 def url2dict(url: str) -> Dict[str, Any]:
     """Get url and return the result as a dictionary."""
-    d: defaultdict[str, Any] = defaultdict(lambda: None)
-    # Creating a thread to request homepage title in background
-    home_thread = Thread(
-        target=analyze_home, args=(url, (home_list := [])))
-    home_thread.start()
+    html, headers = fetch_html(url, head_only=True)
+    return html_to_dict(url, html, headers, Home(url))
 
-    html = get_html(url)
 
-    if doi := find_doi(html):
+def html_to_dict(
+    url: str, html: str, headers: CaseInsensitiveDict, home: Optional[Home]
+) -> Citation:
+    """Return the Citation of the document html of url.
+
+    headers are the response headers of html. home should be the Home of
+    url, or None if the homepage should not be used. It is started early if
+    the site name will probably be needed.
+    """
+    meta = meta_index(html)
+    if doi := find_doi(meta):
         # noinspection PyBroadException
         try:
             return get_crossref_dict(doi)
         except Exception:
             logger.exception(f'{url=}, {doi=}')
-            d['doi'] = doi
+    elif home is not None and needs_home(meta):
+        home.start()
+    return meta_to_dict(url, html, meta, headers, home, doi)
+
+
+async def aurl2dict(url: str) -> Dict[str, Any]:
+    """Async variant of url2dict."""
+    html, headers = await afetch_html(url, head_only=True)
+    return await ahtml_to_dict(url, html, headers, AsyncHome(url))
+
 
-    d['url'] = find_url(html, url)
+async def ahtml_to_dict(
+    url: str, html: str, headers: CaseInsensitiveDict,
+    home: Optional[AsyncHome],
+) -> Citation:
+    """Async variant of html_to_dict."""
+    meta = meta_index(html)
+    if doi := find_doi(meta):
+        # noinspection PyBroadException
+        try:
+            return await aget_crossref_dict(doi)
+        except Exception:
+            logger.exception(f'{url=}, {doi=}')
+    elif home is not None and needs_home(meta):
+        home.start()
+    while True:
+        try:
+            return meta_to_dict(url, html, meta, headers, home, doi)
+        except HomeNotReady:
+            # only the homepage is awaited, the rest is parsed again
+            await home.wait()
+
+
+def needs_home(meta: MetaIndex) -> bool:
+    """Return True if find_site_name will probably need the homepage."""
+    return (
+        first_content(meta, 'og:site_name') is None
+        and find_journal(meta) is None)
+
+
+def meta_to_dict(
+    url: str, html: str, meta: MetaIndex, headers: CaseInsensitiveDict,
+    home: Optional[Home], doi: Optional[str],
+) -> Citation:
+    """Return the Citation of html, see html_to_dict.
+
+    meta is the meta_index of html and doi is the DOI found in it, if any.
+    home can also be an AsyncHome.
+    """
+    d = Citation()
+    if doi:
+        d['doi'] = doi
+    d['url'] = find_url(meta, url)
     if m := TITLE_TAG(html):
         if html_title := html_unescape(m['result']):
             d['html_title'] = html_title
     else:
         html_title = None
     # d['html_title'] is used in waybackmechine.py.
-    if authors := find_authors(html):
+    if authors := find_authors(html, meta):
         d['authors'] = authors
-    d['issn'] = find_issn(html)
-    d['pmid'] = find_pmid(html)
-    d['volume'] = find_volume(html)
-    d['issue'] = find_issue(html)
-    d['page'] = find_pages(html)
-    d['journal'] = find_journal(html)
+    d['issn'] = find_issn(meta)
+    d['pmid'] = find_pmid(meta)
+    d['volume'] = find_volume(meta)
+    d['issue'] = find_issue(meta)
+    d['page'] = find_pages(meta)
+    d['journal'] = find_journal(meta)
     if d['journal']:
         d['cite_type'] = 'journal'
     else:
         d['cite_type'] = 'web'
         d['website'] = find_site_name(
-            html, html_title, url, authors, home_list, home_thread)
+            meta, html_title, url, authors, home)
     if (title := find_title(
-        html, html_title, url, authors, home_list, home_thread
+        html, meta, html_title, url, authors, home
     )) is not None:
         d['title'] = title.strip()
-    if date := find_date(html, url):
+    if date := find_date(html, meta, url):
         d['date'] = date
         d['year'] = str(date.year)
 
-    if (lang_match := LANG_SEARCH(html)) is not None:
-        d['language'] = lang_match[1]
-    else:
-        d['language'] = classify(html)[0]
+    d['language'] = find_language(
+        html, meta, headers, url, d['title'] or html_title)
 
     return d
 
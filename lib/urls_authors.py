@@ -4,6 +4,7 @@ from regex import compile as regex_compile, VERBOSE, IGNORECASE, ASCII
 
 from lib.commons import ANYDATE_SEARCH, first_last, InvalidNameError, \
     FOUR_DIGIT_NUM
+from lib.meta import MetaIndex
 
 
 # Names in byline are required to be two or three parts
@@ -66,37 +67,15 @@ AND_OR_COMMA_SUFFIX = regex_compile(r'(?> and|,)?\s*+$', IGNORECASE).sub
 AND_OR_COMMA_SPLIT = regex_compile(r', and | and |, |;', IGNORECASE).split
 AND_SPLIT = regex_compile(r', and | and |;', IGNORECASE).split
 
-CONTENT_ATTR = r'''
-    content=(?<q>["\'])
-    (?<result>
-        (?>
-            [^'"]++
-            |
-            (?!(?P=q))['"]
-        )++
-    )(?P=q)
-'''
-AUTHOR_META_NAME_OR_PROP = r'''
-    (?<id>(?:name|property)\s*+=\s*+(?<q>["\']?)
-        (?>
-            # http://socialhistory.ihcs.ac.ir/article_571_84.html
-            # http://jn.physiology.org/content/81/1/319
-            a(?>rticle:author|uthor)
-            |citation_authors?
-            |og:author
-        )
-    (?P=q))
-'''
-META_AUTHOR_FINDITER = regex_compile(
-    rf'''
-    <meta\s[^>]*?(?:
-        {AUTHOR_META_NAME_OR_PROP}\s[^c]*+[^>]*?{CONTENT_ATTR}
-        |
-        {CONTENT_ATTR}\s[^>]*?{AUTHOR_META_NAME_OR_PROP}
-    )
-    ''',
-    VERBOSE | IGNORECASE
-).finditer
+AUTHOR_META_NAMES = (
+    # http://socialhistory.ihcs.ac.ir/article_571_84.html
+    # http://jn.physiology.org/content/81/1/319
+    'article:author',
+    'author',
+    'citation_author',
+    'citation_authors',
+    'og:author',
+)
 # id=byline
 # http://www.washingtonpost.com/wp-dyn/content/article/2006/12/20/AR2006122002165.html
 # rel=author
@@ -178,18 +157,27 @@ STOPWORDS_SEARCH = regex_compile(
 ).search
 
 
-def find_authors(html) -> Optional[List[Tuple[str, str]]]:
-    """Return authors names found in html."""
+def find_meta_authors(meta: MetaIndex) -> Optional[List[Tuple[str, str]]]:
+    """Return authors names found in author meta tags."""
     names = []
     match_id = None
-    for match in META_AUTHOR_FINDITER(html):
-        if match_id and match_id != match['id']:
+    for _, id_, content, _ in sorted(
+        entry for key in AUTHOR_META_NAMES
+        for entry in meta.get(key, ())
+    ):
+        if match_id and match_id != id_:
             break
-        if (name := byline_to_names(match['result'])) is not None:
+        if (name := byline_to_names(content)) is not None:
             names.extend(name)
-            match_id = match['id']
-    if names:
+            match_id = id_
+    return names or None
+
+
+def find_authors(html, meta: MetaIndex) -> Optional[List[Tuple[str, str]]]:
+    """Return authors names found in html."""
+    if (names := find_meta_authors(meta)) is not None:
         return names
+    names = []
     match_id = None
     results = set()
     for match in BYLINE_TAG_FINDITER(html):
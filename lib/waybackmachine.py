@@ -1,24 +1,65 @@
 """Define related tools for web.archive.org (aka Wayback Machine)."""
 
 import logging
-from threading import Thread
+from asyncio import gather
+from bisect import bisect_right
 from datetime import date
-from urllib.parse import urlparse
+from functools import cache
+from html import unescape as html_unescape
+from json import JSONDecodeError
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode, urlparse
 
 from regex import compile as regex_compile
-from requests import ConnectionError as RequestsConnectionError
+from requests.structures import CaseInsensitiveDict
+from requests import ConnectionError as RequestsConnectionError, \
+    RequestException, Timeout
 
+import config
+from lib.aio import arequest
+from lib.breaker import CircuitOpenError
+from lib.cache import Cache, MISSING
+from lib.commons import request, Thread
+from lib.meta import meta_index
 from lib.urls import (
-    url_to_dict as urls_url_to_dict, url2dict, analyze_home, get_html, find_authors,
-    find_journal, find_site_name, find_title, ContentTypeError,
-    ContentLengthError, StatusCodeError, TITLE_TAG
+    url_to_dict as urls_url_to_dict, html_to_dict, fetch_html, Home,
+    find_title, ContentTypeError, ContentLengthError, StatusCodeError,
+    TITLE_TAG, HEAD_END_SEARCH, CHUNK_SIZE, check_response_headers,
+    decode_html, aurl_to_dict as urls_aurl_to_dict, ahtml_to_dict,
+    afetch_html, AsyncHome
 )
 
 
 URL_FULLMATCH = regex_compile(
     r'https?+://web(?:-beta)?+\.archive\.org/(?:web/)?+'
-    r'(\d{4})(\d{2})(\d{2})\d{6}(?>cs_|i(?>d_|m_)|js_)?+/(http.*)'
+    r'((\d{4})(\d{2})(\d{2})\d{6})(?>cs_|i(?>d_|m_)|js_)?+/(http.*)'
 ).fullmatch
+# The snapshot as it was archived, without the Wayback Machine banner and
+# with the original links.
+RAW_SNAPSHOT_URL = 'https://web.archive.org/web/{}id_/{}'
+
+# How the status of the original URL is decided. 'fetch' downloads and
+# analyzes the original page. 'probe' sends a HEAD request and, unless the
+# CDX index shows that the page has not changed since the snapshot, reads
+# the <head> of the page to compare its title with the snapshot.
+WAYBACK_LIVENESS = getattr(config, 'WAYBACK_LIVENESS', 'fetch')
+# The CDX index used in probe mode: the path of a local CDX file, 'remote'
+# for the CDX server of web.archive.org, or '' for none.
+WAYBACK_CDX_INDEX = getattr(config, 'WAYBACK_CDX_INDEX', '')
+CDX_URL = 'https://web.archive.org/cdx/search/cdx?'
+# {original url: captures} of the remote CDX index
+CDX_CACHE = Cache(
+    'cdx',
+    maxsize=getattr(config, 'CDX_CACHE_SIZE', 10_000),
+    ttl=getattr(config, 'CDX_CACHE_TTL', 86_400),
+    persistent=True)
+# Maximum number of bytes read by the title probe.
+PROBE_BYTES = 65_536
+# Statuses of HEAD requests that do not mean that the page is missing.
+HEAD_NOT_SUPPORTED = {405, 501}
+
+# (timestamp, status code, digest) of a capture
+Capture = Tuple[str, str, str]
 
 
 def url_to_dict(
@@ -28,93 +69,389 @@ def url_to_dict(
     if (m := URL_FULLMATCH(archive_url)) is None:
         # Could not parse the archive_url. Treat as an ordinary URL.
         return urls_url_to_dict(archive_url, date_format)
-    archive_year, archive_month, archive_day, original_url = \
-        m.groups()
+    timestamp, original_url = m[1], m[5]
     original_dict = {}
-    thread = Thread(
-        target=original_url2dict, args=(original_url, original_dict)
-    )
+    if WAYBACK_LIVENESS == 'probe':
+        thread = Thread(
+            target=probe_original,
+            args=(original_url, timestamp, original_dict))
+    else:
+        thread = Thread(
+            target=original_url2dict, args=(original_url, original_dict))
     thread.start()
-    archive_dict = url2dict(archive_url)
+    html, headers = fetch_html(
+        RAW_SNAPSHOT_URL.format(timestamp, original_url), head_only=True)
+    thread.join()
+    status = url_status(original_url, original_dict, html)
+    html, headers, use_home = source_page(
+        original_dict, html, headers, status)
+    archive_dict = html_to_dict(
+        original_url, html, headers,
+        Home(original_url) if use_home else None)
+    return set_archive_fields(
+        archive_dict, m, status, original_dict, date_format)
+
+
+async def aurl_to_dict(
+    archive_url: str, date_format: str = '%Y-%m-%d'
+) -> dict:
+    """Async variant of url_to_dict."""
+    if (m := URL_FULLMATCH(archive_url)) is None:
+        return await urls_aurl_to_dict(archive_url, date_format)
+    timestamp, original_url = m[1], m[5]
+    original_dict = {}
+    if WAYBACK_LIVENESS == 'probe':
+        original = aprobe_original(original_url, timestamp, original_dict)
+    else:
+        original = aoriginal_url2dict(original_url, original_dict)
+    (html, headers), _ = await gather(afetch_html(
+        RAW_SNAPSHOT_URL.format(timestamp, original_url), head_only=True
+    ), original)
+    status = url_status(original_url, original_dict, html)
+    html, headers, use_home = source_page(
+        original_dict, html, headers, status)
+    archive_dict = await ahtml_to_dict(
+        original_url, html, headers,
+        AsyncHome(original_url) if use_home else None)
+    return set_archive_fields(
+        archive_dict, m, status, original_dict, date_format)
+
+
+def url_status(original_url: str, original_dict: dict, html: str) -> str:
+    """Return the url-status of original_url, html is the snapshot."""
+    if not original_dict or original_dict.get('unavailable'):
+        return 'dead'
+    if original_dict.get('live') or is_same_page(
+        original_url, original_dict, html
+    ):
+        return 'live'
+    return 'unfit'  # the content has probably changed
+
+
+def source_page(
+    original_dict: dict, html: str, headers: CaseInsensitiveDict,
+    status: str,
+) -> Tuple[str, CaseInsensitiveDict, bool]:
+    """Return (html, headers, whether to use the homepage) to extract.
+
+    html and headers are those of the snapshot.
+    """
+    if 'headers' not in original_dict:  # probed
+        # Only the snapshot is available. The homepage of the original
+        # website is relevant if the page is still live.
+        return html, headers, status == 'live'
+    if status == 'live':
+        # Extract the original page instead of the snapshot, it may have
+        # been updated since.
+        return original_dict['html'], original_dict['headers'], True
+    # The homepage of the original website may have changed since and
+    # the homepage of web.archive.org is irrelevant. The site name is
+    # found in the snapshot itself or is the hostname.
+    return html, headers, False
+
+
+def set_archive_fields(
+    archive_dict: dict, m, status: str, original_dict: dict,
+    date_format: str,
+) -> dict:
+    """Set the archive fields of archive_dict, m is the URL_FULLMATCH."""
+    _, archive_year, archive_month, archive_day, original_url = m.groups()
+    archive_dict['url-status'] = status
+    if original_dict.get('unavailable'):
+        # The original may be live once its host recovers.
+        archive_dict['partial'] = True
     archive_dict['date_format'] = date_format
     archive_dict['url'] = original_url
-    archive_dict['archive-url'] = archive_url
+    archive_dict['archive-url'] = m[0]
     archive_dict['archive-date'] = date(
         int(archive_year), int(archive_month), int(archive_day)
     )
-    thread.join()
-    if original_dict:
-        # The original_process has been successful
-        if (
-            original_dict['title'] == archive_dict['title']
-            or original_dict['html_title'] == archive_dict['html_title']
-        ):
-            archive_dict.update(original_dict)
-            archive_dict['url-status'] = 'live'
-        else:
-            # and original title is the same as archive title. Otherwise it
-            # means that the content probably has changed and the original data
-            # cannot be trusted.
-            archive_dict['url-status'] = 'unfit'
-    else:
-        archive_dict['url-status'] = 'dead'
-    if archive_dict['website'] == 'Wayback Machine':
-        archive_dict['website'] = (
-            urlparse(original_url).hostname.replace('www.', '')
-        )
     return archive_dict
 
 
-def original_url2dict(ogurl: str, original_dict) -> None:
-    """Fill the dictionary with the information found in ogurl."""
+def html_title_of(html: str) -> Optional[str]:
+    """Return the unescaped content of the title tag of html."""
+    if (m := TITLE_TAG(html)) is not None:
+        return html_unescape(m['result']) or None
+    return None
+
+
+def original_url2dict(ogurl: str, original_dict: dict) -> None:
+    """Fill original_dict with the html, headers and html_title of ogurl.
+
+    Set 'unavailable' if the host of ogurl is skipped or does not respond in
+    time.
+    """
     # noinspection PyBroadException
     try:
-        original_dict.update(original_url_dict(ogurl))
+        html, headers = fetch_html(ogurl, head_only=True)
+    except (CircuitOpenError, Timeout):
+        original_dict['unavailable'] = True
+        return
     except (
         ContentTypeError,
         ContentLengthError,
         StatusCodeError,
         RequestsConnectionError,
     ):
-        pass
+        return
     except Exception:
         logger.exception(
             'There was an unexpected error in waybackmechine thread'
         )
+        return
+    original_dict['html'] = html
+    original_dict['headers'] = headers
+    original_dict['html_title'] = html_title_of(html)
 
 
-def original_url_dict(url: str):
-    """Retuan dictionary only containing required data for og:url."""
-    d = {}
-    # Creating a thread to request homepage title in background
-    hometitle_list = []  # A mutable variable used to get the thread result
-    home_title_thread = Thread(
-        target=analyze_home, args=(url, hometitle_list)
-    )
-    home_title_thread.start()
-    html = get_html(url)
+async def aoriginal_url2dict(ogurl: str, original_dict: dict) -> None:
+    """Async variant of original_url2dict."""
+    # noinspection PyBroadException
+    try:
+        html, headers = await afetch_html(ogurl, head_only=True)
+    except (CircuitOpenError, Timeout):
+        original_dict['unavailable'] = True
+        return
+    except (
+        ContentTypeError,
+        ContentLengthError,
+        StatusCodeError,
+        RequestsConnectionError,
+    ):
+        return
+    except Exception:
+        logger.exception(
+            'There was an unexpected error in waybackmechine task'
+        )
+        return
+    original_dict['html'] = html
+    original_dict['headers'] = headers
+    original_dict['html_title'] = html_title_of(html)
 
-    if (m := TITLE_TAG(html)) is not None:
-        if html_title := m['result']:
-            d['html_title'] = html_title
-    else:
-        html_title = None
 
-    if authors := find_authors(html):
-        d['authors'] = authors
+def probe_original(url: str, timestamp: str, original_dict: dict) -> None:
+    """Fill original_dict with what is needed to decide if url is live.
 
-    if journal := find_journal(html):
-        d['journal'] = journal
-        d['cite_type'] = 'journal'
-    else:
-        d['cite_type'] = 'web'
-        d['website'] = find_site_name(
-            html, html_title, url, authors, hometitle_list, home_title_thread
+    Leave it empty if url is dead and set 'unavailable' if its host is
+    skipped or does not respond in time. Set 'live' if the CDX index shows
+    that url had the content of the snapshot when it was last captured, or
+    if the content of url cannot be compared with the snapshot. Otherwise,
+    set the html of the <head> of url and its html_title.
+    """
+    try:
+        r = request(url, spoof=True, method='head', allow_redirects=True)
+    except (CircuitOpenError, Timeout):
+        original_dict['unavailable'] = True
+        return
+    except RequestException:
+        return
+    if r.status_code >= 400 and r.status_code not in HEAD_NOT_SUPPORTED:
+        return
+    # url exists. Unless the title probe shows otherwise, it is live.
+    original_dict['live'] = True
+    # noinspection PyBroadException
+    try:
+        if is_unchanged(url, timestamp):
+            return
+        html = fetch_head(url)
+    except (
+        ContentTypeError,
+        ContentLengthError,
+        StatusCodeError,
+        RequestException,
+    ):
+        return
+    except Exception:
+        logger.exception(
+            'There was an unexpected error in waybackmechine thread'
         )
-    d['title'] = find_title(
-        html, html_title, url, authors, hometitle_list, home_title_thread
-    )
-    return d
+        return
+    del original_dict['live']
+    original_dict['html'] = html
+    original_dict['html_title'] = html_title_of(html)
+
+
+async def aprobe_original(
+    url: str, timestamp: str, original_dict: dict
+) -> None:
+    """Async variant of probe_original."""
+    try:
+        r = await arequest(url, spoof=True, method='head')
+    except (CircuitOpenError, Timeout):
+        original_dict['unavailable'] = True
+        return
+    except RequestException:
+        return
+    if r.status_code >= 400 and r.status_code not in HEAD_NOT_SUPPORTED:
+        return
+    # url exists. Unless the title probe shows otherwise, it is live.
+    original_dict['live'] = True
+    # noinspection PyBroadException
+    try:
+        if captures_unchanged(await acdx_captures(url), timestamp):
+            return
+        html = await afetch_head(url)
+    except (
+        ContentTypeError,
+        ContentLengthError,
+        StatusCodeError,
+        RequestException,
+    ):
+        return
+    except Exception:
+        logger.exception(
+            'There was an unexpected error in waybackmechine task'
+        )
+        return
+    del original_dict['live']
+    original_dict['html'] = html
+    original_dict['html_title'] = html_title_of(html)
+
+
+def fetch_head(url: str) -> str:
+    """Return the beginning of url up to </head> or PROBE_BYTES."""
+    with request(url, stream=True, spoof=True) as r:
+        check_response_headers(r)
+        content = bytearray()
+        for chunk in r.iter_content(CHUNK_SIZE):
+            if add_head_chunk(content, chunk):
+                break
+    # PROBE_BYTES may fall in the middle of a character
+    return decode_html(content[:PROBE_BYTES], r.encoding, 'ignore')
+
+
+async def afetch_head(url: str) -> str:
+    """Async variant of fetch_head."""
+    r = await arequest(url, stream=True, spoof=True)
+    try:
+        check_response_headers(r)
+        content = bytearray()
+        async for chunk in r.aiter_bytes(CHUNK_SIZE):
+            if add_head_chunk(content, chunk):
+                break
+    finally:
+        await r.aclose()
+    # PROBE_BYTES may fall in the middle of a character
+    return decode_html(content[:PROBE_BYTES], r.encoding, 'ignore')
+
+
+def add_head_chunk(content: bytearray, chunk: bytes) -> bool:
+    """Add chunk to content. Return True if the rest is not needed."""
+    searched = len(content)
+    content += chunk
+    if (m := HEAD_END_SEARCH(content, max(searched - 6, 0))) is not None:
+        del content[m.end():]
+        return True
+    return len(content) >= PROBE_BYTES
+
+
+def is_unchanged(url: str, timestamp: str) -> bool:
+    """Return True if the last capture of url has the digest of timestamp.
+
+    The snapshot is the last capture at or before timestamp.
+    """
+    return captures_unchanged(cdx_captures(url), timestamp)
+
+
+def captures_unchanged(captures: List[Capture], timestamp: str) -> bool:
+    """Return the is_unchanged result of the captures of a url."""
+    if not captures:
+        return False
+    if (i := bisect_right(captures, (timestamp, '~'))) == 0:
+        return False
+    snapshot, last = captures[i - 1], captures[-1]
+    return snapshot[1] == last[1] == '200' and snapshot[2] == last[2]
+
+
+def cdx_key(url: str) -> str:
+    """Return the key of url in the local CDX index."""
+    parsed = urlparse(url)
+    host = (parsed.hostname or '').removeprefix('www.')
+    return host + (parsed.path.rstrip('/') or '') + (
+        '?' + parsed.query if parsed.query else '')
+
+
+@cache
+def local_cdx_index(path: str) -> Dict[str, List[Capture]]:
+    """Return {cdx_key: sorted captures} of the CDX file at path.
+
+    Lines are expected to have the N b a m s k fields (urlkey, timestamp,
+    original, mimetype, statuscode, digest), in the order given by the
+    CDX header line if the file has one.
+    """
+    fields = 'Nbamsk'
+    index: Dict[str, List[Capture]] = {}
+    with open(path, encoding='utf8') as f:
+        for line in f:
+            parts = line.split()
+            if not parts:
+                continue
+            if parts[0] == 'CDX':
+                fields = ''.join(parts[1:])
+                continue
+            b, a, s, k = (parts[fields.index(c)] for c in 'bask')
+            index.setdefault(cdx_key(a), []).append((b, s, k))
+    for captures in index.values():
+        captures.sort()
+    return index
+
+
+def cdx_captures(url: str) -> List[Capture]:
+    """Return the sorted captures of url in WAYBACK_CDX_INDEX."""
+    if not WAYBACK_CDX_INDEX:
+        return []
+    if WAYBACK_CDX_INDEX != 'remote':
+        return local_cdx_index(WAYBACK_CDX_INDEX).get(cdx_key(url), [])
+    if (captures := CDX_CACHE.get(url)) is not MISSING:
+        return captures
+    try:
+        rows = request(cdx_url(url)).json()
+    except (RequestException, JSONDecodeError):
+        return []
+    return cache_captures(url, rows)
+
+
+async def acdx_captures(url: str) -> List[Capture]:
+    """Async variant of cdx_captures."""
+    if WAYBACK_CDX_INDEX != 'remote':  # no requests are needed
+        return cdx_captures(url)
+    if (captures := CDX_CACHE.get(url)) is not MISSING:
+        return captures
+    try:
+        rows = (await arequest(cdx_url(url))).json()
+    except (RequestException, JSONDecodeError):
+        return []
+    return cache_captures(url, rows)
+
+
+def cdx_url(url: str) -> str:
+    return CDX_URL + urlencode({
+        'url': url, 'output': 'json', 'fl': 'timestamp,statuscode,digest',
+        'collapse': 'digest', 'limit': -1000,
+    })
+
+
+def cache_captures(url: str, rows: list) -> List[Capture]:
+    captures = sorted((*row,) for row in rows[1:])  # rows[0] is the header
+    CDX_CACHE.set(url, captures)
+    return captures
+
+
+def page_title(url: str, html: str, html_title: Optional[str]) -> str:
+    """Return the title of html, found like html_to_dict finds it."""
+    title = find_title(html, meta_index(html), html_title, url, None, None)
+    return title and title.strip()
+
+
+def is_same_page(url: str, original_dict: dict, snapshot_html: str) -> bool:
+    """Return True if the original page has the title of the snapshot."""
+    html_title = html_title_of(snapshot_html)
+    if html_title is not None and original_dict['html_title'] == html_title:
+        return True
+    return page_title(
+        url, original_dict['html'], original_dict['html_title']
+    ) == page_title(url, snapshot_html, html_title)
 
 
 logger = logging.getLogger(__name__)
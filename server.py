@@ -0,0 +1,197 @@
+"""A pre-fork, multi-threaded production server for app.app.
+
+Usage: python3 server.py [--host HOST] [--port PORT] [--workers N]
+    [--threads N]
+
+The master process imports app and warms it up before forking, so the
+workers share the loaded modules, compiled regexes, templates and the langid
+model. Each worker serves the shared listening socket using a pool of
+threads and only accepts connections while one of its threads is idle.
+Workers that die are replaced.
+
+The NCBI rate limit of lib.pubmed is per process. It is divided between the
+workers so that together they stay within the limit.
+
+Signals to the master:
+    SIGTERM, SIGINT: stop accepting connections, let the workers finish
+        their current requests and exit.
+    SIGHUP: graceful reload. The master re-executes itself, keeping the
+        listening socket open and its workers running. Once the new workers
+        that run the updated code are started, the old ones finish their
+        current requests and exit.
+"""
+
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from os import (
+    cpu_count, environ, execv, fork, getpid, kill, waitpid, _exit, WNOHANG)
+from signal import signal, SIGHUP, SIGINT, SIGTERM
+from socket import create_server, getfqdn, socket
+from sys import argv, executable
+from threading import BoundedSemaphore, Thread
+from time import sleep
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+
+import config
+
+# The file descriptor of the listening socket after a reload.
+LISTEN_FD_ENV = 'CITER_LISTEN_FD'
+# The comma-separated pids of the workers started before a reload.
+OLD_WORKERS_ENV = 'CITER_OLD_WORKERS'
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, *_):  # requests are not logged to stderr
+        pass
+
+
+class ThreadPoolWSGIServer(WSGIServer):
+
+    """A WSGIServer that handles requests using a fixed pool of threads."""
+
+    def __init__(self, sock: socket, threads: int):
+        host, port = sock.getsockname()[:2]
+        super().__init__((host, port), QuietHandler, bind_and_activate=False)
+        self.socket.close()  # use the socket that is shared with the others
+        self.socket = sock
+        self.server_name, self.server_port = getfqdn(host), port
+        self.setup_environ()
+        self.pool = ThreadPoolExecutor(threads, thread_name_prefix='worker')
+        # idle threads; connections are left to other workers while all of
+        # the threads are busy
+        self.idle = BoundedSemaphore(threads)
+
+    def server_bind(self):  # the socket is already bound by the master
+        pass
+
+    def get_request(self):
+        self.idle.acquire()
+        try:
+            # The socket is non-blocking. Another worker may have accepted
+            # the connection since the socket became readable.
+            conn, address = self.socket.accept()
+        except BaseException:
+            self.idle.release()
+            raise
+        conn.setblocking(True)
+        return conn, address
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        # noinspection PyBroadException
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.idle.release()
+
+    def server_close(self):  # do not close the socket shared with others
+        self.pool.shutdown(wait=True)
+
+
+def preload(workers: int):
+    """Import app and load everything that is otherwise loaded lazily."""
+    from app import app, warm_up
+    from lib import pubmed
+    warm_up()
+    pubmed.NCBI_BUCKET.rate = pubmed.NCBI_RATE / workers
+    return app
+
+
+def serve(sock: socket, wsgi_app: callable, threads: int):
+    """Run a worker process until it receives SIGTERM."""
+    server = ThreadPoolWSGIServer(sock, threads)
+    server.set_app(wsgi_app)
+
+    def stop(*_):
+        # shutdown waits for serve_forever and must be called from another
+        # thread
+        Thread(target=server.shutdown).start()
+
+    for signum in (SIGTERM, SIGINT, SIGHUP):
+        signal(signum, stop)
+    server.serve_forever()
+    server.server_close()  # waits for the current requests
+
+
+def spawn(sock: socket, wsgi_app: callable, threads: int) -> int:
+    if (pid := fork()) == 0:
+        try:
+            serve(sock, wsgi_app, threads)
+        finally:
+            _exit(0)
+    return pid
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.partition('\n')[0])
+    parser.add_argument(
+        '--host', default=getattr(config, 'SERVER_HOST', 'localhost'))
+    parser.add_argument(
+        '--port', type=int, default=getattr(config, 'SERVER_PORT', 5000))
+    parser.add_argument(
+        '--workers', type=int,
+        default=getattr(config, 'SERVER_WORKERS', None) or cpu_count())
+    parser.add_argument(
+        '--threads', type=int, default=getattr(config, 'SERVER_THREADS', 16))
+    args = parser.parse_args()
+
+    if (fd := environ.pop(LISTEN_FD_ENV, None)) is not None:  # reloaded
+        sock = socket(fileno=int(fd))
+    else:
+        sock = create_server((args.host, args.port), backlog=1024)
+    sock.set_inheritable(True)
+    # another worker may accept a connection first, accept must not block
+    sock.setblocking(False)
+
+    wsgi_app = preload(args.workers)
+
+    workers = {
+        spawn(sock, wsgi_app, args.threads) for _ in range(args.workers)}
+    # the workers of the previous generation stop once the new ones serve
+    if old_workers := environ.pop(OLD_WORKERS_ENV, ''):
+        for pid in map(int, old_workers.split(',')):
+            kill(pid, SIGTERM)
+    print(
+        f'serving on http://{args.host}:{args.port} '
+        f'(pid {getpid()}, {args.workers} workers, {args.threads} threads)')
+
+    signals = []
+    for signum in (SIGTERM, SIGINT, SIGHUP):
+        signal(signum, lambda signum, _: signals.append(signum))
+
+    while not signals:
+        sleep(.5)
+        # replace the workers that died
+        while workers:
+            pid, _ = waitpid(-1, WNOHANG)
+            if pid == 0:
+                break
+            if pid not in workers:  # a worker of the previous generation
+                continue
+            workers.discard(pid)
+            if not signals:
+                workers.add(spawn(sock, wsgi_app, args.threads))
+
+    if signals[0] == SIGHUP:
+        # exec keeps the pid, so the workers remain children of the master
+        environ[LISTEN_FD_ENV] = str(sock.fileno())
+        environ[OLD_WORKERS_ENV] = ','.join(map(str, workers))
+        execv(executable, [executable, *argv])
+
+    for pid in workers:
+        kill(pid, SIGTERM)
+    while True:  # includes the workers of the previous generation
+        try:
+            waitpid(-1, 0)
+        except ChildProcessError:
+            break
+
+
+if __name__ == '__main__':
+    main()
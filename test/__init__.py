@@ -5,9 +5,11 @@ from json import dump, loads, load
 from typing import Optional
 from functools import partial
 
+import httpx
 # noinspection PyPackageRequirements
 from path import Path
 from requests import Session, Response, ConnectionError as RConnectionError
+from requests.structures import CaseInsensitiveDict
 # noinspection PyPackageRequirements
 from environs import Env
 
@@ -86,7 +88,8 @@ def load_response(hsh: str) -> Optional[FakeResponse]:
         USED_TESTDATA.add(filename)
 
     return FakeResponse(
-        d['url'], content, d['status_code'], d['headers'], d['encoding'])
+        d['url'], content, d['status_code'],
+        CaseInsensitiveDict(d['headers']), d['encoding'])
 
 
 def dump_response(hsh, response: Response) -> None:
@@ -155,6 +158,64 @@ original_request = Session.request
 Session.request = fake_request
 
 
+# Response headers that do not apply to the decoded content of testdata.
+CONTENT_CODING_HEADERS = {
+    'content-encoding', 'content-length', 'transfer-encoding'}
+
+
+def fake_build_request(self, method, url, **kwargs):
+    request = original_build_request(self, method, url, **kwargs)
+    # httpx normalizes the url, testdata files are named after the raw one
+    request.extensions['testdata_url'] = str(url)
+    return request
+
+
+async def fake_send(self, request, *, stream=False, **kwargs):
+    """Replay the httpx requests of lib.aio using the testdata of requests."""
+    url = request.extensions.get('testdata_url') or str(request.url)
+    sha1_hex = sha1(url.encode()).hexdigest()
+
+    if FORCE_OVERWRITE_TESTDATA is True:
+        response = None
+    else:
+        try:
+            response = load_response(sha1_hex)
+        except RConnectionError as e:
+            raise httpx.ConnectError(str(e), request=request)
+
+    if response is None:
+        if READONLY_TESTDATA:
+            raise RuntimeError(
+                f'testdata file not found. '
+                f'{READONLY_TESTDATA=} {FORCE_OVERWRITE_TESTDATA=}')
+        print('Downloading ' + url)
+        try:
+            r = await original_send(self, request, **kwargs)
+        except httpx.TransportError:
+            dump_connection_error(sha1_hex)
+            raise
+        await r.aread()
+        response = FakeResponse(
+            str(r.url), r.content, r.status_code, r.headers, r.encoding)
+        dump_response(sha1_hex, response)
+
+    return httpx.Response(
+        response.status_code,
+        headers=[
+            (k, v) for k, v in response.headers.items()
+            if k.lower() not in CONTENT_CODING_HEADERS],
+        content=response.content,
+        # the url of the final response of the redirects
+        request=httpx.Request(request.method, response.url),
+    )
+
+
+original_build_request = httpx.AsyncClient.build_request
+httpx.AsyncClient.build_request = fake_build_request
+original_send = httpx.AsyncClient.send
+httpx.AsyncClient.send = fake_send
+
+
 if REMOVE_UNUSED_TESTDATA is True:
     all_testdata_files = {f.name for f in TESTDATA.files()}
     USED_TESTDATA = {*()}
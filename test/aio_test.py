@@ -0,0 +1,108 @@
+from asyncio import CancelledError, gather, run, sleep
+from threading import active_count
+from time import monotonic
+from unittest.mock import patch
+
+import httpx
+# noinspection PyPackageRequirements
+from pytest import raises
+from requests import ConnectionError as RequestsConnectionError, Timeout
+
+from lib import aio
+from lib.aio import arequest, async_client
+from lib.commons import deadline
+
+
+def test_async_clients():
+    async def clients():
+        return (
+            async_client('doi.org')[0], async_client('doi.org')[0],
+            async_client('api.crossref.org')[0],
+            async_client('example.com')[0], async_client('example.org')[0])
+
+    doi, doi_again, crossref, example_com, example_org = run(clients())
+    assert doi is doi_again
+    assert doi is not crossref
+    # hosts without a pool of their own share one client
+    assert example_com is example_org is not doi
+
+
+def test_hedged_arequest():
+    first = httpx.Response(200, content=b'first')
+    duplicate = httpx.Response(200, content=b'duplicate')
+
+    async def send(*_, **__):
+        send.calls += 1
+        if send.calls == 1:
+            try:
+                await sleep(send.first_delay)
+            except CancelledError:
+                send.cancelled = True
+                raise
+            if send.fail:
+                raise httpx.ReadTimeout('')
+            return first
+        await sleep(.05)
+        return duplicate
+
+    async def hedged(first_delay, fail=False):
+        send.calls, send.cancelled = 0, False
+        send.first_delay, send.fail = first_delay, fail
+        return await arequest('https://doi.org/10.1000/1')
+
+    with patch.object(httpx.AsyncClient, 'send', send), \
+            patch.object(aio, 'HEDGE_DELAY', .05):
+        # a slow first attempt loses to the duplicate and is cancelled
+        assert run(hedged(.3)) is duplicate
+        assert send.cancelled is True
+        # the duplicate is cancelled if the first attempt wins
+        assert run(hedged(.07)) is first
+        assert send.calls == 2
+        # no duplicate is sent if the first attempt is fast
+        assert run(hedged(0)) is first
+        assert send.calls == 1
+        # the duplicate is used if the first attempt fails
+        assert run(hedged(.06, fail=True)) is duplicate
+
+        # no duplicate is sent if the deadline is closer than HEDGE_DELAY
+        async def short_deadline():
+            async_client('doi.org')  # creating the client takes a while
+            with deadline(.04):
+                return await hedged(0, fail=True)
+
+        with raises(Timeout):
+            run(short_deadline())
+        assert send.calls == 1
+
+
+def test_arequest_errors():
+    async def send(*_, **__):
+        raise send.error
+
+    with patch.object(httpx.AsyncClient, 'send', send):
+        send.error = httpx.ConnectError('')
+        with raises(RequestsConnectionError):
+            run(arequest('https://example.com/'))
+        send.error = httpx.ConnectTimeout('')
+        with raises(Timeout):
+            run(arequest('https://example.com/'))
+
+
+def test_arequest_concurrency():
+    async def send(_, request, **__):
+        await sleep(.1)
+        send.threads = max(send.threads, active_count())
+        return httpx.Response(200, content=b'ok', request=request)
+
+    async def fetch_all():
+        return await gather(*[
+            arequest(f'https://example.com/{i}') for i in range(50)])
+
+    send.threads = threads = active_count()
+    with patch.object(httpx.AsyncClient, 'send', send):
+        start = monotonic()
+        responses = run(fetch_all())
+    # the requests wait concurrently without a thread each
+    assert monotonic() - start < 1
+    assert send.threads == threads
+    assert [r.text for r in responses] == ['ok'] * 50
@@ -0,0 +1,104 @@
+from asyncio import run
+from collections import defaultdict
+from json import loads
+from unittest.mock import patch
+
+# noinspection PyPackageRequirements
+from pytest import mark
+from requests import Session
+
+from app import RESULT_CACHE, input_to_scr
+from asgi import ainput_to_scr, application
+from lib.doi import CROSSREF_CACHE
+from lib.googlebooks import VOLUME_CACHE
+from lib.isbn_oclc import BOOK_CACHE, BOOK_NOT_FOUND_CACHE
+from lib.urls import HOME_CACHE, LANGUAGE_CACHE
+from lib.waybackmachine import CDX_CACHE
+
+
+async def fake_doi_to_dict(doi, _, date_format):
+    return defaultdict(
+        lambda: None, cite_type='journal', title=doi, date_format=date_format)
+
+
+def call(scope: dict, body: bytes = b'') -> list:
+    """Return the messages sent by application in response to scope."""
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body}
+
+    async def send(message):
+        messages.append(message)
+
+    run(application({'type': 'http', **scope}, receive, send))
+    return messages
+
+
+@patch('asgi.adoi_to_dict', fake_doi_to_dict)
+def test_page():
+    RESULT_CACHE.clear()
+    messages = call({
+        'path': '/',
+        'query_string': b'user_input=10.1000/3&output_format=json'})
+    assert messages[0]['status'] == 200
+    assert '| title=10.1000/3 |' in loads(
+        messages[1]['body'])['citation_template']
+
+    messages = call({'path': '/', 'query_string': b'user_input=10.1000/3'})
+    assert messages[0]['status'] == 200
+    assert (b'content-type', b'text/html; charset=UTF-8') in \
+        messages[0]['headers']
+    assert b'10.1000/3' in messages[1]['body']
+
+
+@patch('asgi.aget_crossref_dicts')
+@patch('asgi.adoi_to_dict', fake_doi_to_dict)
+def test_batch(_):
+    RESULT_CACHE.clear()
+    messages = call(
+        {'path': '/batch', 'query_string': b''}, b'10.1000/1\n10.1000/2')
+    assert messages[0]['status'] == 200
+    lines = sorted(
+        (loads(m['body']) for m in messages[1:-1]), key=lambda j: j['index'])
+    assert [j['user_input'] for j in lines] == ['10.1000/1', '10.1000/2']
+    assert '| title=10.1000/2 |' in lines[1]['citation_template']
+    assert messages[-1] == {'type': 'http.response.body', 'body': b''}
+
+    messages = call({'path': '/batch', 'query_string': b''}, b'[{}]')
+    assert messages[0]['status'] == 400
+
+
+def clear_caches():
+    for cache in (
+        RESULT_CACHE, HOME_CACHE, LANGUAGE_CACHE, CROSSREF_CACHE, BOOK_CACHE,
+        BOOK_NOT_FOUND_CACHE, VOLUME_CACHE, CDX_CACHE,
+    ):
+        cache.clear()
+
+
+@mark.parametrize('user_input, input_type', [
+    ('http://www.boston.com/cars/news-and-reviews/2014/06/28/'
+     'hot-rod-stamps-google-road-prospectus/hylbVi9qonAwBIH10CwiDP/'
+     'story.html', ''),
+    ('10.1029/2002GL014729', ''),
+    ('9780349119168', ''),
+    ('875039842', 'oclc'),
+    ('http://books.google.com/books?'
+     'id=pzmt3pcBuGYC&pg=PR11&lpg=PP1&dq=digital+library', ''),
+    ('https://www.jstor.org/stable/30078788', ''),
+    ('http://www.noorlib.ir/View/fa/Book/BookView/Image/6120', ''),
+    ('https://ketab.ir/book/27b3444f-1175-4db0-8411-b1719a5d7ed1', ''),
+    ('https://web.archive.org/web/20070429193849id_/'
+     'http://www.londondevelopmentcentre.org/page.php?s=1&p=2462', ''),
+])
+def test_async_resolvers(user_input, input_type):
+    """The async resolvers give the results of the blocking ones."""
+    clear_caches()
+    expected = input_to_scr(user_input, input_type, '')
+    clear_caches()
+    with patch.object(
+        Session, 'request', side_effect=AssertionError('blocking request')
+    ):
+        assert run(ainput_to_scr(user_input, input_type, '')) == expected
+    assert expected[0] == '200 OK'
@@ -0,0 +1,43 @@
+from unittest.mock import patch
+
+# noinspection PyPackageRequirements
+from pytest import raises
+
+from lib import breaker as breaker_module
+from lib.breaker import CircuitBreaker, CircuitOpenError, CLOSED, OPEN, \
+    HALF_OPEN
+
+
+def test_circuit_breaker():
+    b = CircuitBreaker('example.com')
+    for failed in (False, True, True, False):
+        b.before()
+        b.after(failed, .1)
+    assert b.state == CLOSED
+    b.before()
+    b.after(True, .1)  # 3 of 5 calls failed
+    assert b.state == OPEN
+    assert b.available() is False
+    with raises(CircuitOpenError):
+        b.before()
+
+    with patch.object(breaker_module, 'BREAKER_OPEN_SECONDS', 0):
+        assert b.available() is True
+        b.before()  # the probe
+        assert b.state == HALF_OPEN
+        with raises(CircuitOpenError):
+            b.before()  # only one probe at a time
+        b.after(True, .1)
+        assert b.state == OPEN
+        b.before()
+        b.after(False, .1)
+    assert b.state == CLOSED
+    assert b.stats()['calls'] == 0
+
+
+def test_slow_calls_fail():
+    b = CircuitBreaker('example.com')
+    for _ in range(5):
+        b.before()
+        b.after(False, breaker_module.BREAKER_SLOW_CALL + 1)
+    assert b.state == OPEN
@@ -0,0 +1,105 @@
+from asyncio import create_task, gather, run, sleep as async_sleep
+from threading import Event, Thread
+from time import sleep
+from unittest.mock import patch
+
+from pytest import raises
+
+from lib.cache import Cache, MISSING, SingleFlight
+
+
+def test_lru_eviction():
+    c = Cache('test', maxsize=2, ttl=60)
+    c.set('a', 1)
+    c.set('b', 2)
+    assert c.get('a') == 1  # 'b' is now the least recently used
+    c.set('c', 3)
+    assert c.get('b') is MISSING
+    assert c.get('a') == 1
+    assert c.get('c') == 3
+    assert c.stats() == {
+        'size': 2, 'maxsize': 2, 'hits': 3, 'misses': 1, 'persistent': False}
+
+
+def test_ttl():
+    c = Cache('test', maxsize=2, ttl=60)
+    with patch('lib.cache.time', return_value=0):
+        c.set('a', None)
+        c.set('b', 2, ttl=10)
+    with patch('lib.cache.time', return_value=30):
+        assert c.get('a') is None
+        assert c.get('b') is MISSING
+        assert len(c) == 1
+
+
+def test_persistent(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    Cache('test', maxsize=2, ttl=60, path=path).set(('a', 1), [1])
+    c = Cache('test', maxsize=2, ttl=60, path=path)
+    assert len(c) == 0
+    assert c.get(('a', 1)) == [1]
+    assert len(c) == 1
+    assert Cache('other', maxsize=2, ttl=60, path=path).get(('a', 1)) \
+        is MISSING
+
+
+def test_single_flight():
+    sf = SingleFlight('test')
+    release = Event()
+    calls = []
+
+    def func(x):
+        calls.append(x)
+        release.wait()
+        if x == 'bad':
+            raise ValueError(x)
+        return [x]
+
+    results = []
+
+    def target(x):
+        try:
+            results.append(sf.do(x, func, x))
+        except ValueError as e:
+            results.append(e)
+
+    threads = [Thread(target=target, args=(x,)) for x in ('a', 'a', 'bad')]
+    for t in threads:
+        t.start()
+    while sf.stats()['in_flight'] != 2 or sf.deduplicated != 1:
+        sleep(.001)
+    release.set()
+    for t in threads:
+        t.join()
+    assert sorted(calls) == ['a', 'bad']
+    a1, a2 = (r for r in results if r == ['a'])
+    assert a1 is a2
+    assert sf.stats() == {'in_flight': 0, 'deduplicated': 1}
+    with raises(ValueError):
+        sf.do('bad', func, 'bad')
+
+
+def test_async_single_flight():
+    sf = SingleFlight('test')
+    calls = []
+
+    async def func(x):
+        calls.append(x)
+        await async_sleep(.01)
+        if x == 'bad':
+            raise ValueError(x)
+        return [x]
+
+    async def main():
+        first = create_task(sf.ado('a', func, 'a'))
+        await async_sleep(0)  # the first call starts before the others
+        results = await gather(
+            sf.ado('a', func, 'a'), sf.ado('bad', func, 'bad'),
+            return_exceptions=True)
+        assert sf.stats() == {'in_flight': 0, 'deduplicated': 1}
+        return await first, *results
+
+    a1, a2, bad = run(main())
+    assert a1 == ['a'] and a1 is a2
+    assert isinstance(bad, ValueError)
+    assert sorted(calls) == ['a', 'bad']
@@ -0,0 +1,33 @@
+from copy import deepcopy
+from pickle import dumps, loads
+
+from pytest import raises
+
+from lib.citation import Citation
+
+
+def test_defaultdict_compatibility():
+    c = Citation({'title': 'T', 'archive-url': 'https://a.b/', 'sn': '1'})
+    assert c['title'] == c.title == 'T'
+    assert c['archive-url'] == c.archive_url == 'https://a.b/'
+    assert c['doi'] is c.doi is None
+    assert 'doi' not in c  # reading a missing key does not add it
+    assert c.extras == {'sn': '1'}
+    assert c['t2'] is None
+    c['doi'] = '10.1000/1'
+    del c['sn']
+    assert c == {
+        'title': 'T', 'archive-url': 'https://a.b/', 'doi': '10.1000/1'}
+    assert c.pop('year', None) is None
+    with raises(KeyError):
+        del c['year']
+    with raises(AttributeError):
+        _ = c.archive_urls
+
+
+def test_copy_and_pickle():
+    c = Citation(authors=[('F', 'L')], date_format='%Y', type='JOUR')
+    for copy in (deepcopy(c), loads(dumps(c))):
+        assert copy == c
+        copy['authors'].append(('F2', 'L2'))
+        assert c['authors'] == [('F', 'L')]
@@ -0,0 +1,130 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from time import sleep
+from unittest.mock import Mock, patch
+
+# noinspection PyPackageRequirements
+from pytest import raises
+from requests import Session, Timeout
+
+from lib import commons
+from lib.commons import AGENT_HEADER, DeadlineExceededError, deadline, \
+    fetch_memo, request, upstream_stats
+from test import real_request
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *_):
+        pass
+
+
+def test_request_reuses_connections():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/'
+    try:
+        with real_request():
+            for _ in range(3):
+                assert request(url, headers={'X-A': 'b'}).text == 'ok'
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert upstream_stats()['127.0.0.1'] == {
+        'requests': 3, 'connections': 1, 'reused': 2 / 3}
+    assert 'X-A' not in AGENT_HEADER
+
+
+def test_deadline():
+    send = Mock(return_value=Mock(status_code=200))
+    with patch.object(Session, 'request', send), \
+            patch.object(commons, 'HEDGED_HOSTS', ()):
+        with deadline(2):
+            request('https://example.com/1')
+            connect, read = send.call_args.kwargs['timeout']
+            assert connect <= 3.05 and 1.5 < read <= 2
+
+            def in_thread():
+                request('https://example.com/2')
+            (t := commons.Thread(target=in_thread)).start()
+            t.join()
+            assert send.call_args.kwargs['timeout'][1] <= 2
+        with deadline(0), raises(DeadlineExceededError):
+            request('https://example.com/3')
+    assert send.call_count == 2
+
+
+def test_hedged_request():
+    first, duplicate = Mock(status_code=200), Mock(status_code=200)
+
+    def send(*_, **__):
+        send.calls += 1
+        if send.calls == 1:
+            sleep(send.first_delay)
+            if send.fail:
+                raise Timeout
+            return first
+        sleep(.05)
+        return duplicate
+
+    with patch.object(Session, 'request', send), \
+            patch.object(commons, 'HEDGE_DELAY', .05):
+        # a slow first attempt loses to the duplicate and is closed
+        send.calls, send.fail, send.first_delay = 0, False, .3
+        assert request('https://doi.org/10.1000/1') is duplicate
+        first.close.assert_not_called()
+        sleep(.3)
+        first.close.assert_called_once()
+        # the duplicate is closed if the first attempt wins
+        send.calls, send.first_delay = 0, .07
+        assert request('https://doi.org/10.1000/1') is first
+        sleep(.1)
+        duplicate.close.assert_called_once()
+        # no duplicate is sent if the first attempt is fast
+        send.calls, send.first_delay = 0, 0
+        assert request('https://doi.org/10.1000/1') is first
+        assert send.calls == 1
+        # the duplicate is used if the first attempt fails
+        send.calls, send.fail, send.first_delay = 0, True, .1
+        assert request('https://doi.org/10.1000/1') is duplicate
+        # no duplicate is sent if the deadline is closer than HEDGE_DELAY
+        send.calls = 0
+        with deadline(.04), raises(Timeout):
+            request('https://doi.org/10.1000/1')
+        assert send.calls == 1
+
+
+def test_fetch_memo():
+    def send(*_, **__):
+        sleep(.05)
+        return Mock(status_code=200)
+
+    send = Mock(side_effect=send)
+    with patch.object(Session, 'request', send), \
+            patch.object(commons, 'HEDGED_HOSTS', ()):
+        with fetch_memo():
+            (t := commons.Thread(
+                target=request, args=('https://example.com/1',))).start()
+            r = request('https://example.com/1')
+            t.join()
+            assert request('https://example.com/1') is r
+            request('https://example.com/1', spoof=True)
+            request('https://example.com/1', method='post')
+            request('https://example.com/1', memo=False)
+        request('https://example.com/1')
+        assert send.call_count == 5
+        # responses with an error status are not reused
+        send.side_effect = None
+        send.return_value = Mock(status_code=503)
+        with fetch_memo():
+            request('https://example.com/2')
+            request('https://example.com/2')
+    assert send.call_count == 7
@@ -1,4 +1,11 @@
-from lib.doi import doi_to_dict
+from unittest.mock import Mock, patch
+
+# noinspection PyPackageRequirements
+from pytest import raises
+from requests import HTTPError, JSONDecodeError
+
+from lib.doi import doi_to_dict, get_crossref_dict, get_crossref_dicts, \
+    CROSSREF_CACHE
 from lib.commons import dict_to_sfn_cit_ref
 
 
@@ -167,3 +174,60 @@ def test_doi_with_full_date():  # 36
         '| issue=10 | date=2002-05-15 | issn=0094-8276 '
         '| doi=10.1029/2002gl014729 | pages=15–1–15–3}}'
     ) == doi_scr('10.1029/2002GL014729')[1]
+
+
+def test_crossref_cache():
+    CROSSREF_CACHE.clear()
+    doi_to_dict('10.1038/nrd842', True)
+    with patch('lib.doi.request') as request:
+        assert doi_to_dict('10.1038/NRD842', True)['doi'] == '10.1038/nrd842'
+    request.assert_not_called()
+
+
+def test_crossref_negative_cache():
+    CROSSREF_CACHE.clear()
+    not_found = Mock(status_code=404)
+    not_found.json.side_effect = JSONDecodeError('', '', 0)
+    with patch('lib.doi.request', return_value=not_found) as request:
+        for _ in range(2):
+            with raises(JSONDecodeError):
+                get_crossref_dict('10.1000/not-found')
+    request.assert_called_once()
+
+    # error bodies of other statuses are not cached, even if they are JSON
+    CROSSREF_CACHE.clear()
+    busy = Mock(status_code=429)
+    busy.json.return_value = {'message': 'rate limited'}
+    with patch('lib.doi.request', return_value=busy) as request:
+        for _ in range(2):
+            with raises(HTTPError):
+                get_crossref_dict('10.1000/busy')
+    assert request.call_count == 2
+
+
+def test_crossref_batch():
+    CROSSREF_CACHE.clear()
+    works = Mock()
+    works.json.return_value = {'message': {'items': [{
+        'DOI': '10.1000/A', 'type': 'journal-article', 'title': ['A'],
+        'container-title': [], 'reference': [{}],
+    }]}}
+    with patch('lib.doi.request', return_value=works) as request, \
+            patch('lib.doi.get_csl_json', return_value={
+                'DOI': '10.1000/b', 'type': 'dataset', 'title': 'B'}):
+        ds = get_crossref_dicts(['10.1000/a', '10.1000/b'])
+    assert request.call_args[0][0] == (
+        'https://api.crossref.org/works'
+        '?filter=doi%3A10.1000%2Fa%2Cdoi%3A10.1000%2Fb&rows=2')
+    assert ds['10.1000/a']['title'] == 'A'
+    assert ds['10.1000/a']['container-title'] is None
+    assert ds['10.1000/a']['cite_type'] == 'journal-article'
+    assert ds['10.1000/b']['title'] == 'B'
+    assert 'reference' not in CROSSREF_CACHE.get('10.1000/a')
+
+    CROSSREF_CACHE.clear()
+    with patch('lib.doi.request', return_value=works), \
+            patch('lib.doi.get_csl_json') as get_csl_json:
+        ds = get_crossref_dicts(['10.1000/a', '10.1000/b'], fallback=False)
+    get_csl_json.assert_not_called()
+    assert [*ds] == ['10.1000/a']
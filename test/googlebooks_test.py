@@ -1,9 +1,11 @@
+from unittest.mock import patch
 from urllib.parse import urlparse
 
 from pytest import mark
 
+from lib import googlebooks
 from lib.commons import dict_to_sfn_cit_ref
-from lib.googlebooks import url_to_dict
+from lib.googlebooks import url_to_dict, VOLUME_CACHE
 
 
 def _googlebooks_scr(url):
@@ -152,3 +154,19 @@ def test_gb5():
         ' '
         '| access-date=') in o[2]
     assert ' | page=378}}&lt;/ref&gt;' in o[2]
+
+
+def test_volume_cache():
+    VOLUME_CACHE.clear()
+    with patch.object(
+        googlebooks, 'request', wraps=googlebooks.request
+    ) as request:
+        d1 = url_to_dict(urlparse(
+            'https://books.google.com/books?id=pzmt3pcBuGYC&pg=PR11'))
+        d2 = url_to_dict(urlparse(
+            'https://books.google.de/books?id=pzmt3pcBuGYC&pg=PA5'), '%B %Y')
+    request.assert_called_once()
+    assert (d1['page'], d2['page']) == ('11', '5')
+    assert d2['url'] == 'https://books.google.com/books?id=pzmt3pcBuGYC&pg=PA5'
+    assert d2['date_format'] == '%B %Y'
+    assert d1['title'] == d2['title'] == 'Digital Libraries'
@@ -1,6 +1,11 @@
+from unittest.mock import Mock, patch
+
 from pytest import raises
 
-from lib.isbn_oclc import isbn_to_dict, oclc_dict
+from config import LANG
+from lib.cache import MISSING
+from lib.isbn_oclc import isbn_to_dict, oclc_dict, seed_books, BOOK_CACHE, \
+    BOOK_NOT_FOUND_CACHE, IsbnError, canonical_isbn
 from lib.commons import ISBN_10OR13_SEARCH, dict_to_sfn_cit_ref, ReturnError
 
 
@@ -97,3 +102,55 @@ def test_invalid_oclc():
             'Make sure the OCLC identifier is valid.',
             ''
         )
+
+
+def test_book_cache():
+    BOOK_CACHE.clear()
+    BOOK_NOT_FOUND_CACHE.clear()
+    isbn_to_dict('9780349119168', True)
+    with raises(ReturnError):
+        oclc_dict('99999999999999')
+    with patch('lib.isbn_oclc.request') as request:
+        assert isbn_to_dict('978-0-349-11916-8', True)['oclc'] == '137313052'
+        with raises(ReturnError):
+            oclc_dict('99999999999999')
+    request.assert_not_called()
+
+
+def test_citoid_errors_are_not_cached():
+    BOOK_CACHE.clear()
+    BOOK_NOT_FOUND_CACHE.clear()
+    with patch(
+        'lib.isbn_oclc.request', return_value=Mock(status_code=429)
+    ), raises(IsbnError):
+        isbn_to_dict('0 306 40615 2', True)
+    assert BOOK_NOT_FOUND_CACHE.stats()['size'] == 0
+
+
+def test_skipped_ketabir_result_is_partial():
+    BOOK_CACHE.clear()
+    BOOK_NOT_FOUND_CACHE.clear()
+    with patch('lib.isbn_oclc.available', return_value=False):
+        d = isbn_to_dict('964-6736-34-3 ')
+    assert d['partial'] is True
+    assert d['oclc'] == '53446327'  # from citoid
+    # only the result of citoid itself is cached
+    isbn13 = canonical_isbn('964-6736-34-3')
+    assert BOOK_CACHE.get(f'isbn_{LANG}:{isbn13}') is MISSING
+
+
+def test_seed_books():
+    BOOK_CACHE.clear()
+    assert seed_books([{
+        'isbn': '0-306-40615-2', 'title': 'Seeded', 'cite_type': 'book',
+        'language': 'en'}]) == 1
+    with patch('lib.isbn_oclc.request') as request:
+        d = isbn_to_dict('0 306 40615 2', True, '%B %-d, %Y')
+    request.assert_not_called()
+    assert (d['title'], d['date_format']) == ('Seeded', '%B %-d, %Y')
+
+
+def test_canonical_isbn():
+    assert canonical_isbn('978-0-306-40615-7') == 9780306406157
+    assert canonical_isbn('0 306 40615 2') == 9780306406157
+    assert canonical_isbn('080442957X') == 9780804429573
@@ -1,8 +1,13 @@
-from unittest.mock import patch, Mock
+from asyncio import gather, run
+from threading import Thread
+from time import monotonic
+from unittest.mock import call, patch, Mock
+
+from requests import Session
 
 from lib import pubmed
 from lib.pubmed import pmid_dict, pmcid_dict
-from lib.commons import dict_to_sfn_cit_ref
+from lib.commons import dict_to_sfn_cit_ref, fetch_memo
 
 
 pmid_scr = lambda *args: dict_to_sfn_cit_ref(pmid_dict(*args))
@@ -53,3 +58,72 @@ def test_has_doi_but_no_crossref():
         '| date=22 August 2008 | pmid=18723523 | pmc=2562006 '
         '| doi=10.1093/bioinformatics/btn450 | pages=2339–2343}}'
     ) in pmcid_scr('2562006', '%d %B %Y')[1]
+
+
+@patch.object(pubmed, 'NCBI_BATCH_WINDOW', .2)
+def test_esummary_batching():
+    response = Mock()
+    response.json.return_value = {'result': {
+        'uids': ['1', '2'], '1': {'title': 'A'}, '2': {'title': 'B'}}}
+    results = {}
+    batcher = pubmed.ESummaryBatcher('https://example.com/?id=')
+
+    def get(id_):
+        results[id_] = batcher.get(id_)
+
+    with patch.object(pubmed, 'request', return_value=response) as request:
+        threads = [Thread(target=get, args=(i,)) for i in '121']
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    request.assert_called_once_with(
+        'https://example.com/?id=1,2', memo=False)
+    assert results == {'1': {'title': 'A'}, '2': {'title': 'B'}}
+
+
+@patch.object(pubmed, 'NCBI_BATCH_WINDOW', 0)
+@patch.object(pubmed, 'NCBI_BUCKET', pubmed.TokenBucket(1000))
+def test_rate_limit_retry_in_fetch_memo():
+    rate_limited = Mock(status_code=200)
+    rate_limited.json.return_value = {
+        'error': 'API rate limit exceeded', 'count': '11'}
+    found = Mock(status_code=200)
+    found.json.return_value = {'result': {'uids': ['123'], '123': {
+        'title': 'T', 'pubdate': '2012', 'pubtype': ['Journal Article']}}}
+    with patch.object(
+        Session, 'request', side_effect=[rate_limited, found]
+    ) as request, fetch_memo():
+        assert pubmed.ncbi('pmid', '123')['title'] == 'T'
+    assert request.call_count == 2
+
+
+@patch.object(pubmed, 'NCBI_BATCH_WINDOW', .2)
+@patch.object(pubmed, 'NCBI_BUCKET', pubmed.TokenBucket(1000))
+def test_async_esummary_batching():
+    rate_limited = Mock()
+    rate_limited.json.return_value = {
+        'error': 'API rate limit exceeded', 'count': '11'}
+    found = Mock()
+    found.json.return_value = {'result': {
+        'uids': ['1', '2'], '1': {'title': 'A'}, '2': {'title': 'B'}}}
+    batcher = pubmed.AsyncESummaryBatcher('https://example.com/?id=')
+
+    async def get_all():
+        return await gather(*[batcher.get(i) for i in '121'])
+
+    with patch.object(
+        pubmed, 'arequest', side_effect=[rate_limited, found]
+    ) as arequest:
+        results = run(get_all())
+    assert arequest.call_args_list == [
+        call('https://example.com/?id=1,2')] * 2
+    assert results == [{'title': 'A'}, {'title': 'B'}, {'title': 'A'}]
+
+
+def test_token_bucket():
+    bucket = pubmed.TokenBucket(20)
+    start = monotonic()
+    for _ in range(3):
+        bucket.acquire()
+    assert .09 < monotonic() - start < .5
@@ -0,0 +1,88 @@
+from pathlib import Path
+from signal import SIGHUP, SIGTERM
+from socket import create_server, socket
+from subprocess import PIPE, Popen
+from sys import executable
+from threading import Event, Thread
+from time import monotonic, sleep
+from urllib.request import urlopen
+
+from server import ThreadPoolWSGIServer
+
+
+def test_busy_worker_does_not_accept():
+    release = Event()
+    entered = Event()
+
+    def wsgi_app(environ, start_response):
+        if environ['PATH_INFO'] == '/slow':
+            entered.set()
+            release.wait(5)
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b'ok']
+
+    sock = create_server(('localhost', 0))
+    sock.setblocking(False)
+    url = 'http://localhost:%d/' % sock.getsockname()[1]
+    servers = []
+
+    def start_worker():  # a worker sharing the socket, with one thread
+        server = ThreadPoolWSGIServer(sock, 1)
+        server.set_app(wsgi_app)
+        Thread(target=server.serve_forever, args=(.01,)).start()
+        servers.append(server)
+
+    try:
+        start_worker()
+        slow = Thread(target=urlopen, args=(url + 'slow',))
+        slow.start()
+        assert entered.wait(5)
+        fast = []
+        Thread(target=lambda: fast.append(
+            urlopen(url + 'fast', timeout=5).read())).start()
+        sleep(.2)
+        # the busy worker left the connection to the worker started now
+        start_worker()
+        deadline = monotonic() + 2
+        while not fast and monotonic() < deadline:
+            sleep(.01)
+        assert fast == [b'ok']
+        assert slow.is_alive()
+    finally:
+        release.set()
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+        sock.close()
+
+
+def serving_line(process: Popen) -> str:
+    while 'serving on' not in (line := process.stdout.readline()):
+        assert line, 'the server exited'
+    return line
+
+
+def test_graceful_reload():
+    with socket() as s:
+        s.bind(('localhost', 0))
+        port = s.getsockname()[1]
+    url = f'http://localhost:{port}/status'
+    process = Popen(
+        [executable, 'server.py', '--port', str(port), '--workers', '1',
+         '--threads', '2'],
+        cwd=Path(__file__).parent.parent, stdout=PIPE, text=True)
+    try:
+        serving_line(process)
+        assert urlopen(url, timeout=5).status == 200
+        process.send_signal(SIGHUP)
+        # the old worker serves while the new master preloads the app
+        start = monotonic()
+        assert urlopen(url, timeout=5).status == 200
+        assert monotonic() - start < 1
+        serving_line(process)
+        assert urlopen(url, timeout=5).status == 200
+        process.send_signal(SIGTERM)
+        assert process.wait(10) == 0
+    finally:
+        process.kill()
+        process.stdout.close()
@@ -1,5 +1,12 @@
+from collections import defaultdict
+from io import BytesIO
+from json import loads
+from pathlib import Path
+from subprocess import check_output
+from sys import executable
+from threading import Event
 from urllib.parse import urlparse
-from unittest.mock import patch
+from unittest.mock import patch, Mock
 
 # noinspection PyPackageRequirements
 from pytest import raises
@@ -7,7 +14,8 @@ from requests import JSONDecodeError
 
 from app import (
     input_to_dict, TLDLESS_NETLOC_RESOLVER, google_books_dict,
-    noorlib_url_to_dict, noormags_url_to_dict, google_encrypted_dict
+    noorlib_url_to_dict, noormags_url_to_dict, google_encrypted_dict,
+    RESULT_CACHE, app, parse_batch, batch_lines
 )
 
 
@@ -77,3 +85,98 @@ def test_doi_url_fallback_to_url(doi_scr, urls_scr):
     assert input_to_dict(user_input, '%B %#d, %Y') is urls_scr.return_value
     doi_scr.assert_called_once_with('10.5555/3157382.3157535', True, '%B %#d, %Y')
     urls_scr.assert_called_once_with(user_input, '%B %#d, %Y')
+
+
+@patch('app.doi_to_dict', side_effect=lambda doi, _, date_format: {
+    'doi': doi, 'authors': [], 'date_format': date_format})
+def test_result_cache(doi_to_dict):
+    RESULT_CACHE.clear()
+    d1 = input_to_dict('10.1000/ABC', '%Y-%m-%d')
+    d1['authors'].append(('first', 'last'))  # rendering may modify d
+    d2 = input_to_dict('https://doi.org/10.1000/abc', '%B %-d, %Y')
+    doi_to_dict.assert_called_once()
+    assert d2 == {
+        'doi': '10.1000/ABC', 'authors': [], 'date_format': '%B %-d, %Y'}
+    assert RESULT_CACHE.stats()['hits'] == 1
+
+
+@patch('app.doi_to_dict', side_effect=lambda doi, _, date_format: {
+    'doi': doi, 'date_format': date_format, 'partial': True})
+def test_partial_results_are_not_cached(doi_to_dict):
+    RESULT_CACHE.clear()
+    input_to_dict('10.1000/ABC', '%Y-%m-%d')
+    input_to_dict('10.1000/ABC', '%Y-%m-%d')
+    assert doi_to_dict.call_count == 2
+    assert RESULT_CACHE.stats()['size'] == 0
+
+
+def test_parse_batch():
+    assert parse_batch(
+        '["10.1000/1", {"user_input": "123", "input_type": "pmid"}]',
+        '', '%Y-%m-%d',
+    ) == [('10.1000/1', '', '%Y-%m-%d'), ('123', 'pmid', '%Y-%m-%d')]
+    assert parse_batch(
+        '10.1000/1\n\n{"user_input": "10.1000/2", "dateformat": "%B %-d, %Y"}',
+        'url-doi-isbn', '',
+    ) == [
+        ('10.1000/1', 'url-doi-isbn', ''),
+        ('10.1000/2', 'url-doi-isbn', '%B %-d, %Y')]
+    with raises(ValueError):
+        parse_batch('[{"input_type": "pmid"}]', '', '')
+
+
+@patch('app.get_crossref_dicts')
+@patch('app.doi_to_dict', side_effect=lambda doi, _, date_format: defaultdict(
+    lambda: None, cite_type='journal', title=doi, date_format=date_format))
+def test_batch(_, get_crossref_dicts):
+    RESULT_CACHE.clear()
+    body = b'["10.1000/1", "10.1000/2"]'
+    start_response = Mock()
+    response = app({
+        'PATH_INFO': '/batch', 'QUERY_STRING': '',
+        'CONTENT_LENGTH': str(len(body)), 'wsgi.input': BytesIO(body),
+    }, start_response)
+    lines = sorted(
+        (loads(line) for line in response), key=lambda j: j['index'])
+    assert start_response.call_args[0][0] == '200 OK'
+    assert [(j['index'], j['user_input']) for j in lines] == [
+        (0, '10.1000/1'), (1, '10.1000/2')]
+    assert '| title=10.1000/2 |' in lines[1]['citation_template']
+    get_crossref_dicts.assert_called_once_with(
+        ['10.1000/1', '10.1000/2'], fallback=False)
+
+
+def test_batch_upstream_scheduling():
+    released = Event()
+
+    def batch_line(index, item):
+        if item[0].startswith('a.com'):
+            assert released.wait(5)
+        return str(index)
+
+    items = [(f'a.com/{i}', '', '') for i in range(3)] + [('b.com/', '', '')]
+    with patch('app.batch_line', batch_line), \
+            patch('app.BATCH_WORKERS', 2), \
+            patch('app.BATCH_UPSTREAM_LIMIT', 1):
+        lines = batch_lines(items)
+        # the waiting a.com items do not hold the thread that b.com needs
+        assert next(lines) == b'3\n'
+        released.set()
+        assert sorted(lines) == [b'0\n', b'1\n', b'2\n']
+
+
+def test_status():
+    start_response = Mock()
+    j = loads(b''.join(app(
+        {'PATH_INFO': '/status', 'QUERY_STRING': ''}, start_response)))
+    assert start_response.call_args[0][0] == '200 OK'
+    assert j['caches']['results']['maxsize'] == RESULT_CACHE.maxsize
+    assert {'breakers', 'upstreams', 'in_flight'} < j.keys()
+
+
+def test_lazy_imports():
+    loaded = check_output([executable, '-c', (
+        'import sys, app\n'
+        'print(sorted({"bs4", "langid", "lxml"} & sys.modules.keys()))')],
+        cwd=Path(__file__).parent.parent, text=True)
+    assert loaded == '[]\n'
@@ -1,8 +1,15 @@
+from unittest.mock import patch
+
 # noinspection PyPackageRequirements
 from pytest import mark
 
-from lib.urls import url_to_dict
+from lib import urls
+from lib.cache import Cache
+from lib.urls import url_to_dict, get_html, parse_title, Home, \
+    find_language, LANGUAGE_CACHE
 from lib.commons import dict_to_sfn_cit_ref
+from lib.meta import meta_index, first_content
+from test import FakeResponse
 
 
 def urls_scr(*args):
@@ -987,3 +994,99 @@ def test_use_doi_if_available():
         'volume=27 | issue=3 | year=2020 | issn=1117-1936 | '
         'doi=10.4103/npmj.npmj_69_20 | page=242}}'
     )
+
+
+def test_meta_index():
+    meta = meta_index(
+        '<meta property="og:title" content="a > b">'
+        '<meta property ="og:site_name" content="Unquoted">'
+        '<META NAME="Author" content=\'Bob "B" Smith\'>'
+        '<meta name="author" content="">'
+    )
+    assert first_content(meta, 'og:title') == 'a > b'
+    # the name="value" form is required
+    assert first_content(meta, 'og:site_name') is None
+    assert meta['author'] == [(92, 'NAME="Author"', 'Bob "B" Smith', True)]
+
+
+HEAD = (
+    b'<html lang="en"><head><title>T - Site</title>'
+    b'<meta property="og:title" content="T">'
+    b'<meta property="og:site_name" content="Site">'
+    b'<meta name="author" content="John Smith">'
+    b'<meta name="date" content="2020-01-02">'
+    b'</head>'
+)
+
+
+def fake_streamed_response(*chunks):
+    r = FakeResponse(
+        'http://example.com/', b'', 200, {'content-type': 'text/html'},
+        'utf-8')
+    r.iter_content = lambda _: iter(chunks)
+    return r
+
+
+def test_get_html_head_only():
+    r = fake_streamed_response(HEAD[:50], HEAD[50:], b'<body>', b'</body>')
+    with patch.object(urls, 'request', return_value=r):
+        assert get_html('http://example.com/', True) == HEAD.decode()
+
+
+def test_get_html_head_only_split_character():
+    body = '<body>سلام</body>'.encode()
+    # the first chunk ends in the middle of a two-byte character
+    r = fake_streamed_response(HEAD + body[:7], body[7:])
+    with patch.object(urls, 'request', return_value=r):
+        assert get_html('http://example.com/', True) == HEAD.decode()
+
+
+def test_get_html_head_only_incomplete_head():
+    head = HEAD.replace(b'author', b'description')
+    r = fake_streamed_response(head, b'<body>By John Smith</body>')
+    with patch.object(urls, 'request', return_value=r):
+        assert get_html('http://example.com/', True) == \
+            head.decode() + '<body>By John Smith</body>'
+
+
+def test_find_language():
+    def language(html, headers=None, url='https://example.com/a'):
+        return find_language(html, meta_index(html), headers or {}, url, 'T')
+
+    assert language('<html class="x" lang="fa-IR"><p lang="en">') == 'fa'
+    assert language('<html>', {'content-language': 'de-DE, en'}) == 'de'
+    assert language(
+        '<meta property="og:locale" content="pt_BR"><p lang="en">') == 'pt'
+    assert language('<body lang="fr">') == 'fr'
+    LANGUAGE_CACHE.clear()
+    with patch.object(urls, 'classify', return_value=('es', 0.)) as classify:
+        assert language(
+            '<script>x</script><p>Hola <b>mundo</b></p>') == 'es'
+        assert language('<p>Other page</p>', url='https://example.com/b') \
+            == 'es'
+    classify.assert_called_once_with('T Hola mundo')
+
+
+def test_home_is_lazy():
+    home = Home('https://example.com/a')
+    with patch.object(urls, 'analyze_home') as analyze_home:
+        assert parse_title(
+            'Title - Example', 'https://example.com/a', None, home
+        ) == (None, 'Title', 'Example')
+    analyze_home.assert_not_called()
+
+
+def test_home_cache(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    Cache('home', maxsize=2, ttl=60, path=path).set(
+        'https://example.com', ('Example', 'Home - Example'))
+    # a new process only finds the entry on disk
+    with patch.object(
+        urls, 'HOME_CACHE', Cache('home', maxsize=2, ttl=60, path=path)
+    ), patch.object(urls, 'Thread') as thread, patch.object(
+        urls, 'request'
+    ) as request:
+        assert Home('https://example.com/a/b').result() == (
+            'Example', 'Home - Example')
+    thread.assert_not_called()
+    request.assert_not_called()
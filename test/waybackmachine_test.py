@@ -1,11 +1,54 @@
-from lib.waybackmachine import url_to_dict
+from hashlib import sha1
+from unittest.mock import patch
+
+from pytest import mark
+
+from lib import urls, waybackmachine
+from lib.breaker import CircuitOpenError
+from lib.waybackmachine import url_to_dict, RAW_SNAPSHOT_URL
 from lib.commons import dict_to_sfn_cit_ref
+from test import FakeResponse, READONLY_TESTDATA, TESTDATA
+
+
+def raw_snapshot_recorded(timestamp: str, url: str):
+    """Skip the test if the id_ snapshot of url has not been recorded.
+
+    Record it by running the test with READONLY_TESTDATA=false.
+    """
+    raw_url = RAW_SNAPSHOT_URL.format(timestamp, url)
+    return mark.skipif(
+        READONLY_TESTDATA and not (
+            TESTDATA / f'{sha1(raw_url.encode()).hexdigest()}.json'
+        ).exists(),
+        reason=f'not verified against a recording of {raw_url}')
 
 
 def waybackmachine_scr(*args):
     return dict_to_sfn_cit_ref(url_to_dict(*args))
 
 
+HUFFINGTON_URL = (
+    'http://www.huffingtonpost.com/2013/10/19/'
+    'plastic-surgery-justin-bieber-100k_n_4128563.html?'
+    'utm_hp_ref=mostpopular')
+
+
+huffington_recorded = raw_snapshot_recorded(
+    '20131021230444', HUFFINGTON_URL)
+isna_recorded = raw_snapshot_recorded(
+    '20170119050001',
+    'http://www.isna.ir/news/95102918901/'
+    '%D8%B1%D9%88%D8%A7%D9%86%DA%86%DB%8C-%D8%AF%D8%B1-'
+    '%D8%A7%D8%B1%D8%AA%D8%A8%D8%A7%D8%B7-%D8%A8%D8%A7-'
+    '%D9%85%D9%88%D8%A7%D8%B6%D8%B9-'
+    '%D9%86%D8%A7%D9%85%D9%86%D8%A7%D8%B3%D8%A8-'
+    '%D8%A7%D8%AE%DB%8C%D8%B1-'
+    '%D9%85%D9%82%D8%A7%D9%85%D8%A7%D8%AA-'
+    '%D8%A7%D9%86%DA%AF%D9%84%DB%8C%D8%B3%DB%8C-'
+    '%D8%AF%D8%B1-%D9%85%D9%88%D8%B1%D8%AF')
+
+
+@huffington_recorded
 def test_live_og_link():
     """dead-link=no"""
     assert (
@@ -54,6 +97,19 @@ def test_dead_url():
     )[1][:-12]
 
 
+@patch.object(waybackmachine, 'WAYBACK_LIVENESS', 'probe')
+def test_unavailable_original_is_partial():
+    with patch.object(
+        waybackmachine, 'request', side_effect=CircuitOpenError
+    ):
+        d = url_to_dict(
+            'https://web.archive.org/web/20070429193849id_/'
+            'http://www.londondevelopmentcentre.org/page.php?s=1&p=2462')
+    assert d['url-status'] == 'dead'
+    assert d['partial'] is True
+
+
+@isna_recorded
 def test_webless_url():
     """The 'web/ component of the url can be omitted sometimes."""
     o = waybackmachine_scr(
@@ -99,3 +155,89 @@ def test_webless_url():
         '| access-date='
     )
     assert ct in o[1]
+
+
+@huffington_recorded
+def test_raw_snapshot_only():
+    archive_url = (
+        'http://web.archive.org/web/20131021230444/'
+        'http://www.huffingtonpost.com/2013/10/19/'
+        'plastic-surgery-justin-bieber-100k_n_4128563.html?'
+        'utm_hp_ref=mostpopular')
+    with patch.object(urls, 'request', wraps=urls.request) as request:
+        url_to_dict(archive_url)
+    assert [
+        c.args[0] for c in request.call_args_list
+        if 'archive.org' in c.args[0]
+    ] == [archive_url.replace(
+        'http://web.archive.org/web/20131021230444/',
+        'https://web.archive.org/web/20131021230444id_/')]
+
+
+@huffington_recorded
+@patch.object(waybackmachine, 'WAYBACK_LIVENESS', 'probe')
+def test_probe_liveness():
+    with patch.object(
+        waybackmachine, 'request', wraps=waybackmachine.request
+    ) as request:
+        d = url_to_dict(
+            'http://web.archive.org/web/20131021230444/' + HUFFINGTON_URL)
+    assert d['url-status'] == 'live'
+    assert d['title'] == (
+        'LOOK: Bieber Fan Had $100K Worth Of Plastic Surgery To Look Like '
+        'His Idol')
+    # the original page is only probed, never fully downloaded
+    calls = [c for c in request.call_args_list if c.args[0] == HUFFINGTON_URL]
+    assert [
+        c.kwargs.get('method') or ('stream' if c.kwargs.get('stream') else '')
+        for c in calls
+    ] == ['head', 'stream']
+
+
+@huffington_recorded
+@patch.object(waybackmachine, 'WAYBACK_LIVENESS', 'probe')
+def test_local_cdx_index(tmp_path):
+    index = tmp_path / 'index.cdx'
+    index.write_text(
+        ' CDX N b a m s k\n'
+        f'x 20131021230444 {HUFFINGTON_URL} text/html 200 DIGEST1\n'
+        f'x 20150101000000 {HUFFINGTON_URL} text/html 200 DIGEST1\n',
+        encoding='utf8')
+    with patch.object(
+        waybackmachine, 'WAYBACK_CDX_INDEX', str(index)
+    ), patch.object(
+        waybackmachine, 'request', wraps=waybackmachine.request
+    ) as request:
+        d = url_to_dict(
+            'http://web.archive.org/web/20131021230444/' + HUFFINGTON_URL)
+    assert d['url-status'] == 'live'
+    # the HEAD request suffices, no title probe is needed
+    assert [c.kwargs.get('method') for c in request.call_args_list] == [
+        'head']
+
+
+def test_probe_long_head():
+    url = 'https://example.com/a'
+    head = '<html><head><title>T</title><style>'.encode()
+    # PROBE_BYTES falls in the middle of a two-byte character
+    content = head + b'a' * (waybackmachine.PROBE_BYTES - len(head) - 1) \
+        + 'س</style></head>'.encode()
+
+    def request(_, method='get', **__):
+        r = FakeResponse(
+            url, b'', 200, {'content-type': 'text/html'}, 'utf-8')
+        r.iter_content = lambda _: iter((content,))
+        return r
+
+    original_dict = {}
+    with patch.object(waybackmachine, 'request', request):
+        waybackmachine.probe_original(url, '20200101000000', original_dict)
+    assert original_dict['html_title'] == 'T'
+
+    # the original is not dead if the title probe fails
+    original_dict = {}
+    with patch.object(waybackmachine, 'request', request), patch.object(
+        waybackmachine, 'fetch_head', side_effect=ValueError
+    ):
+        waybackmachine.probe_original(url, '20200101000000', original_dict)
+    assert original_dict == {'live': True}